@@ -27,6 +27,8 @@ CREATE TABLE task_interpreter
     name           VARCHAR(255) NOT NULL,
     description    TEXT         NOT NULL,
     has_executable BOOLEAN      NOT NULL,
+    executable_hash VARCHAR(255) NULL,
+    executable_compress_method VARCHAR(255) NOT NULL DEFAULT 'txz',
     type           Type         NOT NULL,
     executable     JSONB        NOT NULL,
     environment    JSONB        NOT NULL
@@ -41,8 +43,13 @@ CREATE TABLE task_template
     name        VARCHAR(255) NOT NULL,
     description TEXT         NOT NULL,
     has_script  BOOLEAN      NOT NULL,
+    script_hash VARCHAR(255) NULL,
+    script_compress_method VARCHAR(255) NOT NULL DEFAULT 'txz',
     arguments   JSONB        NOT NULL,
     environment JSONB        NOT NULL,
+    cpu         INTEGER      NULL,
+    memory      BIGINT       NULL,
+    disk        BIGINT       NULL,
     interpreter INTEGER      NOT NULL REFERENCES task_interpreter (id)
 );
 
@@ -55,9 +62,13 @@ CREATE TABLE task
     name            VARCHAR(255) NOT NULL,
     description     TEXT         NOT NULL,
     has_source_file BOOLEAN      NOT NULL,
+    source_compress_method VARCHAR(255) NOT NULL DEFAULT 'txz',
     arguments       JSONB        NOT NULL,
     environment     JSONB        NOT NULL,
     retry_times     INTEGER      NOT NULL,
+    cpu             INTEGER      NULL,
+    memory          BIGINT       NULL,
+    disk            BIGINT       NULL,
     template        INTEGER      NOT NULL REFERENCES task_template (id)
 );
 
@@ -71,9 +82,27 @@ CREATE TABLE task_run
     status      Status    NOT NULL,
     start_at    TIMESTAMP NULL,
     end_at      TIMESTAMP NULL,
+    spec        JSONB     NULL,
+    metrics     JSONB     NULL,
     task        INTEGER   NOT NULL REFERENCES task (id)
 );
 
+-- 创建索引
+
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+
+CREATE INDEX ix_task_interpreter_active_id ON task_interpreter (id) WHERE is_deleted = false;
+CREATE INDEX ix_task_template_active_id ON task_template (id) WHERE is_deleted = false;
+
+CREATE INDEX ix_task_interpreter_active_name_trgm ON task_interpreter USING gin (name gin_trgm_ops) WHERE is_deleted = false;
+CREATE INDEX ix_task_template_active_name_trgm ON task_template USING gin (name gin_trgm_ops) WHERE is_deleted = false;
+
+CREATE INDEX ix_task_template_interpreter ON task_template (interpreter);
+CREATE INDEX ix_task_by_template ON task (template);
+CREATE INDEX ix_task_run_task_index ON task_run (task, index);
+
+CREATE INDEX ix_task_run_status_create_at ON task_run (status, create_at);
+
 -- 自动更新 modified_at 字段
 
 CREATE OR REPLACE FUNCTION update_modified_at()
@@ -0,0 +1,27 @@
+"""add pack hash
+
+Revision ID: 1834c8257553
+Revises: 383fd5a1b634
+Create Date: 2026-10-16 10:12:41.503217
+
+"""
+from typing import Sequence, Union
+
+import sqlalchemy as sa
+
+from alembic import op
+
+revision: str = "1834c8257553"
+down_revision: Union[str, None] = "383fd5a1b634"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column("task_interpreter", sa.Column("executable_hash", sa.String(length=255), nullable=True))
+    op.add_column("task_template", sa.Column("script_hash", sa.String(length=255), nullable=True))
+
+
+def downgrade() -> None:
+    op.drop_column("task_template", "script_hash")
+    op.drop_column("task_interpreter", "executable_hash")
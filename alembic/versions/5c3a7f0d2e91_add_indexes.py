@@ -0,0 +1,65 @@
+"""add indexes
+
+Revision ID: 5c3a7f0d2e91
+Revises: 9e04c6b2a7d1
+Create Date: 2026-10-16 16:02:45.731254
+
+"""
+
+from typing import Sequence, Union
+
+import sqlalchemy as sa
+
+from alembic import op
+
+revision: str = "5c3a7f0d2e91"
+down_revision: Union[str, None] = "9e04c6b2a7d1"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+NOT_DELETED = sa.text("is_deleted = false")
+
+
+def upgrade() -> None:
+    op.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+
+    # 列表接口按 id 分页，只访问未删除的记录
+    op.create_index("ix_task_interpreter_active_id", "task_interpreter", ["id"], postgresql_where=NOT_DELETED)
+    op.create_index("ix_task_template_active_id", "task_template", ["id"], postgresql_where=NOT_DELETED)
+
+    # 按名称模糊搜索
+    op.create_index(
+        "ix_task_interpreter_active_name_trgm",
+        "task_interpreter",
+        ["name"],
+        postgresql_using="gin",
+        postgresql_ops={"name": "gin_trgm_ops"},
+        postgresql_where=NOT_DELETED,
+    )
+    op.create_index(
+        "ix_task_template_active_name_trgm",
+        "task_template",
+        ["name"],
+        postgresql_using="gin",
+        postgresql_ops={"name": "gin_trgm_ops"},
+        postgresql_where=NOT_DELETED,
+    )
+
+    # 外键
+    op.create_index("ix_task_template_interpreter", "task_template", ["interpreter"])
+    op.create_index("ix_task_by_template", "task", ["template"])
+    op.create_index("ix_task_run_task_index", "task_run", ["task", "index"])
+
+    # 按状态查询运行记录
+    op.create_index("ix_task_run_status_create_at", "task_run", ["status", "create_at"])
+
+
+def downgrade() -> None:
+    op.drop_index("ix_task_run_status_create_at", table_name="task_run")
+    op.drop_index("ix_task_run_task_index", table_name="task_run")
+    op.drop_index("ix_task_by_template", table_name="task")
+    op.drop_index("ix_task_template_interpreter", table_name="task_template")
+    op.drop_index("ix_task_template_active_name_trgm", table_name="task_template")
+    op.drop_index("ix_task_interpreter_active_name_trgm", table_name="task_interpreter")
+    op.drop_index("ix_task_template_active_id", table_name="task_template")
+    op.drop_index("ix_task_interpreter_active_id", table_name="task_interpreter")
@@ -0,0 +1,38 @@
+"""add pack compress method
+
+Revision ID: 9e04c6b2a7d1
+Revises: 1834c8257553
+Create Date: 2026-10-16 14:37:09.118402
+
+"""
+
+from typing import Sequence, Union
+
+import sqlalchemy as sa
+
+from alembic import op
+
+revision: str = "9e04c6b2a7d1"
+down_revision: Union[str, None] = "1834c8257553"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column(
+        "task_interpreter",
+        sa.Column("executable_compress_method", sa.String(length=255), server_default="txz", nullable=False),
+    )
+    op.add_column(
+        "task_template",
+        sa.Column("script_compress_method", sa.String(length=255), server_default="txz", nullable=False),
+    )
+    op.add_column(
+        "task", sa.Column("source_compress_method", sa.String(length=255), server_default="txz", nullable=False)
+    )
+
+
+def downgrade() -> None:
+    op.drop_column("task", "source_compress_method")
+    op.drop_column("task_template", "script_compress_method")
+    op.drop_column("task_interpreter", "executable_compress_method")
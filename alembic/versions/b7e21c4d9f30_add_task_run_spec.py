@@ -0,0 +1,26 @@
+"""add task run spec
+
+Revision ID: b7e21c4d9f30
+Revises: 5c3a7f0d2e91
+Create Date: 2026-10-16 17:25:13.402871
+
+"""
+
+from typing import Sequence, Union
+
+import sqlalchemy as sa
+
+from alembic import op
+
+revision: str = "b7e21c4d9f30"
+down_revision: Union[str, None] = "5c3a7f0d2e91"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column("task_run", sa.Column("spec", sa.JSON(), nullable=True))
+
+
+def downgrade() -> None:
+    op.drop_column("task_run", "spec")
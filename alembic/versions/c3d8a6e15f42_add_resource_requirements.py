@@ -0,0 +1,32 @@
+"""add resource requirements
+
+Revision ID: c3d8a6e15f42
+Revises: b7e21c4d9f30
+Create Date: 2026-10-16 19:02:41.518204
+
+"""
+
+from typing import Sequence, Union
+
+import sqlalchemy as sa
+
+from alembic import op
+
+revision: str = "c3d8a6e15f42"
+down_revision: Union[str, None] = "b7e21c4d9f30"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    for table in ("task_template", "task"):
+        op.add_column(table, sa.Column("cpu", sa.Integer(), nullable=True))
+        op.add_column(table, sa.Column("memory", sa.BigInteger(), nullable=True))
+        op.add_column(table, sa.Column("disk", sa.BigInteger(), nullable=True))
+
+
+def downgrade() -> None:
+    for table in ("task_template", "task"):
+        op.drop_column(table, "disk")
+        op.drop_column(table, "memory")
+        op.drop_column(table, "cpu")
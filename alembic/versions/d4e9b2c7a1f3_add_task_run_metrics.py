@@ -0,0 +1,27 @@
+"""add task run metrics
+
+Revision ID: d4e9b2c7a1f3
+Revises: c3d8a6e15f42
+Create Date: 2026-10-16 21:14:07.835126
+
+"""
+
+from typing import Sequence, Union
+
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+from alembic import op
+
+revision: str = "d4e9b2c7a1f3"
+down_revision: Union[str, None] = "c3d8a6e15f42"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column("task_run", sa.Column("metrics", postgresql.JSONB(), nullable=True))
+
+
+def downgrade() -> None:
+    op.drop_column("task_run", "metrics")
@@ -0,0 +1,117 @@
+# 对比各压缩方式打包目录的吞吐量和压缩率
+#
+# 默认生成类似 BIDS 格式的神经影像数据（int16 的 4D 体数据、JSON 元数据和 TSV 事件文件），
+# 也可以用 --data 指定真实的数据目录。tzst 需要安装 zstandard：pip install zjbs-tasker[zstd]
+# 用法：python benchmark/codec_throughput.py --subjects 4
+import argparse
+import io
+import json
+import math
+import random
+import sys
+import tempfile
+import time
+from array import array
+from pathlib import Path
+
+cwd = Path(__file__).parent.parent.absolute()
+sys.path.append(str(cwd / "src"))
+
+from zjbs_tasker.codec import PACK_COMPRESS_METHODS, open_tar_reader, open_tar_writer  # noqa: E402
+from zjbs_tasker.model import CompressMethod  # noqa: E402
+
+
+# 只统计写入字节数的文件
+class CountingWriter:
+    def __init__(self) -> None:
+        self.size = 0
+        self.buffer = io.BytesIO()
+
+    def write(self, data: bytes) -> int:
+        self.size += len(data)
+        return self.buffer.write(data)
+
+
+def generate_volume(path: Path, shape: tuple[int, int, int, int], rng: random.Random) -> None:
+    x_size, y_size, z_size, t_size = shape
+    # 平滑的“大脑”强度分布，加上随时间变化的信号和高斯噪声
+    base = array("h")
+    for z in range(z_size):
+        for y in range(y_size):
+            for x in range(x_size):
+                r = math.dist((x, y, z), (x_size / 2, y_size / 2, z_size / 2)) / (x_size / 2)
+                base.append(int(1000 * max(0.0, 1 - r * r)))
+    with open(path, "wb") as file:
+        file.write(b"\0" * 352)
+        for t in range(t_size):
+            signal = 20 * math.sin(t / 5)
+            volume = array("h", (int(value + signal + rng.gauss(0, 8)) if value else 0 for value in base))
+            file.write(volume.tobytes())
+
+
+def generate_dataset(root: Path, subjects: int, shape: tuple[int, int, int, int]) -> None:
+    rng = random.Random(0)
+    for subject in range(1, subjects + 1):
+        func_dir = root / f"sub-{subject:02d}" / "func"
+        func_dir.mkdir(parents=True)
+        prefix = f"sub-{subject:02d}_task-rest_bold"
+        generate_volume(func_dir / f"{prefix}.nii", shape, rng)
+        metadata = {"RepetitionTime": 2.0, "EchoTime": 0.03, "SliceTiming": [i * 0.05 for i in range(shape[2])]}
+        (func_dir / f"{prefix}.json").write_text(json.dumps(metadata, indent=2))
+        events = ["onset\tduration\ttrial_type"]
+        events.extend(f"{i * 12.0}\t6.0\t{rng.choice(['left', 'right'])}" for i in range(shape[3] // 6))
+        (func_dir / f"sub-{subject:02d}_task-rest_events.tsv").write_text("\n".join(events))
+
+
+def directory_size(directory: Path) -> int:
+    return sum(path.stat().st_size for path in directory.rglob("*") if path.is_file())
+
+
+def run_benchmark(data_dir: Path, compress_method: CompressMethod) -> dict:
+    raw_size = directory_size(data_dir)
+
+    writer = CountingWriter()
+    start = time.perf_counter()
+    with open_tar_writer(writer, compress_method) as tar_file:
+        tar_file.add(data_dir, arcname="data")
+    compress_seconds = time.perf_counter() - start
+
+    writer.buffer.seek(0)
+    start = time.perf_counter()
+    with open_tar_reader(writer.buffer, compress_method) as tar_file:
+        for member in tar_file:
+            if member.isreg():
+                tar_file.extractfile(member).read()
+    decompress_seconds = time.perf_counter() - start
+
+    return {
+        "compress_method": str(compress_method),
+        "raw_bytes": raw_size,
+        "packed_bytes": writer.size,
+        "ratio": round(raw_size / writer.size, 3),
+        "compress_mb_per_second": round(raw_size / compress_seconds / 1e6, 2),
+        "decompress_mb_per_second": round(raw_size / decompress_seconds / 1e6, 2),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="archive codec benchmark")
+    parser.add_argument("--data", type=Path, help="要打包的数据目录，不指定时生成合成数据")
+    parser.add_argument("--subjects", type=int, default=2, help="合成数据的被试数量")
+    parser.add_argument("--shape", type=int, nargs=4, default=[64, 64, 36, 60], help="合成体数据的 X Y Z T")
+    parser.add_argument(
+        "--methods", nargs="+", default=[str(method) for method in sorted(PACK_COMPRESS_METHODS)], help="压缩方式"
+    )
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        data_dir = args.data
+        if data_dir is None:
+            data_dir = Path(temp_dir) / "data"
+            generate_dataset(data_dir, args.subjects, tuple(args.shape))
+        results = [run_benchmark(data_dir, CompressMethod(method)) for method in args.methods]
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
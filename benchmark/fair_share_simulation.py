@@ -0,0 +1,146 @@
+# 模拟混合负载下各提交者的排队等待时间，对比 FIFO 和 FairQueue 的加权轮转
+#
+# 一个提交者在开始时提交大量任务运行（参数扫描），其他提交者周期性地提交少量任务运行，
+# 可选一个提交者以更高的优先级提交。调度逻辑与 FairQueue 的出队脚本一致，不需要 Redis。
+# 用法：python benchmark/fair_share_simulation.py --sweep 10000 --workers 32
+import argparse
+import heapq
+import json
+import random
+import statistics
+from collections import defaultdict, deque
+
+
+class FifoScheduler:
+    def __init__(self) -> None:
+        self.jobs: deque = deque()
+
+    def push(self, job: tuple, priority: int, share: str, weight: int) -> None:
+        self.jobs.append(job)
+
+    def pop(self) -> tuple:
+        return self.jobs.popleft()
+
+    def empty(self) -> bool:
+        return not self.jobs
+
+
+# 与 fair_queue.POP_SCRIPT 相同：最高优先级中，轮转队列头部的份额连续出队 weight 个作业后移到末尾
+class FairScheduler:
+    def __init__(self) -> None:
+        self.jobs: dict[tuple[int, str], deque] = defaultdict(deque)
+        self.rings: dict[int, deque] = defaultdict(deque)
+        self.credit: dict[tuple[int, str], int] = {}
+        self.weight: dict[tuple[int, str], int] = {}
+
+    def push(self, job: tuple, priority: int, share: str, weight: int) -> None:
+        jobs = self.jobs[priority, share]
+        jobs.append(job)
+        if len(jobs) == 1:
+            self.rings[priority].append(share)
+            self.credit[priority, share] = weight
+        self.weight[priority, share] = weight
+
+    def pop(self) -> tuple:
+        priority = max(self.rings)
+        ring = self.rings[priority]
+        share = ring[0]
+        jobs = self.jobs[priority, share]
+        job = jobs.popleft()
+        if not jobs:
+            ring.popleft()
+            del self.credit[priority, share]
+            if not ring:
+                del self.rings[priority]
+        else:
+            self.credit[priority, share] -= 1
+            if self.credit[priority, share] <= 0:
+                ring.rotate(-1)
+                self.credit[priority, share] = self.weight[priority, share]
+        return job
+
+    def empty(self) -> bool:
+        return not self.rings
+
+
+def percentile(values: list[float], q: float) -> float:
+    values = sorted(values)
+    return values[min(int(q * len(values)), len(values) - 1)]
+
+
+def simulate(scheduler: FifoScheduler | FairScheduler, args: argparse.Namespace) -> dict[str, dict]:
+    rng = random.Random(args.seed)
+    # (到达时间, 序号, 提交者, 优先级)
+    arrivals = [(0.0, i, "sweep", 0) for i in range(args.sweep)]
+    for submitter in range(args.submitters):
+        t = rng.uniform(0, args.interval)
+        while t < args.duration:
+            arrivals.extend((t, len(arrivals), f"user{submitter}", 0) for _ in range(args.batch))
+            t += rng.expovariate(1 / args.interval)
+    if args.urgent_interval > 0:
+        t = args.urgent_interval
+        while t < args.duration:
+            arrivals.append((t, len(arrivals), "urgent", 10))
+            t += args.urgent_interval
+    arrivals.sort()
+
+    weights = {"sweep": args.sweep_weight}
+    free_at = [0.0] * args.workers
+    waits: dict[str, list[float]] = defaultdict(list)
+    i = 0
+    while i < len(arrivals) or not scheduler.empty():
+        now = heapq.heappop(free_at)
+        # 队列为空时空闲的工作进程等到下一个作业到达
+        if scheduler.empty():
+            now = max(now, arrivals[i][0])
+        while i < len(arrivals) and arrivals[i][0] <= now:
+            arrived, _, submitter, priority = arrivals[i]
+            scheduler.push((arrived, submitter), priority, submitter, weights.get(submitter, 1))
+            i += 1
+        arrived, submitter = scheduler.pop()
+        waits[submitter].append(now - arrived)
+        heapq.heappush(free_at, now + rng.uniform(args.run_seconds * 0.5, args.run_seconds * 1.5))
+
+    return {
+        submitter: {
+            "runs": len(values),
+            "wait_p50_seconds": round(statistics.median(values), 1),
+            "wait_p95_seconds": round(percentile(values, 0.95), 1),
+            "wait_max_seconds": round(max(values), 1),
+        }
+        for submitter, values in sorted(waits.items())
+    }
+
+
+def summarize(results: dict[str, dict]) -> dict[str, float]:
+    small = [result for submitter, result in results.items() if submitter.startswith("user")]
+    return {
+        "small_submitters_wait_p95_seconds": max((result["wait_p95_seconds"] for result in small), default=0.0),
+        "urgent_wait_max_seconds": results.get("urgent", {}).get("wait_max_seconds", 0.0),
+        "sweep_wait_max_seconds": results.get("sweep", {}).get("wait_max_seconds", 0.0),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="fair-share scheduling simulation")
+    parser.add_argument("--sweep", type=int, default=10000, help="参数扫描提交者在开始时提交的任务运行数")
+    parser.add_argument("--sweep-weight", type=int, default=1, help="参数扫描提交者的权重")
+    parser.add_argument("--submitters", type=int, default=8, help="周期性提交少量任务运行的提交者数")
+    parser.add_argument("--batch", type=int, default=5, help="每次提交的任务运行数")
+    parser.add_argument("--interval", type=float, default=600, help="每个提交者平均提交间隔（秒）")
+    parser.add_argument("--urgent-interval", type=float, default=1800, help="高优先级提交间隔（秒），0 表示不提交")
+    parser.add_argument("--duration", type=float, default=4 * 3600, help="提交持续时间（秒）")
+    parser.add_argument("--workers", type=int, default=32, help="工作进程数")
+    parser.add_argument("--run-seconds", type=float, default=60, help="任务运行的平均时间（秒）")
+    parser.add_argument("--seed", type=int, default=0, help="随机数种子")
+    args = parser.parse_args()
+
+    results = {}
+    for name, scheduler in (("fifo", FifoScheduler()), ("fair", FairScheduler())):
+        submitters = simulate(scheduler, args)
+        results[name] = {"summary": summarize(submitters), "submitters": submitters}
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,302 @@
+# 离线的热点路径微基准：打包、解压、上传时转换压缩包和构造任务命令行
+#
+# 生成与平台数据形状相似的合成数据集：大量小文件（tiny）、少数大文件（huge）和深层目录树（deep），
+# 测量 compress_directory、decompress_file、upload_file（文件服务器替换为只读取请求体的传输层）、
+# build_command 和 build_environment 的吞吐量和峰值内存。不需要数据库、Redis 和文件服务器。
+# 每个用例在新的进程中运行，峰值内存为该进程的最大 RSS。结果以 JSON 输出，用 --baseline 与之前的结果比较，
+# 吞吐量下降或峰值内存增长超过 --tolerance 时返回 1。tzst 需要安装 zstandard：pip install zjbs-tasker[zstd]
+# 用法：python benchmark/hot_paths.py --output hot_paths.json
+#       python benchmark/hot_paths.py --quick --baseline hot_paths.json
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from multiprocessing import get_context
+from pathlib import Path
+from typing import Any
+
+cwd = Path(__file__).parent.parent.absolute()
+sys.path.append(str(cwd / "src"))
+
+import httpx  # noqa: E402
+from zjbs_file_client import async_client as file_client_module  # noqa: E402
+
+from zjbs_tasker import worker  # noqa: E402
+from zjbs_tasker.artifact import directory_size  # noqa: E402
+from zjbs_tasker.codec import FILE_SUFFIXES  # noqa: E402
+from zjbs_tasker.model import ArtifactSpec, CompressMethod, ExecutionSpec  # noqa: E402
+from zjbs_tasker.util import compress_directory, decompress_file, upload_file  # noqa: E402
+
+MiB = 1024 * 1024
+
+# 比较结果时使用的吞吐量指标
+THROUGHPUT_KEYS: tuple[str, ...] = ("mb_per_second", "ops_per_second")
+
+
+# 大量小文件：事件表、JSON 元数据等，每个目录 1000 个
+def generate_tiny(root: Path, files: int) -> None:
+    rng = random.Random(0)
+    for i in range(files):
+        directory = root / f"sub-{i // 1000:03d}"
+        if i % 1000 == 0:
+            directory.mkdir(parents=True)
+        rows = [f"{rng.uniform(0, 600):.2f}\t{rng.uniform(0.5, 6):.2f}\t{rng.choice(['left', 'right'])}"]
+        rows.extend(rows[0] for _ in range(rng.randint(0, 10)))
+        (directory / f"events-{i:06d}.tsv").write_text("onset\tduration\ttrial_type\n" + "\n".join(rows))
+
+
+# 少数大文件：一半随机数据、一半重复数据，压缩率与体数据接近
+def generate_huge(root: Path, files: int, size: int) -> None:
+    root.mkdir(parents=True)
+    pattern = bytes(range(256)) * (MiB // 2 // 256)
+    for i in range(files):
+        with open(root / f"bold-{i}.nii", "wb") as file:
+            for _ in range(size // MiB):
+                file.write(os.urandom(MiB // 2))
+                file.write(pattern)
+
+
+# 深层目录树：每层一个目录和一个小文件
+def generate_deep(root: Path, trees: int, depth: int) -> None:
+    for tree in range(trees):
+        directory = root / f"tree-{tree:03d}"
+        for level in range(depth):
+            directory = directory / f"level-{level:02d}"
+            directory.mkdir(parents=True)
+            (directory / "meta.json").write_text(json.dumps({"tree": tree, "level": level}))
+
+
+# 只读取请求体的文件服务器
+class DrainTransport(httpx.AsyncBaseTransport):
+    def __init__(self) -> None:
+        self.bytes_received = 0
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        async for chunk in request.stream:
+            self.bytes_received += len(chunk)
+        return httpx.Response(200, json=None)
+
+
+async def upload_pack(pack: Path, compress_method: CompressMethod, store_method: CompressMethod) -> int:
+    transport = DrainTransport()
+    file_client_module.client = httpx.AsyncClient(transport=transport, base_url="http://file-server")
+    try:
+        with open(pack, "rb") as file:
+            await upload_file(file, pack.name, compress_method, "/benchmark", "data", store_method)
+    finally:
+        await file_client_module.client.aclose()
+        file_client_module.client = None
+    return transport.bytes_received
+
+
+def benchmark_spec() -> ExecutionSpec:
+    return ExecutionSpec(
+        task_id=1,
+        task_name="benchmark",
+        index=1,
+        interpreter=ArtifactSpec(
+            cache_key="interpreter/1_0123abcd", server_path="/i", compress_method=CompressMethod.txz, wrapper="*"
+        ),
+        template=ArtifactSpec(
+            cache_key="template/1_4567cdef", server_path="/t", compress_method=CompressMethod.txz, wrapper="*"
+        ),
+        command=["run.sh", "--subject", "sub-01", "--output", "results"],
+        environment={f"PARAMETER_{i}": str(i) for i in range(50)},
+    )
+
+
+def max_rss_bytes() -> int:
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+# 在子进程中运行一个用例，重复 repeat 次取最短时间
+def run_case(params: dict[str, Any]) -> dict[str, Any]:
+    case, work_dir = params["case"], Path(params["work_dir"])
+    baseline_rss = max_rss_bytes()
+    result: dict[str, Any] = {"case": case, "dataset": params["dataset"], "method": params["method"]}
+    best = float("inf")
+
+    if case in ("build_command", "build_environment"):
+        worker.artifact_cache.root = work_dir / "cache"
+        spec = benchmark_spec()
+        # 可执行文件在模板目录中，需要先后检查解释器和模板目录
+        template_dir = worker.artifact_cache.path(spec.template.cache_key)
+        template_dir.mkdir(parents=True, exist_ok=True)
+        (template_dir / spec.command[0]).touch()
+        run_dir = work_dir / "run_1"
+        iterations = params["iterations"]
+        for _ in range(params["repeat"]):
+            start = time.perf_counter()
+            if case == "build_command":
+                for _ in range(iterations):
+                    worker.build_command(spec)
+            else:
+                for _ in range(iterations):
+                    worker.build_environment(spec, run_dir)
+            best = min(best, time.perf_counter() - start)
+        result.update(
+            iterations=iterations,
+            ops_per_second=round(iterations / best, 1),
+            microseconds_per_op=round(best / iterations * 1e6, 3),
+        )
+    else:
+        method = CompressMethod(params["method"])
+        data_dir = Path(params["data_dir"])
+        pack = work_dir / f"{params['dataset']}{FILE_SUFFIXES[method]}"
+        for _ in range(params["repeat"]):
+            target = work_dir / "extract"
+            start = time.perf_counter()
+            match case:
+                case "compress_directory":
+                    compress_directory(data_dir, work_dir, arcname=params["dataset"], compress_method=method)
+                    result["packed_bytes"] = pack.stat().st_size
+                case "decompress_file":
+                    decompress_file(pack, method, target)
+                case "upload_file":
+                    store_method = CompressMethod(params["store_method"])
+                    result["store_method"] = str(store_method)
+                    result["uploaded_bytes"] = asyncio.run(upload_pack(pack, method, store_method))
+            best = min(best, time.perf_counter() - start)
+            shutil.rmtree(target, ignore_errors=True)
+        result.update(
+            files=params["files"],
+            raw_bytes=params["raw_bytes"],
+            seconds=round(best, 3),
+            mb_per_second=round(params["raw_bytes"] / best / 1e6, 2),
+            files_per_second=round(params["files"] / best, 1),
+        )
+
+    peak_rss = max_rss_bytes()
+    result.update(peak_rss_bytes=peak_rss, rss_growth_bytes=peak_rss - baseline_rss)
+    return result
+
+
+# 每个用例使用新的进程，使最大 RSS 只反映该用例
+def run_in_process(params: dict[str, Any]) -> dict[str, Any]:
+    with ProcessPoolExecutor(max_workers=1, mp_context=get_context("spawn")) as executor:
+        return executor.submit(run_case, params).result()
+
+
+def result_key(result: dict[str, Any]) -> tuple:
+    return result["case"], result["dataset"], result["method"], result.get("store_method")
+
+
+# 与基准结果比较，返回超过容差的退化
+def compare(results: list[dict[str, Any]], baseline: list[dict[str, Any]], tolerance: float) -> list[dict[str, Any]]:
+    baseline_by_key = {result_key(result): result for result in baseline}
+    regressions = []
+    for result in results:
+        old = baseline_by_key.get(result_key(result))
+        if old is None:
+            continue
+        for key in THROUGHPUT_KEYS:
+            if key in result and key in old and result[key] < old[key] * (1 - tolerance):
+                regressions.append({"key": result_key(result), "metric": key, "old": old[key], "new": result[key]})
+        if result["peak_rss_bytes"] > old["peak_rss_bytes"] * (1 + tolerance):
+            regressions.append(
+                {
+                    "key": result_key(result),
+                    "metric": "peak_rss_bytes",
+                    "old": old["peak_rss_bytes"],
+                    "new": result["peak_rss_bytes"],
+                }
+            )
+    return regressions
+
+
+def git_commit() -> str | None:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"], cwd=cwd, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="offline hot path micro-benchmarks")
+    parser.add_argument("--tiny-files", type=int, default=100000, help="tiny 数据集的文件数")
+    parser.add_argument("--huge-files", type=int, default=2, help="huge 数据集的文件数")
+    parser.add_argument("--huge-size", type=int, default=512, help="huge 数据集每个文件的大小（MiB）")
+    parser.add_argument("--deep-trees", type=int, default=200, help="deep 数据集的目录树数量")
+    parser.add_argument("--deep-depth", type=int, default=40, help="deep 数据集每棵目录树的深度")
+    parser.add_argument("--datasets", nargs="+", default=["tiny", "huge", "deep"], help="运行的数据集")
+    parser.add_argument("--methods", nargs="+", default=["tar", "tgz"], help="压缩方式")
+    parser.add_argument("--store-method", default="txz", help="上传时转换为的压缩方式")
+    parser.add_argument("--iterations", type=int, default=100000, help="构造命令行和环境变量的循环次数")
+    parser.add_argument("--repeat", type=int, default=1, help="每个用例重复的次数，取最短时间")
+    parser.add_argument("--quick", action="store_true", help="使用小数据集快速检查")
+    parser.add_argument("--work-dir", type=Path, help="生成数据集和压缩包的目录，默认为临时目录")
+    parser.add_argument("--output", type=Path, help="把结果写入 JSON 文件")
+    parser.add_argument("--baseline", type=Path, help="与之前的结果文件比较")
+    parser.add_argument("--tolerance", type=float, default=0.1, help="允许的退化比例")
+    args = parser.parse_args()
+    if args.quick:
+        args.tiny_files, args.huge_size, args.deep_trees, args.iterations = 2000, 16, 20, 10000
+
+    report: dict[str, Any] = {
+        "commit": git_commit(),
+        "time": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "arguments": {key: str(value) for key, value in vars(args).items()},
+        "results": [],
+    }
+    with tempfile.TemporaryDirectory(dir=args.work_dir) as temp_dir:
+        work_dir = Path(temp_dir)
+        generators = {
+            "tiny": lambda root: generate_tiny(root, args.tiny_files),
+            "huge": lambda root: generate_huge(root, args.huge_files, args.huge_size * MiB),
+            "deep": lambda root: generate_deep(root, args.deep_trees, args.deep_depth),
+        }
+        for dataset in args.datasets:
+            data_dir = work_dir / "data" / dataset
+            generators[dataset](data_dir)
+            params = {
+                "dataset": dataset,
+                "data_dir": str(data_dir),
+                "work_dir": str(work_dir),
+                "files": sum(1 for path in data_dir.rglob("*") if path.is_file()),
+                "raw_bytes": directory_size(data_dir),
+                "repeat": args.repeat,
+            }
+            for method in args.methods:
+                # 先打包，解压和上传使用打包的结果
+                for case in ("compress_directory", "decompress_file", "upload_file"):
+                    result = run_in_process({**params, "case": case, "method": method, "store_method": method})
+                    report["results"].append(result)
+                if args.store_method != method:
+                    result = run_in_process(
+                        {**params, "case": "upload_file", "method": method, "store_method": args.store_method}
+                    )
+                    report["results"].append(result)
+            shutil.rmtree(data_dir)
+        for case in ("build_command", "build_environment"):
+            params = {"case": case, "dataset": "-", "method": "-", "work_dir": str(work_dir)}
+            report["results"].append(run_in_process({**params, "iterations": args.iterations, "repeat": args.repeat}))
+
+    exit_code = 0
+    if args.baseline is not None:
+        baseline = json.loads(args.baseline.read_text(encoding="utf-8"))
+        report["baseline_commit"] = baseline.get("commit")
+        report["regressions"] = compare(report["results"], baseline["results"], args.tolerance)
+        exit_code = 1 if report["regressions"] else 0
+    if args.output is not None:
+        args.output.write_text(json.dumps(report, indent=2), encoding="utf-8")
+    print(json.dumps(report, indent=2))
+    sys.exit(exit_code)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,578 @@
+# 端到端负载测试：通过真实的 API 服务器和工作进程按指定的速率开始任务，
+# 测量吞吐量、从提交到开始的延迟、排队等待、各阶段耗时和工作进程利用率
+#
+# 所有依赖都在本机启动，不需要 deploy/dev.docker-compose.yaml：
+# - 文件服务器：本脚本的 serve-files 子命令，文件保存在本地目录中，实现了 zjbs_file_client 使用的接口
+# - Redis：PATH 中有 redis-server 时启动临时实例，否则启动 fakeredis 的 TCP 服务器（pip install fakeredis[lua]），
+#   也可以用 --redis-host-port 指定
+# - PostgreSQL：PATH 或 --pg-bin 中有 initdb 和 postgres 时创建临时实例，否则用 --database-url 指定，该数据库会被清空
+#   （PostgreSQL 不能以 root 运行，以 root 运行本脚本时需要使用 --database-url）
+# 然后启动 API 服务器和 --workers 个工作进程，通过 API 创建解释器和模板、上传模板脚本，在数据库中创建任务，
+# 以 --rate 的速率调用 StartTask。所有任务运行结束后从数据库读取开始时间和 TaskRunMetrics，
+# 工作进程的利用率来自运行期间定期读取的工作进程 Prometheus 指标。各进程的日志在工作目录的 log 中
+# 用法：python benchmark/load_test.py run --rate 20 --duration 60 --workers 4 --slots 4
+import argparse
+import asyncio
+import io
+import json
+import os
+import random
+import shutil
+import signal
+import socket
+import statistics
+import subprocess
+import sys
+import tarfile
+import tempfile
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import Any
+
+import asyncpg
+import httpx
+import uvicorn
+from fastapi import FastAPI, HTTPException, UploadFile
+from fastapi.responses import FileResponse, PlainTextResponse
+from prometheus_client.parser import text_string_to_metric_families
+
+cwd = Path(__file__).parent.parent.absolute()
+
+# 模板脚本：参数为运行时间（秒）和输出文件的大小（字节）
+RUN_SCRIPT: bytes = b"""#!/bin/sh
+sleep "$1"
+head -c "$2" /dev/zero > "$OUTPUT_DIR/output.bin"
+echo "done"
+"""
+
+
+# 本地目录中的文件服务器，实现 zjbs_file_client 和 tasker 使用的接口。上传时总是覆盖已有的文件
+def file_server_app(root: Path) -> FastAPI:
+    root = root.resolve()
+    app = FastAPI()
+
+    def local_path(path: str) -> Path:
+        resolved = (root / path.lstrip("/")).resolve()
+        if resolved != root and root not in resolved.parents:
+            raise HTTPException(status_code=400, detail=f"invalid path {path}")
+        return resolved
+
+    def save(file: Any, target: Path) -> None:
+        temp_path = target.with_name(f".{target.name}.uploading")
+        with open(temp_path, "wb") as target_file:
+            shutil.copyfileobj(file, target_file, 1024 * 1024)
+        temp_path.rename(target)
+
+    def extract(file: Any, target_dir: Path) -> None:
+        with tarfile.open(fileobj=file, mode="r:*") as tar_file:
+            tar_file.extractall(target_dir, filter="data")
+
+    @app.post("/upload-file")
+    async def upload_file(directory: str, file: UploadFile, mkdir: bool = False) -> None:
+        target_dir = local_path(directory)
+        if mkdir:
+            target_dir.mkdir(parents=True, exist_ok=True)
+        await asyncio.to_thread(save, file.file, target_dir / file.filename)
+
+    @app.post("/upload-directory")
+    async def upload_directory(parent_dir: str, compressed_dir: UploadFile, mkdir: bool = False) -> None:
+        target_dir = local_path(parent_dir)
+        if mkdir:
+            target_dir.mkdir(parents=True, exist_ok=True)
+        await asyncio.to_thread(extract, compressed_dir.file, target_dir)
+
+    @app.post("/download-file")
+    async def download_file(path: str) -> FileResponse:
+        local = local_path(path)
+        if not local.is_file():
+            raise HTTPException(status_code=404, detail=f"{path} not found")
+        return FileResponse(local)
+
+    @app.post("/delete")
+    async def delete(path: str, recursive: bool = False) -> PlainTextResponse:
+        local = local_path(path)
+        if local.is_dir() and recursive:
+            await asyncio.to_thread(shutil.rmtree, local)
+        elif local.is_file():
+            local.unlink()
+        else:
+            return PlainTextResponse("")
+        return PlainTextResponse("true")
+
+    @app.post("/list-directory")
+    async def list_directory(directory: str) -> list[dict[str, Any]]:
+        local = local_path(directory)
+        if not local.is_dir():
+            raise HTTPException(status_code=404, detail=f"{directory} not found")
+        return [
+            {
+                "type": "directory" if child.is_dir() else "file",
+                "name": child.name,
+                "last_modified": datetime.fromtimestamp(child.stat().st_mtime).isoformat(),
+                "size": None if child.is_dir() else child.stat().st_size,
+            }
+            for child in local.iterdir()
+        ]
+
+    @app.post("/rename")
+    async def rename(path: str, new_name: str) -> None:
+        local = local_path(path)
+        local.rename(local.with_name(new_name))
+
+    return app
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+async def wait_for_port(port: int, process: subprocess.Popen, timeout: float = 60) -> None:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"process {process.args} exited with {process.returncode}")
+        try:
+            _, writer = await asyncio.open_connection("127.0.0.1", port)
+            writer.close()
+            return
+        except OSError:
+            await asyncio.sleep(0.2)
+    raise TimeoutError(f"port {port} is not ready after {timeout} seconds")
+
+
+# 负载测试启动的进程，按启动的相反顺序停止
+class Stack:
+    def __init__(self, root: Path) -> None:
+        self.root = root
+        self.log_dir = root / "log"
+        self.log_dir.mkdir(parents=True, exist_ok=True)
+        self.processes: list[tuple[str, subprocess.Popen, signal.Signals]] = []
+
+    def spawn(
+        self, name: str, args: list[Any], env: dict[str, str] | None = None, stop_signal=signal.SIGTERM
+    ) -> subprocess.Popen:
+        with open(self.log_dir / f"{name}.log", "wb") as log_file:
+            process = subprocess.Popen(
+                [str(arg) for arg in args], env=env, stdout=log_file, stderr=subprocess.STDOUT, cwd=cwd
+            )
+        self.processes.append((name, process, stop_signal))
+        return process
+
+    def stop(self) -> None:
+        for name, process, stop_signal in reversed(self.processes):
+            if process.poll() is None:
+                process.send_signal(stop_signal)
+                try:
+                    process.wait(timeout=30)
+                except subprocess.TimeoutExpired:
+                    print(f"{name} did not stop in 30 seconds, kill it", file=sys.stderr)
+                    process.kill()
+                    process.wait()
+
+
+async def start_postgres(stack: Stack, pg_bin: Path | None) -> str:
+    path = str(pg_bin) if pg_bin is not None else None
+    initdb, postgres = shutil.which("initdb", path=path), shutil.which("postgres", path=path)
+    if initdb is None or postgres is None:
+        raise RuntimeError("initdb and postgres are not found, use --pg-bin or --database-url")
+    data_dir = stack.root / "postgres"
+    subprocess.run(
+        [initdb, "-D", str(data_dir), "-U", "tasker", "--auth=trust", "-E", "UTF8"], check=True, capture_output=True
+    )
+    port = free_port()
+    # SIGINT 为快速关闭，不等待客户端断开
+    process = stack.spawn(
+        "postgres",
+        [postgres, "-D", data_dir, "-p", port, "-k", data_dir, "-c", "listen_addresses=127.0.0.1"],
+        stop_signal=signal.SIGINT,
+    )
+    await wait_for_port(port, process)
+    for _ in range(50):
+        try:
+            connection = await asyncpg.connect(f"postgresql://tasker@127.0.0.1:{port}/postgres")
+            break
+        except asyncpg.CannotConnectNowError:
+            await asyncio.sleep(0.2)
+    else:
+        raise TimeoutError("postgres is not accepting connections")
+    try:
+        await connection.execute('CREATE DATABASE "zjbs-tasker"')
+    finally:
+        await connection.close()
+    return f"postgresql://tasker@127.0.0.1:{port}/zjbs-tasker"
+
+
+async def start_redis(stack: Stack) -> str:
+    port = free_port()
+    redis_server = shutil.which("redis-server")
+    if redis_server is not None:
+        args = [redis_server, "--port", port, "--bind", "127.0.0.1", "--save", "", "--appendonly", "no"]
+    else:
+        args = [sys.executable, __file__, "serve-redis", "--port", port]
+    await wait_for_port(port, stack.spawn("redis", args))
+    return f"127.0.0.1:{port}"
+
+
+async def create_schema(database_url: str) -> None:
+    connection = await asyncpg.connect(database_url)
+    try:
+        await connection.execute((cwd / "alembic" / "sql" / "create_all.sql").read_text(encoding="utf-8"))
+    finally:
+        await connection.close()
+
+
+async def wait_for_http(client: httpx.AsyncClient, url: str, process: subprocess.Popen, timeout: float = 60) -> None:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"process {process.args} exited with {process.returncode}")
+        try:
+            if (await client.get(url)).status_code == 200:
+                return
+        except httpx.TransportError:
+            pass
+        await asyncio.sleep(0.2)
+    raise TimeoutError(f"{url} is not ready after {timeout} seconds")
+
+
+def run_script_pack() -> bytes:
+    buffer = io.BytesIO()
+    with tarfile.open(fileobj=buffer, mode="w:gz") as tar_file:
+        member = tarfile.TarInfo("run.sh")
+        member.size, member.mode, member.mtime = len(RUN_SCRIPT), 0o755, int(time.time())
+        tar_file.addfile(member, io.BytesIO(RUN_SCRIPT))
+    return buffer.getvalue()
+
+
+# 通过 API 创建解释器和模板并上传模板脚本，任务直接插入数据库
+async def create_tasks(client: httpx.AsyncClient, database_url: str, args: argparse.Namespace) -> list[int]:
+    response = await client.post(
+        "/CreateTaskInterpreter",
+        json={"name": "load-test", "description": "", "type": "executable", "executable": [], "environment": {}},
+    )
+    response.raise_for_status()
+    response = await client.post(
+        "/CreateTaskTemplate",
+        json={
+            "interpreter": response.json()["id"],
+            "name": "load-test",
+            "description": "",
+            "arguments": ["run.sh"],
+            "environment": {},
+            "cpu": args.task_cpu,
+        },
+    )
+    response.raise_for_status()
+    template_id = response.json()["id"]
+    response = await client.post(
+        "/UploadTaskTemplateScript",
+        data={"id": template_id, "compress_method": "tgz"},
+        files={"file": ("run.tar.gz", run_script_pack(), "application/octet-stream")},
+    )
+    response.raise_for_status()
+
+    connection = await asyncpg.connect(database_url)
+    try:
+        rows = await connection.fetch(
+            "INSERT INTO task (name, description, has_source_file, arguments, environment, retry_times, template) "
+            "SELECT 'load-test-' || i, '', false, $1::jsonb, '{}'::jsonb, 0, $2 FROM generate_series(1, $3) AS i "
+            "RETURNING id",
+            json.dumps([str(args.run_seconds), str(args.output_bytes)]),
+            template_id,
+            args.tasks,
+        )
+    finally:
+        await connection.close()
+    return [row["id"] for row in rows]
+
+
+# 按速率调用 StartTask，同一个任务同时只有一个请求，保证序号不重复
+async def drive(client: httpx.AsyncClient, task_ids: list[int], args: argparse.Namespace) -> list[dict[str, Any]]:
+    rng = random.Random(args.seed)
+    locks = {task_id: asyncio.Lock() for task_id in task_ids}
+    submissions: list[dict[str, Any]] = []
+
+    async def submit(i: int) -> None:
+        task_id = task_ids[i % len(task_ids)]
+        async with locks[task_id]:
+            submission = {"task_id": task_id, "submitted_at": datetime.now()}
+            start = time.perf_counter()
+            try:
+                response = await client.post(
+                    "/StartTask", json=task_id, params={"owner": f"user{i % args.owners}"}, timeout=60
+                )
+                response.raise_for_status()
+                submission["task_run_id"] = response.json()["task_run_id"]
+            except httpx.HTTPError as e:
+                submission["error"] = str(e) or type(e).__name__
+            submission["api_seconds"] = time.perf_counter() - start
+            submissions.append(submission)
+
+    total = int(args.rate * args.duration)
+    start = time.monotonic()
+    offset = 0.0
+    tasks = []
+    for i in range(total):
+        offset += rng.expovariate(args.rate) if args.poisson else 1 / args.rate
+        await asyncio.sleep(max(start + offset - time.monotonic(), 0))
+        tasks.append(asyncio.create_task(submit(i)))
+    await asyncio.gather(*tasks)
+    return submissions
+
+
+# 定期读取工作进程的 Prometheus 指标，记录正在执行的任务运行数和执行槽数
+async def sample_utilisation(
+    client: httpx.AsyncClient, metrics_ports: list[int], interval: float, samples: list[tuple[datetime, float, float]]
+) -> None:
+    while True:
+        busy, slots = 0.0, 0.0
+        for port in metrics_ports:
+            try:
+                text = (await client.get(f"http://127.0.0.1:{port}/metrics")).text
+            except httpx.HTTPError:
+                continue
+            for family in text_string_to_metric_families(text):
+                if family.name == "tasker_worker_busy_slots":
+                    busy += sum(sample.value for sample in family.samples)
+                elif family.name == "tasker_worker_slots":
+                    slots += sum(sample.value for sample in family.samples)
+        samples.append((datetime.now(), busy, slots))
+        await asyncio.sleep(interval)
+
+
+async def wait_for_runs(database_url: str, task_run_ids: list[int], timeout: float) -> None:
+    connection = await asyncpg.connect(database_url)
+    try:
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            active = await connection.fetchval(
+                "SELECT count(*) FROM task_run WHERE id = ANY($1::int[]) AND status IN ('pending', 'running')",
+                task_run_ids,
+            )
+            if active == 0:
+                return
+            await asyncio.sleep(1)
+        print(f"{active} task runs are still active after {timeout} seconds", file=sys.stderr)
+    finally:
+        await connection.close()
+
+
+def percentile(values: list[float], q: float) -> float:
+    values = sorted(values)
+    return values[min(int(q * len(values)), len(values) - 1)]
+
+
+def summarize(values: list[float]) -> dict[str, float] | None:
+    if not values:
+        return None
+    return {
+        "count": len(values),
+        "mean": round(statistics.fmean(values), 4),
+        "p50": round(percentile(values, 0.5), 4),
+        "p99": round(percentile(values, 0.99), 4),
+        "max": round(max(values), 4),
+    }
+
+
+async def collect_report(
+    database_url: str,
+    submissions: list[dict[str, Any]],
+    samples: list[tuple[datetime, float, float]],
+    args: argparse.Namespace,
+) -> dict[str, Any]:
+    submitted = {submission["task_run_id"]: submission for submission in submissions if "task_run_id" in submission}
+    connection = await asyncpg.connect(database_url)
+    try:
+        rows = await connection.fetch(
+            "SELECT id, status, start_at, end_at, metrics FROM task_run WHERE id = ANY($1::int[])", list(submitted)
+        )
+    finally:
+        await connection.close()
+
+    statuses: dict[str, int] = {}
+    submit_to_start, run_seconds, queue_waits = [], [], []
+    phases: dict[str, list[float]] = {}
+    for row in rows:
+        statuses[row["status"]] = statuses.get(row["status"], 0) + 1
+        if row["start_at"] is not None:
+            submit_to_start.append((row["start_at"] - submitted[row["id"]]["submitted_at"]).total_seconds())
+            if row["end_at"] is not None:
+                run_seconds.append((row["end_at"] - row["start_at"]).total_seconds())
+        metrics = json.loads(row["metrics"]) if row["metrics"] is not None else {}
+        if metrics.get("queue_wait_seconds") is not None:
+            queue_waits.append(metrics["queue_wait_seconds"])
+        for phase, seconds in metrics.get("phases", {}).items():
+            phases.setdefault(phase, []).append(seconds)
+
+    first_submit = min((submission["submitted_at"] for submission in submissions), default=None)
+    last_end = max((row["end_at"] for row in rows if row["end_at"] is not None), default=None)
+    elapsed = (last_end - first_submit).total_seconds() if first_submit and last_end else None
+    completed = sum(1 for row in rows if row["end_at"] is not None)
+    # 只统计从第一次提交到最后一个任务运行结束之间的采样
+    window = [
+        (busy, slots) for at, busy, slots in samples if first_submit and last_end and first_submit <= at <= last_end
+    ]
+    busy_total = sum(busy for busy, _ in window)
+    slots_total = sum(slots for _, slots in window)
+
+    return {
+        "arguments": {key: str(value) for key, value in vars(args).items()},
+        "submitted": len(submissions),
+        "submit_errors": sum(1 for submission in submissions if "error" in submission),
+        "statuses": statuses,
+        "elapsed_seconds": round(elapsed, 3) if elapsed else None,
+        "throughput_runs_per_second": round(completed / elapsed, 3) if elapsed else None,
+        "start_task_seconds": summarize([submission["api_seconds"] for submission in submissions]),
+        "submit_to_start_seconds": summarize(submit_to_start),
+        "queue_wait_seconds": summarize(queue_waits),
+        "run_seconds": summarize(run_seconds),
+        "phases": {phase: summarize(values) for phase, values in sorted(phases.items())},
+        "worker_utilisation": round(busy_total / slots_total, 4) if slots_total else None,
+    }
+
+
+async def run(args: argparse.Namespace) -> dict[str, Any]:
+    root = Path(tempfile.mkdtemp(prefix="tasker-load-", dir=args.work_dir))
+    stack = Stack(root)
+    try:
+        database_url = args.database_url or await start_postgres(stack, args.pg_bin)
+        redis_host_port = args.redis_host_port or await start_redis(stack)
+        await create_schema(database_url)
+
+        file_server_port = free_port()
+        file_server = stack.spawn(
+            "file-server",
+            [sys.executable, __file__, "serve-files", "--root", root / "files", "--port", file_server_port],
+        )
+        await wait_for_port(file_server_port, file_server)
+
+        env = {
+            **os.environ,
+            "PYTHONPATH": os.pathsep.join(filter(None, [str(cwd / "src"), os.environ.get("PYTHONPATH")])),
+            "DATABASE_URL": database_url,
+            "REDIS_HOST_PORT": redis_host_port,
+            "FILE_SERVER_URL": f"http://127.0.0.1:{file_server_port}",
+            "LOG_DIR": str(root / "log" / "tasker"),
+            "SERVER_WORKING_DIR": str(root / "server"),
+        }
+        api_port = free_port()
+        api = stack.spawn(
+            "api",
+            [sys.executable, "-m", "uvicorn", "zjbs_tasker.main:app", "--port", api_port, "--log-level", "warning"],
+            env,
+        )
+        metrics_ports = []
+        workers = []
+        for i in range(args.workers):
+            metrics_ports.append(free_port())
+            worker_env = {
+                **env,
+                "WORKER_WORKING_DIR": str(root / f"worker-{i}"),
+                "WORKER_METRICS_PORT": str(metrics_ports[-1]),
+                "WORKER_SLOTS": str(args.slots),
+            }
+            worker_args = [sys.executable, "-m", "rq.cli", "worker", "--worker-class", args.worker_class]
+            worker_args += ["--job-class", "zjbs_tasker.runtime.TaskerJob", "--url", f"redis://{redis_host_port}"]
+            # 第一个工作进程运行调度器，把到期的重试放回队列
+            worker_args += ["--name", f"load-test-{i}", "--quiet", *(["--with-scheduler"] if i == 0 else []), "tasker"]
+            workers.append(stack.spawn(f"worker-{i}", worker_args, worker_env))
+
+        async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{api_port}", timeout=60) as client:
+            await wait_for_http(client, "/metrics", api)
+            for port, worker in zip(metrics_ports, workers):
+                await wait_for_http(client, f"http://127.0.0.1:{port}/metrics", worker)
+            task_ids = await create_tasks(client, database_url, args)
+
+            samples: list[tuple[datetime, float, float]] = []
+            sampler = asyncio.create_task(sample_utilisation(client, metrics_ports, args.sample_interval, samples))
+            try:
+                submissions = await drive(client, task_ids, args)
+                task_run_ids = [submission["task_run_id"] for submission in submissions if "task_run_id" in submission]
+                await wait_for_runs(database_url, task_run_ids, args.drain_timeout)
+            finally:
+                sampler.cancel()
+        return await collect_report(database_url, submissions, samples, args)
+    finally:
+        stack.stop()
+        if not args.keep:
+            shutil.rmtree(root, ignore_errors=True)
+
+
+def serve_redis(port: int) -> None:
+    try:
+        from fakeredis import TcpFakeServer
+        from fakeredis._clients._tcp_server import TCPFakeRequestHandler
+    except ImportError:
+        sys.exit("redis-server is not found and fakeredis is not installed: pip install fakeredis[lua]")
+
+    # fakeredis 返回错误（例如 INFO 和 NOSCRIPT）后会关闭连接，而 redis-py 会继续使用该连接，
+    # 因此返回错误后继续处理同一个连接，直到客户端关闭连接
+    class RequestHandler(TCPFakeRequestHandler):
+        def handle(self) -> None:
+            while not self.server._shutdown_event.is_set():
+                super().handle()
+                try:
+                    if self.connection.recv(1, socket.MSG_PEEK) == b"":
+                        return
+                except BlockingIOError:
+                    continue
+                except OSError:
+                    return
+
+    server = TcpFakeServer(("127.0.0.1", port))
+    server.RequestHandlerClass = RequestHandler
+    server.serve_forever()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="end-to-end load test")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = commands.add_parser("run", help="运行负载测试")
+    run_parser.add_argument("--rate", type=float, default=10, help="每秒调用 StartTask 的次数")
+    run_parser.add_argument("--duration", type=float, default=60, help="提交持续的时间（秒）")
+    run_parser.add_argument("--poisson", action="store_true", help="按泊松过程提交，否则均匀提交")
+    run_parser.add_argument("--tasks", type=int, default=100, help="轮流开始的任务数")
+    run_parser.add_argument("--owners", type=int, default=4, help="提交者数量，任务运行按提交者公平分配")
+    run_parser.add_argument("--run-seconds", type=float, default=1, help="每个任务运行的时间（秒）")
+    run_parser.add_argument("--output-bytes", type=int, default=1024 * 1024, help="每个任务运行输出文件的大小（字节）")
+    run_parser.add_argument("--task-cpu", type=int, default=1, help="每个任务需要的CPU核数")
+    run_parser.add_argument("--workers", type=int, default=2, help="工作进程数")
+    run_parser.add_argument("--slots", type=int, default=4, help="每个工作进程同时执行的任务运行数")
+    run_parser.add_argument("--worker-class", default="zjbs_tasker.runtime.ConcurrentTaskerWorker", help="工作进程的类")
+    run_parser.add_argument("--sample-interval", type=float, default=1, help="读取工作进程指标的间隔（秒）")
+    run_parser.add_argument("--drain-timeout", type=float, default=600, help="提交结束后等待任务运行结束的时间（秒）")
+    run_parser.add_argument("--database-url", help="使用已有的数据库，其中的表会被重新创建")
+    run_parser.add_argument("--pg-bin", type=Path, help="initdb 和 postgres 所在的目录")
+    run_parser.add_argument("--redis-host-port", help="使用已有的 Redis，例如 localhost:6379")
+    run_parser.add_argument("--work-dir", type=Path, help="临时文件和日志所在的目录")
+    run_parser.add_argument("--keep", action="store_true", help="结束后保留临时文件和日志")
+    run_parser.add_argument("--seed", type=int, default=0, help="随机数种子")
+    run_parser.add_argument("--output", type=Path, help="把结果写入 JSON 文件")
+
+    files_parser = commands.add_parser("serve-files", help="运行本地文件服务器")
+    files_parser.add_argument("--root", type=Path, required=True)
+    files_parser.add_argument("--port", type=int, required=True)
+
+    redis_parser = commands.add_parser("serve-redis", help="运行 fakeredis 的 TCP 服务器")
+    redis_parser.add_argument("--port", type=int, required=True)
+
+    args = parser.parse_args()
+    match args.command:
+        case "serve-files":
+            args.root.mkdir(parents=True, exist_ok=True)
+            uvicorn.run(file_server_app(args.root), host="127.0.0.1", port=args.port, log_level="warning")
+        case "serve-redis":
+            serve_redis(args.port)
+        case "run":
+            report = asyncio.run(run(args))
+            if args.output is not None:
+                args.output.write_text(json.dumps(report, indent=2), encoding="utf-8")
+            print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,62 @@
+# 对比 rq 默认的 fork-per-job 工作进程和长期运行的 TaskerWorker 的任务吞吐量
+#
+# 需要先启动 deploy/dev.docker-compose.yaml 中的数据库、文件服务器和 Redis
+# 用法：python benchmark/worker_throughput.py --jobs 500
+import argparse
+import json
+import sys
+import time
+from pathlib import Path
+
+cwd = Path(__file__).parent.parent.absolute()
+sys.path.append(str(cwd / "src"))
+
+from rq import Queue, Worker  # noqa: E402
+from zjbs_file_client import list_directory  # noqa: E402
+
+from zjbs_tasker.db import database  # noqa: E402
+from zjbs_tasker.runtime import TaskerJob, TaskerWorker  # noqa: E402
+from zjbs_tasker.server import redis_connection  # noqa: E402
+from zjbs_tasker.worker import connect_database, file_client  # noqa: E402
+
+
+# 与 execute_task_run 相同的连接生命周期，外加一次数据库查询和一次文件服务请求
+async def probe_job() -> None:
+    async with connect_database(), file_client():
+        await database.fetch_val("SELECT 1")
+        await list_directory("/")
+
+
+def run_benchmark(worker_class: type[Worker], jobs: int) -> dict:
+    queue = Queue(name="tasker-benchmark", connection=redis_connection, job_class=TaskerJob)
+    queue.empty()
+    failed_before = queue.failed_job_registry.count
+    for _ in range(jobs):
+        queue.enqueue(probe_job, result_ttl=0)
+
+    worker = worker_class([queue], connection=redis_connection, job_class=TaskerJob)
+    start = time.perf_counter()
+    worker.work(burst=True, logging_level="WARNING")
+    elapsed = time.perf_counter() - start
+
+    return {
+        "worker": worker_class.__name__,
+        "jobs": jobs,
+        "failed": queue.failed_job_registry.count - failed_before,
+        "seconds": round(elapsed, 3),
+        "jobs_per_second": round(jobs / elapsed, 2),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="worker throughput benchmark")
+    parser.add_argument("--jobs", type=int, default=200, help="每种工作进程执行的任务数")
+    args = parser.parse_args()
+
+    results = [run_benchmark(Worker, args.jobs), run_benchmark(TaskerWorker, args.jobs)]
+    results.append({"speedup": round(results[1]["jobs_per_second"] / results[0]["jobs_per_second"], 2)})
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
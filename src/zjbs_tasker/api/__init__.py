@@ -1,40 +1,177 @@
+import asyncio
+from datetime import datetime
 from typing import Annotated
 
-from fastapi import APIRouter, Body, File, Form, UploadFile
+from fastapi import APIRouter, Body, Depends, File, Form, Header, Query, UploadFile
+from fastapi.responses import StreamingResponse
+from ormar import NoMatch
+from zjbs_file_client import delete
 
-from zjbs_tasker.db import Task, TaskRun
-from zjbs_tasker.model import CompressMethod
-from zjbs_tasker.server import queue
-from zjbs_tasker.settings import FileServerPath
-from zjbs_tasker.util import upload_file
-from zjbs_tasker.worker import execute_task_run
+from zjbs_tasker.codec import DEFAULT_PACK_COMPRESS_METHOD
+from zjbs_tasker.db import Task, TaskRun, database, use_read_replica
+from zjbs_tasker.model import (
+    CompressMethod,
+    MetricSummary,
+    QueueStats,
+    StartTaskResult,
+    TaskRunMetrics,
+    TaskRunResponse,
+)
+from zjbs_tasker.output import is_stream_id, tail_output
+from zjbs_tasker.resource import collect_queue_stats
+from zjbs_tasker.server import async_redis_connection
+from zjbs_tasker.settings import FileServerPath, settings
+from zjbs_tasker.task_run import (
+    cancel_active_task_runs,
+    enqueue_task_runs,
+    load_execution_spec,
+    select_metric_summaries,
+    select_task_runs,
+    start_task_runs,
+)
+from zjbs_tasker.util import invalid_request_exception, upload_file
 
 router = APIRouter(tags=["api"])
 
+# 读取任务输出使用的异步 Redis 客户端
+async_redis = async_redis_connection()
+
 
 @router.post("/UploadTaskSourceFile", description="上传任务源文件")
 async def upload_task_source_file(
     task_id: Annotated[int, Form(ge=0, description="任务ID")],
     file: Annotated[UploadFile, File(description="任务源文件")],
     compress_method: Annotated[CompressMethod, Form(description="压缩方式")] = CompressMethod.not_compressed,
+    pack_compress_method: Annotated[CompressMethod, Form(description="存储的压缩方式")] = DEFAULT_PACK_COMPRESS_METHOD,
 ) -> None:
     task = await Task.objects.get(id=task_id, is_deleted=False)
-    await upload_file(file.file, file.filename, compress_method, FileServerPath.task_dir(task.id, task.name), "source")
+    await upload_file(
+        file.file,
+        file.filename,
+        compress_method,
+        FileServerPath.task_dir(task.id, task.name),
+        "source",
+        pack_compress_method,
+    )
+    # 压缩方式改变时删除之前的压缩包
+    if task.has_source_file and task.source_compress_method != pack_compress_method:
+        await delete(FileServerPath.task_source_file_path(task.id, task.name, task.source_compress_method))
+    await task.update(
+        ["has_source_file", "source_compress_method"],
+        has_source_file=True,
+        source_compress_method=pack_compress_method,
+    )
 
 
 @router.post("/StartTask", description="开始任务")
-async def start_task(task_id: Annotated[int, Body(description="任务ID")]) -> None:
-    task = await Task.objects.get(id=task_id, is_deleted=False)
-    task_run = await TaskRun.objects.create(task=task.id, index=0, status=TaskRun.Status.pending)
-    queue.enqueue(execute_task_run, task_run.id)
+async def start_task(
+    task_id: Annotated[int, Body(description="任务ID")],
+    priority: Annotated[int, Query(ge=0, le=100, description="优先级，越大越优先")] = 0,
+    owner: Annotated[
+        str | None, Query(max_length=255, description="提交者，不同提交者的任务轮流执行；为空时按模板轮流执行")
+    ] = None,
+) -> StartTaskResult:
+    (result,) = await start_task_runs([task_id], priority, owner)
+    if result.error is not None:
+        raise invalid_request_exception(result.error)
+    return result
+
+
+@router.post("/StartTasks", description="批量开始任务，单个任务的错误不影响其他任务")
+async def start_tasks(
+    task_ids: Annotated[list[int], Body(max_items=settings.START_TASKS_MAX_BATCH, description="任务ID列表")],
+    priority: Annotated[int, Query(ge=0, le=100, description="优先级，越大越优先")] = 0,
+    owner: Annotated[
+        str | None, Query(max_length=255, description="提交者，不同提交者的任务轮流执行；为空时按模板轮流执行")
+    ] = None,
+) -> list[StartTaskResult]:
+    return await start_task_runs(task_ids, priority, owner)
+
+
+@router.post("/CancelTaskRun", description="取消等待或运行中的任务运行，运行中的子进程会被终止")
+async def cancel_task_run(task_run_id: Annotated[int, Body(description="运行记录ID")]) -> None:
+    if not await cancel_active_task_runs([task_run_id]):
+        raise invalid_request_exception(f"task run {task_run_id} is not pending or running")
+
+
+@router.post("/CancelTaskRuns", description="批量取消任务运行，返回被取消的运行记录ID")
+async def cancel_task_runs(
+    task_run_ids: Annotated[
+        list[int] | None, Body(max_items=settings.START_TASKS_MAX_BATCH, description="运行记录ID列表")
+    ] = None,
+    task_id: Annotated[int | None, Body(description="取消该任务所有等待或运行中的运行")] = None,
+) -> list[int]:
+    if task_run_ids is None and task_id is None:
+        raise invalid_request_exception("task_run_ids or task_id is required")
+    return await cancel_active_task_runs(task_run_ids, task_id)
+
+
+@router.post("/ListTaskRuns", description="列出任务运行记录，按序号排序", dependencies=[Depends(use_read_replica)])
+async def list_task_runs(
+    task_id: Annotated[int, Query(description="任务ID")],
+    status: Annotated[TaskRun.Status | None, Query(description="运行状态")] = None,
+    after_index: Annotated[int | None, Query(description="只返回序号大于该值的记录，用于分页")] = None,
+    updated_since: Annotated[datetime | None, Query(description="只返回在该时间之后修改的记录，用于轮询")] = None,
+    limit: Annotated[int, Query(ge=1, le=1000, description="分页大小")] = 100,
+) -> list[TaskRunResponse]:
+    query = select_task_runs(task_id, status, after_index, updated_since, limit)
+    rows = await database.fetch_all(query)
+    # 没有记录时确认任务存在，任务不存在或已删除时返回 404
+    if not rows and not await Task.objects.filter(id=task_id, is_deleted=False).exists():
+        raise NoMatch(f"task {task_id} not found")
+    return [TaskRunResponse(**row) for row in rows]
+
+
+@router.post(
+    "/GetTaskRunMetrics",
+    description="任务运行各阶段的耗时和资源使用，运行结束前为空",
+    dependencies=[Depends(use_read_replica)],
+)
+async def get_task_run_metrics(
+    task_run_id: Annotated[int, Query(description="运行记录ID")],
+) -> TaskRunMetrics | None:
+    task_run = await TaskRun.objects.get(id=task_run_id, is_deleted=False)
+    return TaskRunMetrics.parse_obj(task_run.metrics) if task_run.metrics is not None else None
+
+
+@router.post(
+    "/AggregateTaskRunMetrics",
+    description="汇总任务运行的耗时和资源使用，阶段耗时的名称为 phase:<阶段>",
+    dependencies=[Depends(use_read_replica)],
+)
+async def aggregate_task_run_metrics(
+    task_id: Annotated[int | None, Query(description="任务ID")] = None,
+    template_id: Annotated[int | None, Query(description="模板ID")] = None,
+    status: Annotated[TaskRun.Status | None, Query(description="运行状态")] = None,
+    ended_since: Annotated[datetime | None, Query(description="只统计在该时间之后结束的运行")] = None,
+    ended_before: Annotated[datetime | None, Query(description="只统计在该时间之前结束的运行")] = None,
+) -> list[MetricSummary]:
+    query = select_metric_summaries(task_id, template_id, status, ended_since, ended_before)
+    return [MetricSummary(**row) for row in await database.fetch_all(query)]
+
+
+@router.get("/TailTaskRunOutput", description="以 Server-Sent Events 实时读取任务运行的 stdout 和 stderr")
+async def tail_task_run_output(
+    task_run_id: Annotated[int, Query(description="运行记录ID")],
+    last_event_id: Annotated[str | None, Header(description="断线重连时从该事件之后继续读取")] = None,
+) -> StreamingResponse:
+    if last_event_id is not None and not is_stream_id(last_event_id):
+        raise invalid_request_exception(f"invalid Last-Event-ID: {last_event_id}")
+    task_run = await TaskRun.objects.select_related("task").get(id=task_run_id, is_deleted=False)
+    return StreamingResponse(
+        tail_output(async_redis, task_run, last_event_id),
+        media_type="text/event-stream",
+        # 设置 Content-Encoding 使 GZipMiddleware 不缓冲事件流
+        headers={"Content-Encoding": "identity", "Cache-Control": "no-cache"},
+    )
 
 
-@router.post("/ListTaskRuns", description="列出任务运行记录", response_model=list[TaskRun])
-async def list_task_runs(task_id: int) -> list[TaskRun]:
-    task = await Task.objects.select_related("runs").get(id=task_id, is_deleted=False)
-    return [task_run.dict(exclude={"task"}) for task_run in task.runs if not task_run.is_deleted]
+@router.post("/GetQueueStats", description="获取各资源类别队列的排队作业数和等待时间")
+async def get_queue_stats() -> list[QueueStats]:
+    return await asyncio.to_thread(collect_queue_stats)
 
 
 async def start_run_task(task_id: int, index: int = 1) -> None:
     task_run = await TaskRun.objects.create(task=task_id, index=index, status=TaskRun.Status.pending)
-    queue.enqueue(execute_task_run, task_run.id)
+    spec = await load_execution_spec(task_run.id)
+    await asyncio.to_thread(enqueue_task_runs, [(task_run.id, spec)])
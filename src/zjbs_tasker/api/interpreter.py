@@ -1,12 +1,14 @@
 from typing import Annotated
 
-from fastapi import APIRouter, Body, File, Form, Query, UploadFile
+from fastapi import APIRouter, Body, Depends, File, Form, Query, UploadFile
 from pydantic import BaseModel
 from zjbs_file_client import delete
 
-from zjbs_tasker.db import TaskInterpreter
-from zjbs_tasker.model import CompressMethod
-from zjbs_tasker.settings import FileServerPath
+from zjbs_tasker.codec import DEFAULT_PACK_COMPRESS_METHOD
+from zjbs_tasker.db import TaskInterpreter, fetch_page, use_read_replica
+from zjbs_tasker.model import CompressMethod, Page
+from zjbs_tasker.model_cache import ModelCache
+from zjbs_tasker.settings import FileServerPath, settings
 from zjbs_tasker.util import invalid_request_exception, upload_file
 
 router = APIRouter(tags=["interpreter"])
@@ -22,6 +24,20 @@ class TaskInterpreterResponse(BaseModel):
     environment: dict[str, str]
 
 
+interpreter_cache: ModelCache[TaskInterpreterResponse] = ModelCache(
+    "interpreter",
+    TaskInterpreterResponse,
+    settings.MODEL_CACHE_SIZE,
+    settings.MODEL_CACHE_TTL,
+    settings.MODEL_CACHE_SHARED,
+)
+
+
+async def load_task_interpreter(id_: int) -> TaskInterpreterResponse | None:
+    interpreter: TaskInterpreter | None = await TaskInterpreter.objects.get_or_none(id=id_, is_deleted=False)
+    return TaskInterpreterResponse(**interpreter.dict()) if interpreter else None
+
+
 @router.post("/CreateTaskInterpreter", description="创建任务解释器")
 async def create_task_interpreter(
     name: Annotated[str, Body(max_length=255, description="名称")],
@@ -45,24 +61,48 @@ async def create_task_interpreter(
 async def get_task_interpreter(
     id_: Annotated[int, Query(alias="id", description="解释器ID")]
 ) -> TaskInterpreterResponse | None:
-    interpreter: TaskInterpreter | None = await TaskInterpreter.objects.get_or_none(id=id_, is_deleted=False)
-    return TaskInterpreterResponse(**interpreter.dict()) if interpreter else None
+    return await interpreter_cache.get(id_, load_task_interpreter)
 
 
-@router.post("/ListTaskInterpreters", description="获取任务解释器列表")
+@router.post("/ListTaskInterpreters", description="获取任务解释器列表", dependencies=[Depends(use_read_replica)])
 async def list_task_interpreters(
     name: Annotated[str | None, Query(alias="name", description="名称")] = None,
     type_: Annotated[TaskInterpreter.Type | None, Query(alias="type", description="类型")] = None,
+    cursor: Annotated[int | None, Query(description="只返回ID大于该值的解释器")] = None,
     offset: Annotated[int, Query(description="分页偏移量")] = 0,
     limit: Annotated[int, Query(description="分页大小")] = 10,
 ) -> list[TaskInterpreterResponse]:
+    page = await list_task_interpreters_page(name, type_, cursor, offset, limit)
+    return page.items
+
+
+@router.post(
+    "/ListTaskInterpretersPage",
+    description="分页获取任务解释器列表，返回下一页的 cursor 和总数",
+    dependencies=[Depends(use_read_replica)],
+)
+async def list_task_interpreters_page(
+    name: Annotated[str | None, Query(alias="name", description="名称")] = None,
+    type_: Annotated[TaskInterpreter.Type | None, Query(alias="type", description="类型")] = None,
+    cursor: Annotated[int | None, Query(description="上一页返回的 next_cursor")] = None,
+    offset: Annotated[int, Query(description="分页偏移量")] = 0,
+    limit: Annotated[int, Query(ge=1, description="分页大小")] = 10,
+    with_total: Annotated[bool, Query(description="是否返回总数，没有过滤条件时为估计值")] = False,
+) -> Page[TaskInterpreterResponse]:
     query = {"is_deleted": False}
     if name is not None:
         query["name__icontains"] = name
     if type_ is not None:
         query["type"] = type_
-    interpreters: list[TaskInterpreter] = await TaskInterpreter.objects.offset(offset).limit(limit).all(**query)
-    return [TaskInterpreterResponse(**interpreter.dict()) for interpreter in interpreters]
+    interpreters, next_cursor, total, total_estimated = await fetch_page(
+        TaskInterpreter, query, cursor, offset, limit, with_total
+    )
+    return Page(
+        items=[TaskInterpreterResponse(**interpreter.dict()) for interpreter in interpreters],
+        next_cursor=next_cursor,
+        total=total,
+        total_estimated=total_estimated,
+    )
 
 
 @router.post("/UpdateTaskInterpreter", description="更新任务解释器")
@@ -89,6 +129,7 @@ async def update_task_interpreter(
     if environment is not None:
         update_fields["environment"] = environment
     await interpreter.update(list(update_fields.keys()), **update_fields)
+    await interpreter_cache.invalidate(interpreter.id)
     return TaskInterpreterResponse(**interpreter.dict())
 
 
@@ -100,6 +141,7 @@ async def delete_task_interpreter(
     if interpreter is None:
         return None
     await interpreter.update(["is_deleted"], is_deleted=True)
+    await interpreter_cache.invalidate(interpreter.id)
     return TaskInterpreterResponse(**interpreter.dict())
 
 
@@ -108,18 +150,33 @@ async def upload_task_interpreter_executable(
     id_: Annotated[int, Form(alias="id", description="任务解释器ID")],
     file: Annotated[UploadFile, File(description="任务解释器文件")],
     compress_method: Annotated[CompressMethod, Form(description="压缩方式")],
+    pack_compress_method: Annotated[CompressMethod, Form(description="存储的压缩方式")] = DEFAULT_PACK_COMPRESS_METHOD,
 ) -> None:
     interpreter: TaskInterpreter | None = await TaskInterpreter.objects.get_or_none(id=id_, is_deleted=False)
     if interpreter is None:
         raise invalid_request_exception("task interpreter not found")
-    await upload_file(
+    executable_hash = await upload_file(
         file.file,
         file.filename,
         compress_method,
         FileServerPath.TASK_INTERPRETER_DIR,
         f"{interpreter.id}_{interpreter.name}",
+        pack_compress_method,
+    )
+    # 压缩方式改变时删除之前的压缩包
+    if interpreter.has_executable and interpreter.executable_compress_method != pack_compress_method:
+        await delete(
+            FileServerPath.interpreter_executable_path(
+                interpreter.id, interpreter.name, interpreter.executable_compress_method
+            )
+        )
+    await interpreter.update(
+        ["has_executable", "executable_hash", "executable_compress_method"],
+        has_executable=True,
+        executable_hash=executable_hash,
+        executable_compress_method=pack_compress_method,
     )
-    await interpreter.update(["has_executable"], has_executable=True)
+    await interpreter_cache.invalidate(interpreter.id)
 
 
 @router.post("/DeleteTaskInterpreterExecutable", description="删除任务解释器文件")
@@ -128,5 +185,10 @@ async def delete_task_interpreter_executable(id_: Annotated[int, Query(alias="id
     if interpreter is None:
         raise invalid_request_exception("task interpreter not found")
     if interpreter.has_executable:
-        await delete(FileServerPath.interpreter_executable_path(interpreter.id, interpreter.name))
-        await interpreter.update(["has_executable"], has_executable=False)
+        await delete(
+            FileServerPath.interpreter_executable_path(
+                interpreter.id, interpreter.name, interpreter.executable_compress_method
+            )
+        )
+        await interpreter.update(["has_executable", "executable_hash"], has_executable=False, executable_hash=None)
+        await interpreter_cache.invalidate(interpreter.id)
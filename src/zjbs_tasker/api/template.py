@@ -1,12 +1,14 @@
 from typing import Annotated, Optional
 
-from fastapi import APIRouter, Body, File, Form, Query, UploadFile
+from fastapi import APIRouter, Body, Depends, File, Form, Query, UploadFile
 from pydantic import BaseModel
 from zjbs_file_client import delete, rename
 
-from zjbs_tasker.db import TaskTemplate
-from zjbs_tasker.model import CompressMethod
-from zjbs_tasker.settings import FileServerPath
+from zjbs_tasker.codec import DEFAULT_PACK_COMPRESS_METHOD
+from zjbs_tasker.db import TaskTemplate, fetch_page, use_read_replica
+from zjbs_tasker.model import CompressMethod, Page
+from zjbs_tasker.model_cache import ModelCache
+from zjbs_tasker.settings import FileServerPath, settings
 from zjbs_tasker.util import invalid_request_exception, upload_file
 
 router = APIRouter(tags=["template"])
@@ -20,6 +22,9 @@ class TaskTemplateResponse(BaseModel):
     has_script: bool
     arguments: list[str]
     environment: dict[str, str]
+    cpu: int | None
+    memory: int | None
+    disk: int | None
 
     @staticmethod
     def from_db(task_template: TaskTemplate | None) -> Optional["TaskTemplateResponse"]:
@@ -32,12 +37,29 @@ class TaskTemplateResponse(BaseModel):
                 has_script=task_template.has_script,
                 arguments=task_template.arguments,
                 environment=task_template.environment,
+                cpu=task_template.cpu,
+                memory=task_template.memory,
+                disk=task_template.disk,
             )
             if task_template
             else None
         )
 
 
+template_cache: ModelCache[TaskTemplateResponse] = ModelCache(
+    "template",
+    TaskTemplateResponse,
+    settings.MODEL_CACHE_SIZE,
+    settings.MODEL_CACHE_TTL,
+    settings.MODEL_CACHE_SHARED,
+)
+
+
+async def load_task_template(id_: int) -> TaskTemplateResponse | None:
+    template: TaskTemplate | None = await TaskTemplate.objects.get_or_none(id=id_, is_deleted=False)
+    return TaskTemplateResponse.from_db(template)
+
+
 @router.post("/CreateTaskTemplate", description="创建任务模板")
 async def create_task_template(
     interpreter: Annotated[int, Body(description="任务解释器ID")],
@@ -45,6 +67,9 @@ async def create_task_template(
     description: Annotated[str, Body(description="描述")],
     arguments: Annotated[list[str], Body(description="参数")],
     environment: Annotated[dict[str, str], Body(description="环境变量")],
+    cpu: Annotated[int | None, Body(ge=0, description="需要的CPU核数")] = None,
+    memory: Annotated[int | None, Body(ge=0, description="需要的内存（字节）")] = None,
+    disk: Annotated[int | None, Body(ge=0, description="需要的磁盘空间（字节）")] = None,
 ) -> TaskTemplateResponse:
     template: TaskTemplate = await TaskTemplate.objects.create(
         interpreter=interpreter,
@@ -53,6 +78,9 @@ async def create_task_template(
         has_script=False,
         arguments=arguments,
         environment=environment,
+        cpu=cpu,
+        memory=memory,
+        disk=disk,
     )
     return TaskTemplateResponse.from_db(template)
 
@@ -62,38 +90,77 @@ async def upload_task_template_script(
     id_: Annotated[int, Form(alias="id", description="任务模板ID")],
     file: Annotated[UploadFile, File(description="任务模板脚本")],
     compress_method: Annotated[CompressMethod, Form(description="压缩方式")] = CompressMethod.not_compressed,
+    pack_compress_method: Annotated[CompressMethod, Form(description="存储的压缩方式")] = DEFAULT_PACK_COMPRESS_METHOD,
 ) -> None:
     template: TaskTemplate | None = await TaskTemplate.objects.get_or_none(id=id_, is_deleted=False)
     if template is None:
         raise invalid_request_exception("task template not found")
-    await upload_file(
-        file.file, file.filename, compress_method, FileServerPath.TASK_TEMPLATE_DIR, f"{template.id}_{template.name}"
+    script_hash = await upload_file(
+        file.file,
+        file.filename,
+        compress_method,
+        FileServerPath.TASK_TEMPLATE_DIR,
+        f"{template.id}_{template.name}",
+        pack_compress_method,
     )
-    await template.update(["has_script"], has_script=True)
+    # 压缩方式改变时删除之前的压缩包
+    if template.has_script and template.script_compress_method != pack_compress_method:
+        await delete(FileServerPath.template_script_path(template.id, template.name, template.script_compress_method))
+    await template.update(
+        ["has_script", "script_hash", "script_compress_method"],
+        has_script=True,
+        script_hash=script_hash,
+        script_compress_method=pack_compress_method,
+    )
+    await template_cache.invalidate(template.id)
 
 
 @router.post("/GetTaskTemplate", description="获取任务模板")
 async def get_task_template(
     id_: Annotated[int, Query(alias="id", description="任务模板ID")]
 ) -> TaskTemplateResponse | None:
-    template: TaskTemplate | None = await TaskTemplate.objects.get_or_none(id=id_, is_deleted=False)
-    return TaskTemplateResponse.from_db(template)
+    return await template_cache.get(id_, load_task_template)
 
 
-@router.post("/ListTaskTemplate", description="获取任务模板列表")
+@router.post("/ListTaskTemplate", description="获取任务模板列表", dependencies=[Depends(use_read_replica)])
 async def list_task_template(
     interpreter: Annotated[int | None, Query(alias="interpreter", description="任务解释器ID")] = None,
     name: Annotated[str | None, Query(alias="name", description="任务模板名称")] = None,
+    cursor: Annotated[int | None, Query(description="只返回ID大于该值的模板")] = None,
     offset: Annotated[int, Query(description="分页偏移量")] = 0,
     limit: Annotated[int, Query(description="分页大小")] = 10,
 ) -> list[TaskTemplateResponse]:
+    page = await list_task_template_page(interpreter, name, cursor, offset, limit)
+    return page.items
+
+
+@router.post(
+    "/ListTaskTemplatePage",
+    description="分页获取任务模板列表，返回下一页的 cursor 和总数",
+    dependencies=[Depends(use_read_replica)],
+)
+async def list_task_template_page(
+    interpreter: Annotated[int | None, Query(alias="interpreter", description="任务解释器ID")] = None,
+    name: Annotated[str | None, Query(alias="name", description="任务模板名称")] = None,
+    cursor: Annotated[int | None, Query(description="上一页返回的 next_cursor")] = None,
+    offset: Annotated[int, Query(description="分页偏移量")] = 0,
+    limit: Annotated[int, Query(ge=1, description="分页大小")] = 10,
+    with_total: Annotated[bool, Query(description="是否返回总数，没有过滤条件时为估计值")] = False,
+) -> Page[TaskTemplateResponse]:
     query = {"is_deleted": False}
     if interpreter is not None:
         query["interpreter"] = interpreter
     if name is not None:
         query["name__icontains"] = name
-    templates: list[TaskTemplate] = await TaskTemplate.objects.offset(offset).limit(limit).all(**query)
-    return [TaskTemplateResponse.from_db(template) for template in templates]
+    templates, next_cursor, total, total_estimated = await fetch_page(
+        TaskTemplate, query, cursor, offset, limit, with_total
+    )
+    return Page(
+        items=[TaskTemplateResponse.from_db(template) for template in templates],
+        next_cursor=next_cursor,
+        total=total,
+        total_estimated=total_estimated,
+    )
 
 
 @router.post("/UpdateTaskTemplate", description="更新任务模板")
@@ -103,6 +170,9 @@ async def update_task_template(
     description: Annotated[str | None, Body(description="描述")] = None,
     arguments: Annotated[list[str] | None, Body(description="参数")] = None,
     environment: Annotated[dict[str, str] | None, Body(description="环境变量")] = None,
+    cpu: Annotated[int | None, Body(ge=0, description="需要的CPU核数")] = None,
+    memory: Annotated[int | None, Body(ge=0, description="需要的内存（字节）")] = None,
+    disk: Annotated[int | None, Body(ge=0, description="需要的磁盘空间（字节）")] = None,
 ) -> TaskTemplateResponse:
     template: TaskTemplate | None = await TaskTemplate.objects.get_or_none(id=id_, is_deleted=False)
     if template is None:
@@ -118,9 +188,18 @@ async def update_task_template(
         update_fields["arguments"] = arguments
     if environment is not None:
         update_fields["environment"] = environment
+    if cpu is not None:
+        update_fields["cpu"] = cpu
+    if memory is not None:
+        update_fields["memory"] = memory
+    if disk is not None:
+        update_fields["disk"] = disk
+    script_path = FileServerPath.template_script_path(template.id, template.name, template.script_compress_method)
     await template.update(list(update_fields.keys()), **update_fields)
-    if new_name is not None:
-        await rename(FileServerPath.template_script_path(template.id, template.name), f"{template.id}_{new_name}.txz")
+    # 先使缓存失效，重命名脚本失败时也不会读到修改前的模板
+    await template_cache.invalidate(template.id)
+    if new_name is not None and template.has_script:
+        await rename(script_path, f"{template.id}_{new_name}.{template.script_compress_method}")
     return TaskTemplateResponse.from_db(template)
 
 
@@ -132,6 +211,7 @@ async def delete_task_template(
     if template is None:
         return None
     await template.update(["is_deleted"], is_deleted=True)
+    await template_cache.invalidate(template.id)
     return TaskTemplateResponse.from_db(template)
 
 
@@ -141,5 +221,6 @@ async def delete_task_template_script(id_: Annotated[int, Query(alias="id", desc
     if template is None:
         raise invalid_request_exception("task template not found")
     if template.has_script:
-        await delete(FileServerPath.template_script_path(template.id, template.name))
-        await template.update(["has_script"], has_script=False)
+        await delete(FileServerPath.template_script_path(template.id, template.name, template.script_compress_method))
+        await template.update(["has_script", "script_hash"], has_script=False, script_hash=None)
+        await template_cache.invalidate(template.id)
@@ -0,0 +1,181 @@
+import asyncio
+import fcntl
+import os
+import shutil
+import time
+import uuid
+from collections import Counter
+from collections.abc import AsyncIterator, Awaitable, Callable
+from contextlib import asynccontextmanager
+from pathlib import Path
+
+from loguru import logger
+
+# 每个缓存项旁边的元数据文件，内容为缓存项大小，修改时间为最近一次使用时间
+SIZE_SUFFIX = ".size"
+# 每个缓存项旁边的锁文件，使用缓存项时持有共享锁，淘汰时需要获得排他锁
+LOCK_SUFFIX = ".lock"
+# 临时目录前缀，中断的解压会留下这些目录
+TEMP_PREFIX = ".tmp-"
+# 超过该时间的临时目录被认为是崩溃遗留的
+STALE_TEMP_SECONDS = 24 * 60 * 60
+# 缓存项正在被其他进程淘汰时，重新获取共享锁的间隔（秒）
+PIN_RETRY_SECONDS = 0.05
+
+
+# 工作进程上的解释器和模板缓存
+#
+# 缓存项的 key 形如 "interpreter/3_<hash>"，包含上传时记录的内容哈希，因此重新上传后会自动使用新的缓存项。
+# 缓存项通过先解压到临时目录再重命名的方式原子地写入；超过磁盘上限时按最近使用时间淘汰未被使用的缓存项。
+# 是否被使用由锁文件上的 flock 决定，共享同一个工作目录的其他工作进程和 fork 出的作业进程正在使用的缓存项也不会被淘汰。
+class ArtifactCache:
+    def __init__(self, root: Path, max_size: int) -> None:
+        self.root = root
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        # 进程内同一个缓存项只由一个协程填充，没有协程使用时删除
+        self._locks: dict[str, asyncio.Lock] = {}
+        self._users: Counter[str] = Counter()
+
+    def path(self, key: str) -> Path:
+        return self.root / key
+
+    # 获取缓存项，不存在时调用 fill 填充。在上下文中缓存项不会被淘汰
+    @asynccontextmanager
+    async def acquire(self, key: str, fill: Callable[[Path], Awaitable[None]]) -> AsyncIterator[Path]:
+        self._users[key] += 1
+        lock = self._locks.setdefault(key, asyncio.Lock())
+        pin = None
+        try:
+            path = self.path(key)
+            path.parent.mkdir(parents=True, exist_ok=True)
+            # 淘汰时只在重命名期间短暂持有排他锁
+            while (pin := self._pin(key)) is None:
+                await asyncio.sleep(PIN_RETRY_SECONDS)
+            async with lock:
+                if path.is_dir():
+                    self.hits += 1
+                    self._touch(key)
+                else:
+                    self.misses += 1
+                    await fill(path)
+                    size = await asyncio.to_thread(directory_size, path)
+                    self._size_file(key).write_text(str(size), encoding="utf-8")
+                    self._touch(key)
+                    await self.evict()
+            yield path
+        finally:
+            if pin is not None:
+                os.close(pin)
+            self._users[key] -= 1
+            if self._users[key] <= 0:
+                del self._users[key]
+                del self._locks[key]
+
+    # 打开锁文件并获得共享锁，返回文件描述符，关闭时释放锁。其他进程正在淘汰该缓存项时返回 None。
+    # 获得锁前缓存项可能已经被淘汰并删除了锁文件，此时也返回 None，重试时打开新的锁文件
+    def _pin(self, key: str) -> int | None:
+        lock_file = self._lock_file(key)
+        fd = os.open(lock_file, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_SH | fcntl.LOCK_NB)
+            if os.fstat(fd).st_ino == os.stat(lock_file).st_ino:
+                return fd
+        except (BlockingIOError, FileNotFoundError):
+            pass
+        except BaseException:
+            os.close(fd)
+            raise
+        os.close(fd)
+        return None
+
+    # 按最近使用时间淘汰缓存项，直到总大小不超过上限
+    async def evict(self) -> None:
+        entries = await asyncio.to_thread(self._scan)
+        total_size = sum(size for _, size, _ in entries)
+        for key, size, _ in sorted(entries, key=lambda entry: entry[2]):
+            if total_size <= self.max_size:
+                break
+            if not await asyncio.to_thread(self._remove, key):
+                continue
+            total_size -= size
+            self.evictions += 1
+            logger.info(f"evicted cached artifact {key}, size {size}")
+
+    def _scan(self) -> list[tuple[str, int, int]]:
+        entries = []
+        if not self.root.is_dir():
+            return entries
+        for kind_dir in self.root.iterdir():
+            if not kind_dir.is_dir():
+                continue
+            for path in kind_dir.iterdir():
+                if path.name.startswith(TEMP_PREFIX):
+                    if time.time() - path.stat().st_mtime > STALE_TEMP_SECONDS:
+                        shutil.rmtree(path, ignore_errors=True)
+                    continue
+                if not path.is_dir():
+                    continue
+                key = f"{kind_dir.name}/{path.name}"
+                size_file = self._size_file(key)
+                try:
+                    entries.append((key, int(size_file.read_text(encoding="utf-8")), size_file.stat().st_mtime_ns))
+                except (OSError, ValueError):
+                    # 其他进程刚刚完成重命名但还没有写入大小
+                    continue
+        return entries
+
+    # 删除没有被使用的缓存项，缓存项正在被使用时返回 False
+    def _remove(self, key: str) -> bool:
+        path = self.path(key)
+        lock_file = self._lock_file(key)
+        trash_path = path.with_name(f"{TEMP_PREFIX}{uuid.uuid4().hex}")
+        try:
+            fd = os.open(lock_file, os.O_RDWR | os.O_CREAT, 0o644)
+        except OSError:
+            return False
+        try:
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                return False
+            try:
+                path.rename(trash_path)
+            except OSError:
+                return False
+            self._size_file(key).unlink(missing_ok=True)
+            # 持有排他锁时删除锁文件，正在等待的进程获得锁后发现锁文件已经被替换，会重新打开
+            lock_file.unlink(missing_ok=True)
+        finally:
+            os.close(fd)
+        shutil.rmtree(trash_path, ignore_errors=True)
+        return True
+
+    def _touch(self, key: str) -> None:
+        # 文件系统写入时使用粗粒度时钟，这里显式设置纳秒级的时间
+        now = time.time_ns()
+        try:
+            os.utime(self._size_file(key), ns=(now, now))
+        except OSError:
+            pass
+
+    def _size_file(self, key: str) -> Path:
+        path = self.path(key)
+        return path.with_name(path.name + SIZE_SUFFIX)
+
+    def _lock_file(self, key: str) -> Path:
+        path = self.path(key)
+        return path.with_name(path.name + LOCK_SUFFIX)
+
+
+def directory_size(directory: Path) -> int:
+    size = 0
+    for parent, _, filenames in os.walk(directory):
+        for filename in filenames:
+            try:
+                size += os.lstat(os.path.join(parent, filename)).st_size
+            except OSError:
+                pass
+    return size
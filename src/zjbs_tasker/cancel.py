@@ -0,0 +1,109 @@
+import asyncio
+import os
+import signal
+from collections.abc import AsyncIterator
+from contextlib import asynccontextmanager
+
+from loguru import logger
+from redis import RedisError
+
+from zjbs_tasker.server import async_redis_connection
+from zjbs_tasker.settings import settings
+
+# 取消任务运行的 Redis 频道，消息为运行记录ID
+CANCEL_CHANNEL: str = "tasker:cancel"
+
+
+# 给整个进程组发送 SIGTERM，grace_seconds 后还没有退出时发送 SIGKILL
+async def terminate_process_group(process: asyncio.subprocess.Process, grace_seconds: float) -> None:
+    for sig in (signal.SIGTERM, signal.SIGKILL):
+        try:
+            os.killpg(process.pid, sig)
+        except ProcessLookupError:
+            return
+        try:
+            await asyncio.wait_for(process.wait(), grace_seconds)
+            return
+        except TimeoutError:
+            if sig == signal.SIGTERM:
+                logger.warning(f"process {process.pid} did not exit in {grace_seconds} seconds, kill it")
+
+
+def kill_process_group(process: asyncio.subprocess.Process) -> None:
+    try:
+        os.killpg(process.pid, signal.SIGKILL)
+    except ProcessLookupError:
+        pass
+
+
+# 当前工作进程中正在运行的任务子进程，收到取消消息时终止对应的进程组
+class RunningProcesses:
+    def __init__(self, grace_seconds: float) -> None:
+        self.grace_seconds = grace_seconds
+        self.canceled = 0
+        self._processes: dict[int, asyncio.subprocess.Process] = {}
+        self._canceled: set[int] = set()
+        self._tasks: set[asyncio.Task] = set()
+        self._listener: asyncio.Task | None = None
+
+    # 退出上下文时子进程还在运行，说明协程被取消（作业超时、工作进程退出）或者出错，
+    # 此时终止整个进程组，避免子进程成为孤儿进程并和重试同时运行
+    @asynccontextmanager
+    async def register(self, task_run_id: int, process: asyncio.subprocess.Process) -> AsyncIterator[None]:
+        self._processes[task_run_id] = process
+        try:
+            yield
+        finally:
+            try:
+                if process.returncode is None:
+                    logger.warning(f"task run {task_run_id} interrupted, terminate process group {process.pid}")
+                    try:
+                        await terminate_process_group(process, self.grace_seconds)
+                    except BaseException:
+                        # 等待子进程退出时再次被取消，直接杀死进程组
+                        kill_process_group(process)
+                        raise
+            finally:
+                del self._processes[task_run_id]
+
+    # 终止任务运行的子进程，任务运行不在当前工作进程中时返回 False
+    async def cancel(self, task_run_id: int) -> bool:
+        process = self._processes.get(task_run_id)
+        if process is None:
+            return False
+        if task_run_id not in self._canceled:
+            self._canceled.add(task_run_id)
+            self.canceled += 1
+            logger.info(f"cancel task run {task_run_id}, terminate process group {process.pid}")
+            await terminate_process_group(process, self.grace_seconds)
+        return True
+
+    # 任务运行是否被取消，调用后清除记录
+    def pop_canceled(self, task_run_id: int) -> bool:
+        if task_run_id in self._canceled:
+            self._canceled.remove(task_run_id)
+            return True
+        return False
+
+    # 在后台接收取消消息，直到事件循环关闭
+    def start(self) -> None:
+        if self._listener is None or self._listener.done():
+            self._listener = asyncio.create_task(self.listen())
+
+    # 订阅取消频道，连接断开时重新订阅
+    async def listen(self) -> None:
+        while True:
+            try:
+                async with async_redis_connection(socket_timeout=None) as redis, redis.pubsub() as pubsub:
+                    await pubsub.subscribe(CANCEL_CHANNEL)
+                    async for message in pubsub.listen():
+                        if message["type"] == "message":
+                            task = asyncio.create_task(self.cancel(int(message["data"])))
+                            self._tasks.add(task)
+                            task.add_done_callback(self._tasks.discard)
+            except (RedisError, OSError) as e:
+                logger.warning(f"cancel channel disconnected, resubscribe: {e}")
+                await asyncio.sleep(5)
+
+
+running_processes = RunningProcesses(settings.WORKER_CANCEL_GRACE_SECONDS)
@@ -0,0 +1,70 @@
+import tarfile
+from collections.abc import Iterator
+from contextlib import contextmanager
+from typing import BinaryIO
+
+from zjbs_tasker.model import CompressMethod
+from zjbs_tasker.settings import settings
+
+# 可以作为解释器、模板和源文件压缩包存储的压缩方式
+PACK_COMPRESS_METHODS: frozenset[CompressMethod] = frozenset(
+    {CompressMethod.tar, CompressMethod.tgz, CompressMethod.txz, CompressMethod.tzst}
+)
+
+# 默认的压缩包压缩方式
+DEFAULT_PACK_COMPRESS_METHOD: CompressMethod = CompressMethod(settings.PACK_COMPRESS_METHOD)
+
+# 本地文件的后缀名
+FILE_SUFFIXES: dict[CompressMethod, str] = {
+    CompressMethod.tar: ".tar",
+    CompressMethod.tgz: ".tar.gz",
+    CompressMethod.txz: ".tar.xz",
+    CompressMethod.tzst: ".tar.zst",
+}
+
+
+# zstd 是可选依赖：pip install zjbs-tasker[zstd]
+def zstandard():
+    try:
+        import zstandard
+    except ImportError as e:
+        raise RuntimeError("tzst requires the zstandard package, install zjbs-tasker[zstd]") from e
+    return zstandard
+
+
+# 以流的方式写入 tar 压缩包，fileobj 只需要支持顺序写入
+@contextmanager
+def open_tar_writer(fileobj: BinaryIO, compress_method: CompressMethod) -> Iterator[tarfile.TarFile]:
+    match compress_method:
+        case CompressMethod.tar | CompressMethod.tgz | CompressMethod.txz:
+            mode = {CompressMethod.tar: "w|", CompressMethod.tgz: "w|gz", CompressMethod.txz: "w|xz"}[compress_method]
+            with tarfile.open(fileobj=fileobj, mode=mode) as tar_file:
+                yield tar_file
+        case CompressMethod.tzst:
+            compressor = zstandard().ZstdCompressor(level=settings.ZSTD_LEVEL, threads=settings.ZSTD_THREADS)
+            with (
+                compressor.stream_writer(fileobj, closefd=False) as zstd_writer,
+                tarfile.open(fileobj=zstd_writer, mode="w|") as tar_file,
+            ):
+                yield tar_file
+        case _:
+            raise ValueError(f"{compress_method} is not a tar compress method")
+
+
+# 以流的方式读取 tar 压缩包，fileobj 只需要支持顺序读取
+@contextmanager
+def open_tar_reader(fileobj: BinaryIO, compress_method: CompressMethod) -> Iterator[tarfile.TarFile]:
+    match compress_method:
+        case CompressMethod.tar | CompressMethod.tgz | CompressMethod.txz:
+            mode = {CompressMethod.tar: "r|", CompressMethod.tgz: "r|gz", CompressMethod.txz: "r|xz"}[compress_method]
+            with tarfile.open(fileobj=fileobj, mode=mode) as tar_file:
+                yield tar_file
+        case CompressMethod.tzst:
+            decompressor = zstandard().ZstdDecompressor()
+            with (
+                decompressor.stream_reader(fileobj, closefd=False) as zstd_reader,
+                tarfile.open(fileobj=zstd_reader, mode="r|") as tar_file,
+            ):
+                yield tar_file
+        case _:
+            raise ValueError(f"{compress_method} is not a tar compress method")
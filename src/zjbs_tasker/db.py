@@ -1,21 +1,61 @@
 import asyncio
+import json
+from contextvars import ContextVar
 from datetime import datetime
 from enum import StrEnum
 from pathlib import Path
-from typing import Any
+from typing import Any, NamedTuple
 
 import asyncpg
 import databases
 import sqlalchemy
 from asyncpg import Connection
 from databases import Database
-from ormar import JSON, Boolean, DateTime, Enum, ForeignKey, Integer, Model, ModelMeta, String, Text
+from ormar import JSON, BigInteger, Boolean, DateTime, Enum, ForeignKey, Integer, Model, ModelMeta, String, Text
 from sqlalchemy import MetaData, func
+from sqlalchemy.dialects import postgresql
 from sqlalchemy.sql import expression
 
 from zjbs_tasker.settings import settings
 
-database: Database = databases.Database(settings.DATABASE_URL)
+
+# 数据库连接池的参数，传给 asyncpg.create_pool
+def pool_options() -> dict[str, Any]:
+    return {
+        "min_size": settings.DATABASE_POOL_MIN_SIZE,
+        "max_size": settings.DATABASE_POOL_MAX_SIZE,
+        "statement_cache_size": settings.DATABASE_STATEMENT_CACHE_SIZE,
+        "timeout": settings.DATABASE_CONNECT_TIMEOUT,
+        "command_timeout": settings.DATABASE_COMMAND_TIMEOUT,
+        "max_inactive_connection_lifetime": settings.DATABASE_MAX_INACTIVE_CONNECTION_LIFETIME,
+    }
+
+
+# 当前请求中的查询是否发送到只读副本。由只读接口的依赖 use_read_replica 在执行接口前设置，
+# 因此同一个请求中的所有查询都使用同一个数据库
+reading_replica: ContextVar[bool] = ContextVar("reading_replica", default=False)
+
+
+# 把 reading_replica 为 True 时的查询发送到只读副本，其他查询发送到主库。
+# 只读副本由 API 服务器在启动时连接，没有配置或没有连接（例如在工作进程中）时所有查询都发送到主库
+class RoutingDatabase(Database):
+    def __init__(self, url: str, replica_url: str | None = None, **options: Any) -> None:
+        super().__init__(url, **options)
+        self.replica: Database | None = Database(replica_url, **options) if replica_url else None
+
+    def connection(self) -> databases.core.Connection:
+        if reading_replica.get() and self.replica is not None and self.replica.is_connected:
+            return self.replica.connection()
+        return super().connection()
+
+
+# 只读接口的依赖，使请求中的查询发送到只读副本。
+# 只读副本可能落后于主库，修改后需要立即读到新值的查询（例如填充缓存）不应使用
+async def use_read_replica() -> None:
+    reading_replica.set(True)
+
+
+database: RoutingDatabase = RoutingDatabase(settings.DATABASE_URL, settings.DATABASE_REPLICA_URL, **pool_options())
 metadata: MetaData = sqlalchemy.MetaData()
 
 
@@ -63,6 +103,10 @@ class TaskInterpreter(Model, ModelMixin):
     description: str = Text()
     # 是否有可执行文件
     has_executable: bool = Boolean()
+    # 可执行文件压缩包的SHA-256
+    executable_hash: str | None = short_string(nullable=True)
+    # 可执行文件压缩包的压缩方式
+    executable_compress_method: str = short_string(default="txz")
     # 类型
     type: Type = Enum(enum_class=Type)
     # 可执行文件
@@ -82,10 +126,20 @@ class TaskTemplate(Model, ModelMixin):
     description: str = Text()
     # 是否有脚本
     has_script: bool = Boolean()
+    # 脚本压缩包的SHA-256
+    script_hash: str | None = short_string(nullable=True)
+    # 脚本压缩包的压缩方式
+    script_compress_method: str = short_string(default="txz")
     # 参数
     arguments: list[str] = JSON()
     # 环境变量
     environment: dict[str, Any] = JSON()
+    # 需要的CPU核数，为空时使用默认值
+    cpu: int | None = Integer(nullable=True, minimum=0)
+    # 需要的内存（字节），为空时使用默认值
+    memory: int | None = BigInteger(nullable=True, minimum=0)
+    # 需要的磁盘空间（字节），为空时使用默认值
+    disk: int | None = BigInteger(nullable=True, minimum=0)
 
     # 解释器
     interpreter: TaskInterpreter = ForeignKey(TaskInterpreter, related_name="templates")
@@ -102,12 +156,20 @@ class Task(Model, ModelMixin):
     description: str = Text()
     # 是否有源文件
     has_source_file: bool = Boolean()
+    # 源文件压缩包的压缩方式
+    source_compress_method: str = short_string(default="txz")
     # 参数
     arguments: list[str] = JSON()
     # 环境变量
     environment: dict[str, Any] = JSON()
     # 允许重试的次数
     retry_times: int = Integer(minimum=0)
+    # 需要的CPU核数，为空时使用模板的设置
+    cpu: int | None = Integer(nullable=True, minimum=0)
+    # 需要的内存（字节），为空时使用模板的设置
+    memory: int | None = BigInteger(nullable=True, minimum=0)
+    # 需要的磁盘空间（字节），为空时使用模板的设置
+    disk: int | None = BigInteger(nullable=True, minimum=0)
 
     # 模板
     template: TaskTemplate = ForeignKey(TaskTemplate, related_name="tasks", nullable=False)
@@ -139,11 +201,97 @@ class TaskRun(Model, ModelMixin):
     start_at: datetime | None = DateTime(nullable=True)
     # 结束时间
     end_at: datetime | None = DateTime(nullable=True)
+    # 开始时确定的执行规格，见 model.ExecutionSpec
+    spec: dict[str, Any] | None = JSON(nullable=True)
+    # 各阶段的耗时和资源使用，见 model.TaskRunMetrics
+    metrics: dict[str, Any] | None = JSON(nullable=True)
 
     # 任务
     task: Task = ForeignKey(Task, related_name="runs", nullable=False)
 
 
+# 按主键分页查询。cursor 为上一页最后一条记录的ID，多查询一条记录判断是否还有下一页。
+# 返回记录、下一页的 cursor、总数和总数是否为估计值；只有 is_deleted 一个过滤条件时总数为估计值
+async def fetch_page(
+    model: type[Model], filters: dict[str, Any], cursor: int | None, offset: int, limit: int, with_total: bool
+) -> tuple[list[Model], int | None, int | None, bool]:
+    queryset = model.objects.filter(**filters)
+    page_queryset = queryset if cursor is None else queryset.filter(id__gt=cursor)
+    if any(key.startswith("name__") for key in filters):
+        ids = [row[0] for row in await database.fetch_all(select_matched_ids(page_queryset, offset, limit + 1))]
+        rows = await page_queryset.filter(id__in=ids).order_by("id").all() if ids else []
+    else:
+        rows = await page_queryset.order_by("id").offset(offset).limit(limit + 1).all()
+    next_cursor = rows[limit - 1].id if len(rows) > limit else None
+
+    total = None
+    estimated = False
+    if with_total:
+        if filters == {"is_deleted": False}:
+            total = await estimate_active_row_count(model)
+            estimated = total is not None
+        if total is None:
+            total = await queryset.count()
+    return rows[:limit], next_cursor, total, estimated
+
+
+# 按名称模糊搜索时一页记录的ID。直接按 id 排序分页时，规划器会沿 id 索引逐条检查名称，匹配的记录少时要扫描整个索引；
+# 因此先在物化的 CTE 中通过名称的 trigram 索引找出所有匹配的记录，再排序分页
+def select_matched_ids(queryset: Any, offset: int, limit: int) -> sqlalchemy.sql.Select:
+    table = queryset.model.Meta.table
+    matched = (
+        queryset.build_select_expression()
+        .order_by(None)
+        .with_only_columns(table.c.id)
+        .cte("matched")
+        .prefix_with("MATERIALIZED")
+    )
+    return sqlalchemy.select(matched.c.id).order_by(matched.c.id).offset(offset).limit(limit)
+
+
+# 未删除记录的估计行数，取自查询计划，按统计信息中 is_deleted 的分布扣除了已删除的记录。
+# 表还没有被 ANALYZE 时 pg_class.reltuples 为 -1，没有可用的统计信息，返回 None
+async def estimate_active_row_count(model: type[Model]) -> int | None:
+    reltuples = await database.fetch_val(
+        "SELECT reltuples::BIGINT FROM pg_class WHERE oid = to_regclass(:table)", {"table": model.Meta.tablename}
+    )
+    if reltuples is None or reltuples < 0:
+        return None
+    table = model.Meta.table
+    query = sqlalchemy.select(table.c.id).where(table.c.is_deleted == expression.false())
+    sql = query.compile(dialect=postgresql.dialect(), compile_kwargs={"literal_binds": True})
+    plan = await database.fetch_val(f"EXPLAIN (FORMAT JSON) {sql}")
+    return int(json.loads(plan)[0]["Plan"]["Plan Rows"])
+
+
+class PoolUsage(NamedTuple):
+    # 连接池中的连接数和上限
+    size: int
+    max_size: int
+    # 正在使用的连接数
+    in_use: int
+    # 等待获取连接的协程数
+    waiting: int
+
+
+# 数据库连接池的使用情况，还没有连接时返回 None
+def pool_usage(db: Database | None = database) -> PoolUsage | None:
+    if db is None:
+        return None
+    pool = getattr(db._backend, "_pool", None)
+    if pool is None:
+        return None
+    size = pool.get_size()
+    # asyncpg 没有公开等待连接的数量，取连接队列中等待者的数量
+    waiters = getattr(pool._queue, "_getters", None) or ()
+    return PoolUsage(
+        size=size,
+        max_size=pool.get_max_size(),
+        in_use=size - pool.get_idle_size(),
+        waiting=sum(1 for waiter in waiters if not waiter.done()),
+    )
+
+
 async def run_pg_script(path: Path | str) -> None:
     connection: Connection | None = None
     try:
@@ -0,0 +1,95 @@
+import asyncio
+import os
+import threading
+import time
+from collections.abc import Callable
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, TypeVar
+
+from fastapi import HTTPException
+from loguru import logger
+
+from zjbs_tasker.settings import settings
+
+T = TypeVar("T")
+
+# 排队时间超过该值时记录警告（秒）
+SLOW_QUEUE_WAIT_SECONDS: float = 1.0
+
+
+class ArchiveExecutorBusy(RuntimeError):
+    pass
+
+
+def service_unavailable_exception(message: str) -> HTTPException:
+    return HTTPException(status_code=503, detail=f"service unavailable: {message}", headers={"Retry-After": "5"})
+
+
+# 执行压缩、解压等耗时操作的有界线程池
+#
+# zlib、lzma 和 zstd 在压缩和解压时会释放 GIL，所以线程池就可以利用多个 CPU，
+# 并且任务可以通过 BytePipe 和事件循环交换数据，不需要把整个压缩包复制到其他进程。
+# 已提交但没有完成的任务超过 max_pending 时拒绝新任务，None 表示不限制；任务在队列中的等待时间记录在 wait_* 中
+class ArchiveExecutor:
+    def __init__(self, max_workers: int, max_pending: int | None) -> None:
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self.pending = 0
+        self.completed = 0
+        self.rejected = 0
+        self.wait_count = 0
+        self.wait_seconds_total = 0.0
+        self.wait_seconds_max = 0.0
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers, thread_name_prefix="archive")
+
+    # 提交任务并立即返回，超过排队上限时抛出 ArchiveExecutorBusy
+    def submit(self, func: Callable[..., T], *args: Any) -> asyncio.Future:
+        with self._lock:
+            if self.max_pending is not None and self.pending >= self.max_pending:
+                self.rejected += 1
+                raise ArchiveExecutorBusy(f"{self.pending} archive jobs pending, limit is {self.max_pending}")
+            self.pending += 1
+        submit_time = time.perf_counter()
+
+        def job() -> T:
+            self._record_wait(time.perf_counter() - submit_time)
+            return func(*args)
+
+        try:
+            future = self._executor.submit(job)
+        except BaseException:
+            self._done()
+            raise
+        # 线程中的任务真正结束时才释放名额，等待它的协程被取消时任务可能仍在运行
+        future.add_done_callback(self._done)
+        return asyncio.wrap_future(future)
+
+    async def run(self, func: Callable[..., T], *args: Any) -> T:
+        return await self.submit(func, *args)
+
+    def _record_wait(self, seconds: float) -> None:
+        with self._lock:
+            self.wait_count += 1
+            self.wait_seconds_total += seconds
+            self.wait_seconds_max = max(self.wait_seconds_max, seconds)
+        if seconds >= SLOW_QUEUE_WAIT_SECONDS:
+            logger.warning(f"archive job waited {seconds:.3f}s in queue, {self.pending} jobs pending")
+
+    def _done(self, _: Future | None = None) -> None:
+        with self._lock:
+            self.pending -= 1
+            self.completed += 1
+
+    def shutdown(self) -> None:
+        self._executor.shutdown(wait=True, cancel_futures=True)
+
+
+archive_executor: ArchiveExecutor = ArchiveExecutor(settings.ARCHIVE_WORKERS, settings.ARCHIVE_MAX_PENDING)
+
+# 工作进程解压输入的线程池，和 API 服务器的线程池分开，不拒绝任务。
+# 流式解压在整个下载期间占用一个线程，每个执行槽和每个预取的作业最多同时解压解释器、模板和源文件 3 个输入，
+# 线程数按此计算，不会因为线程都在等待下载而阻塞其他解压。线程在使用时才创建
+worker_archive_executor: ArchiveExecutor = ArchiveExecutor(
+    ((settings.WORKER_SLOTS or os.cpu_count() or 1) + settings.WORKER_PREFETCH_DEPTH) * 3, None
+)
@@ -0,0 +1,221 @@
+import asyncio
+import threading
+import time
+from collections.abc import Iterable, Iterator
+from contextlib import contextmanager
+from typing import Any
+from wsgiref.simple_server import WSGIRequestHandler, make_server
+
+from loguru import logger
+from prometheus_client import REGISTRY, Counter, Gauge, Histogram, generate_latest, make_wsgi_app
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily, Metric
+from prometheus_client.exposition import ThreadingWSGIServer
+from prometheus_client.registry import Collector
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from zjbs_tasker.cancel import running_processes
+from zjbs_tasker.db import database, pool_usage
+from zjbs_tasker.executor import worker_archive_executor
+from zjbs_tasker.model_cache import model_caches
+from zjbs_tasker.resource import collect_queue_stats
+from zjbs_tasker.task_run import count_task_runs_by_status
+
+# 没有匹配到路由的请求使用的 route 标签，避免路径参数导致标签数量无限增长
+UNMATCHED_ROUTE: str = "<unmatched>"
+
+HTTP_REQUEST_SECONDS = Histogram(
+    "tasker_http_request_duration_seconds", "Time spent handling API requests", ["method", "route", "status"]
+)
+FILE_TRANSFER_BYTES = Counter(
+    "tasker_file_transfer_bytes", "Bytes transferred to and from the file server", ["direction"]
+)
+FILE_TRANSFER_SECONDS = Histogram(
+    "tasker_file_transfer_duration_seconds",
+    "Time spent transferring one file to or from the file server",
+    ["direction"],
+    buckets=(0.1, 0.5, 1, 5, 10, 30, 60, 300, 600, 1800, float("inf")),
+)
+QUEUE_LENGTH = Gauge("tasker_queue_length", "Jobs waiting in the queue", ["queue"])
+QUEUE_OLDEST_JOB_AGE = Gauge("tasker_queue_oldest_job_age_seconds", "Wait time of the oldest queued job", ["queue"])
+TASK_RUNS = Gauge("tasker_task_runs", "Task runs by status", ["status"])
+REFRESH_SUCCESS = Gauge("tasker_metrics_refresh_success", "Whether queue and task run metrics were refreshed")
+
+# 事先绑定标签，传输时只需要一次字典查找
+_transfer_bytes = {direction: FILE_TRANSFER_BYTES.labels(direction) for direction in ("download", "upload")}
+_transfer_seconds = {direction: FILE_TRANSFER_SECONDS.labels(direction) for direction in ("download", "upload")}
+
+
+# 记录一次与文件服务器的传输，direction 为 download 或 upload
+def record_transfer(direction: str, size: int, seconds: float) -> None:
+    _transfer_bytes[direction].inc(size)
+    _transfer_seconds[direction].observe(seconds)
+
+
+# 按路由模板记录请求处理时间的 ASGI 中间件
+#
+# 不使用 BaseHTTPMiddleware，不会为每个请求创建额外的任务和流；路由模板在路由匹配后由 FastAPI 写入 scope。
+# 流式响应的时间包含发送整个响应体的时间
+class RequestMetricsMiddleware:
+    def __init__(self, app: ASGIApp) -> None:
+        self.app = app
+        # (method, route, status) -> 绑定了标签的直方图
+        self._histograms: dict[tuple[str, str, str], Any] = {}
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        start = time.perf_counter()
+        status = 500
+
+        async def send_with_status(message: Message) -> None:
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            route = scope.get("route")
+            key = (scope["method"], getattr(route, "path", UNMATCHED_ROUTE), str(status))
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = HTTP_REQUEST_SECONDS.labels(*key)
+            histogram.observe(time.perf_counter() - start)
+
+
+# 采集时读取数据库连接池的使用情况，database 为 primary（主库）或 replica（只读副本）
+class DatabasePoolCollector(Collector):
+    def collect(self) -> Iterable[Metric]:
+        labels = ["database"]
+        size = GaugeMetricFamily("tasker_db_pool_size", "Connections in the database pool", labels=labels)
+        max_size = GaugeMetricFamily(
+            "tasker_db_pool_max_size", "Maximum connections in the database pool", labels=labels
+        )
+        in_use = GaugeMetricFamily("tasker_db_pool_in_use", "Database connections in use", labels=labels)
+        waiting = GaugeMetricFamily(
+            "tasker_db_pool_waiting", "Coroutines waiting for a database connection", labels=labels
+        )
+        for name, db in (("primary", database), ("replica", database.replica)):
+            usage = pool_usage(db)
+            if usage is None:
+                continue
+            size.add_metric([name], usage.size)
+            max_size.add_metric([name], usage.max_size)
+            in_use.add_metric([name], usage.in_use)
+            waiting.add_metric([name], usage.waiting)
+        yield from (size, max_size, in_use, waiting)
+
+
+REGISTRY.register(DatabasePoolCollector())
+
+
+# 采集时读取解释器和模板缓存的计数，layer 为 local（进程内）或 shared（Redis）
+class ModelCacheCollector(Collector):
+    def collect(self) -> Iterable[Metric]:
+        hits = CounterMetricFamily("tasker_model_cache_hits", "Model cache hits", labels=["cache", "layer"])
+        misses = CounterMetricFamily(
+            "tasker_model_cache_misses", "Model cache misses that read the database", labels=["cache"]
+        )
+        invalidations = CounterMetricFamily(
+            "tasker_model_cache_invalidations", "Model cache entries invalidated by this process", labels=["cache"]
+        )
+        entries = GaugeMetricFamily("tasker_model_cache_entries", "Entries in the local model cache", labels=["cache"])
+        for cache in model_caches.values():
+            hits.add_metric([cache.name, "local"], cache.hits)
+            hits.add_metric([cache.name, "shared"], cache.shared_hits)
+            misses.add_metric([cache.name], cache.misses)
+            invalidations.add_metric([cache.name], cache.invalidations)
+            entries.add_metric([cache.name], len(cache))
+        yield from (hits, misses, invalidations, entries)
+
+
+REGISTRY.register(ModelCacheCollector())
+
+
+# 采集时读取工作进程各组件已有的计数，执行任务时不需要额外更新指标
+class WorkerCollector(Collector):
+    def __init__(self, worker: Any) -> None:
+        self.worker = worker
+
+    def collect(self) -> Iterable[Metric]:
+        # 工作进程模块通过 util 导入本模块，在采集时再导入，避免循环导入
+        from zjbs_tasker.worker import artifact_cache, prefetcher
+
+        yield GaugeMetricFamily("tasker_worker_slots", "Task runs the worker can execute at once", self.worker.slots)
+        yield GaugeMetricFamily("tasker_worker_busy_slots", "Task runs being executed", self.worker.running_jobs())
+        yield GaugeMetricFamily(
+            "tasker_archive_pending", "Archive jobs submitted but not finished", worker_archive_executor.pending
+        )
+        for name, value, description in (
+            ("tasker_archive_completed", worker_archive_executor.completed, "Archive jobs finished"),
+            (
+                "tasker_archive_wait_seconds",
+                worker_archive_executor.wait_seconds_total,
+                "Time archive jobs waited for a thread",
+            ),
+            ("tasker_artifact_cache_hits", artifact_cache.hits, "Artifact cache hits"),
+            ("tasker_artifact_cache_misses", artifact_cache.misses, "Artifact cache misses"),
+            ("tasker_artifact_cache_evictions", artifact_cache.evictions, "Artifact cache evictions"),
+            ("tasker_prefetch_hits", prefetcher.hits, "Inputs served by the prefetcher"),
+            ("tasker_prefetch_misses", prefetcher.misses, "Inputs downloaded in the foreground"),
+            ("tasker_prefetch_errors", prefetcher.errors, "Failed prefetches"),
+            ("tasker_prefetch_skipped", prefetcher.skipped, "Prefetches skipped because of the size limit"),
+            ("tasker_prefetch_discarded", prefetcher.discarded, "Prefetched inputs discarded without being used"),
+            ("tasker_prefetch_bytes", prefetcher.bytes_prefetched, "Bytes downloaded by the prefetcher"),
+            ("tasker_task_runs_canceled", running_processes.canceled, "Task run processes terminated by cancellation"),
+        ):
+            yield CounterMetricFamily(name, description, value)
+
+
+# 不把每次抓取指标的请求打印到标准错误
+class SilentRequestHandler(WSGIRequestHandler):
+    def log_message(self, format: str, *args: Any) -> None:
+        pass
+
+
+# 在 port 上导出工作进程的指标，返回实际监听的端口（port 为 0 时随机选择），退出上下文时停止。
+# prometheus-client 0.20 之前的 start_http_server 不返回服务器，无法停止，因此自己创建服务器
+@contextmanager
+def worker_exporter(worker: Any, port: int) -> Iterator[int]:
+    collector = WorkerCollector(worker)
+    REGISTRY.register(collector)
+    try:
+        server = make_server("", port, make_wsgi_app(REGISTRY), ThreadingWSGIServer, handler_class=SilentRequestHandler)
+        thread = threading.Thread(target=server.serve_forever, name="worker-exporter", daemon=True)
+        thread.start()
+        try:
+            logger.info(f"exporting worker metrics on port {server.server_port}")
+            yield server.server_port
+        finally:
+            server.shutdown()
+            server.server_close()
+            thread.join()
+    finally:
+        REGISTRY.unregister(collector)
+
+
+# 更新需要查询 Redis 和数据库的指标，失败时保留上次的值
+async def refresh_server_metrics() -> None:
+    try:
+        queue_stats, task_run_counts = await asyncio.gather(
+            asyncio.to_thread(collect_queue_stats), count_task_runs_by_status()
+        )
+    except Exception as e:
+        logger.warning(f"failed to refresh metrics: {e}")
+        REFRESH_SUCCESS.set(0)
+        return
+    for stats in queue_stats:
+        QUEUE_LENGTH.labels(stats.queue).set(stats.queued)
+        QUEUE_OLDEST_JOB_AGE.labels(stats.queue).set(stats.oldest_wait_seconds or 0.0)
+    for status, count in task_run_counts.items():
+        TASK_RUNS.labels(status.value).set(count)
+    REFRESH_SUCCESS.set(1)
+
+
+# API 服务器 /metrics 的响应内容
+async def render_server_metrics() -> bytes:
+    await refresh_server_metrics()
+    return generate_latest(REGISTRY)
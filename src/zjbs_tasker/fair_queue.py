@@ -0,0 +1,279 @@
+import math
+import time
+from typing import Any
+
+from redis import Redis
+from redis.client import Pipeline
+from rq import Queue
+from rq.exceptions import DequeueTimeout, NoSuchJobError
+from rq.job import Job, JobStatus
+from rq.utils import as_text, backend_class, utcnow
+
+from zjbs_tasker.settings import settings
+
+# 作业 meta 中的优先级和份额名称
+PRIORITY_META: str = "priority"
+SHARE_META: str = "share"
+DEFAULT_SHARE: str = "default"
+# 唤醒等待中的工作进程的令牌最多保留的数量
+WAKEUP_MAX_LEN: int = 100
+
+# 把作业加入优先级 p 中份额 share 的列表，列表由空变为非空时把份额加入优先级 p 的轮转队列末尾
+PUSH_SCRIPT = """
+local prefix, job_id, priority, share, weight, at_front = ARGV[1], ARGV[2], ARGV[3], ARGV[4], ARGV[5], ARGV[6]
+local jobs = prefix .. priority .. ':jobs:' .. share
+if at_front == '1' then
+    redis.call('LPUSH', jobs, job_id)
+else
+    redis.call('RPUSH', jobs, job_id)
+end
+local field = priority .. ':' .. share
+if redis.call('LLEN', jobs) == 1 then
+    redis.call('RPUSH', prefix .. priority .. ':ring', share)
+    redis.call('HSET', prefix .. 'credit', field, weight)
+end
+redis.call('HSET', prefix .. 'weight', field, weight)
+redis.call('ZADD', prefix .. 'priorities', priority, priority)
+redis.call('RPUSH', prefix .. 'wakeup', '1')
+redis.call('LTRIM', prefix .. 'wakeup', -tonumber(ARGV[7]), -1)
+"""
+
+# 先取出直接推入 rq 列表的作业（调度器到期的作业），再从最高优先级的轮转队列头部的份额中取出一个作业。
+# 份额连续取出 weight 个作业后移到轮转队列末尾，列表为空时移出轮转队列。除了查找最高优先级，都是 O(1) 操作
+POP_SCRIPT = """
+local prefix, plain_key = ARGV[1], ARGV[2]
+local job_id = redis.call('LPOP', plain_key)
+if job_id then
+    return job_id
+end
+while true do
+    local top = redis.call('ZREVRANGE', prefix .. 'priorities', 0, 0)
+    if #top == 0 then
+        return false
+    end
+    local priority = top[1]
+    local ring = prefix .. priority .. ':ring'
+    local share = redis.call('LINDEX', ring, 0)
+    if not share then
+        redis.call('ZREM', prefix .. 'priorities', priority)
+    else
+        local jobs = prefix .. priority .. ':jobs:' .. share
+        local field = priority .. ':' .. share
+        job_id = redis.call('LPOP', jobs)
+        if not job_id or redis.call('LLEN', jobs) == 0 then
+            redis.call('LPOP', ring)
+            redis.call('HDEL', prefix .. 'credit', field)
+            redis.call('HDEL', prefix .. 'weight', field)
+            if redis.call('LLEN', ring) == 0 then
+                redis.call('ZREM', prefix .. 'priorities', priority)
+            end
+        elseif redis.call('HINCRBY', prefix .. 'credit', field, -1) <= 0 then
+            redis.call('LMOVE', ring, ring, 'LEFT', 'RIGHT')
+            redis.call('HSET', prefix .. 'credit', field, redis.call('HGET', prefix .. 'weight', field) or 1)
+        end
+        if job_id then
+            return job_id
+        end
+    end
+end
+"""
+
+# 从优先级 p 中份额 share 的列表删除作业，列表变为空时把份额移出轮转队列，之后再入队时份额只在轮转队列中出现一次
+REMOVE_SCRIPT = """
+local prefix, job_id, priority, share = ARGV[1], ARGV[2], ARGV[3], ARGV[4]
+local jobs = prefix .. priority .. ':jobs:' .. share
+local removed = redis.call('LREM', jobs, 1, job_id)
+if removed > 0 and redis.call('LLEN', jobs) == 0 then
+    local ring = prefix .. priority .. ':ring'
+    local field = priority .. ':' .. share
+    redis.call('LREM', ring, 0, share)
+    redis.call('HDEL', prefix .. 'credit', field)
+    redis.call('HDEL', prefix .. 'weight', field)
+    if redis.call('LLEN', ring) == 0 then
+        redis.call('ZREM', prefix .. 'priorities', priority)
+    end
+end
+return removed
+"""
+
+
+def share_weight(share: str) -> int:
+    return max(settings.FAIR_SHARE_WEIGHTS.get(share, settings.FAIR_SHARE_DEFAULT_WEIGHT), 1)
+
+
+# 按优先级和份额加权轮转出队的 rq 队列
+#
+# 作业按 meta 中的 priority（越大越优先）和 share 进入 tasker:fair:<队列>:<优先级>:jobs:<份额> 列表，
+# 同一优先级中不同份额的作业按权重 FAIR_SHARE_WEIGHTS 轮流出队，避免一个提交者的大量作业阻塞其他人。
+# 调度器到期的作业和之前版本提交的作业仍在 rq 原来的列表中，优先出队。
+# 入队时向唤醒列表推入令牌，等待作业的工作进程阻塞在唤醒列表上
+class FairQueue(Queue):
+    @property
+    def fair_prefix(self) -> str:
+        return f"tasker:fair:{self.name}:"
+
+    @property
+    def wakeup_key(self) -> str:
+        return self.fair_prefix + "wakeup"
+
+    def _enqueue_job(self, job: Job, pipeline: Pipeline | None = None, at_front: bool = False) -> Job:
+        if not self._is_async:
+            return super()._enqueue_job(job, pipeline, at_front)
+
+        pipe = pipeline if pipeline is not None else self.connection.pipeline()
+        pipe.sadd(self.redis_queues_keys, self.key)
+        job.redis_server_version = self.get_redis_server_version()
+        job.set_status(JobStatus.QUEUED, pipeline=pipe)
+        job.origin = self.name
+        job.enqueued_at = utcnow()
+        if job.timeout is None:
+            job.timeout = self._default_timeout
+        job.save(pipeline=pipe)
+        job.cleanup(ttl=job.ttl, pipeline=pipe)
+
+        priority = int(job.meta.get(PRIORITY_META, 0))
+        share = str(job.meta.get(SHARE_META, DEFAULT_SHARE))
+        self._script(PUSH_SCRIPT)(
+            args=[self.fair_prefix, job.id, priority, share, share_weight(share), int(at_front), WAKEUP_MAX_LEN],
+            client=pipe,
+        )
+        if pipeline is None:
+            pipe.execute()
+        return job
+
+    def pop_job_id(self) -> str | None:
+        # 队列为空时脚本返回 false，redis-py 将其转换为 None
+        job_id = self._script(POP_SCRIPT)(args=[self.fair_prefix, self.key])
+        return as_text(job_id) if job_id is not None else None
+
+    def remove(self, job_or_id: Job | str, pipeline: Pipeline | None = None) -> Any:
+        job = job_or_id
+        if not isinstance(job, Job):
+            try:
+                job = self.job_class.fetch(job_or_id, connection=self.connection, serializer=self.serializer)
+            except NoSuchJobError:
+                return super().remove(job_or_id, pipeline)
+        priority = int(job.meta.get(PRIORITY_META, 0))
+        share = str(job.meta.get(SHARE_META, DEFAULT_SHARE))
+        self._script(REMOVE_SCRIPT)(
+            args=[self.fair_prefix, job.id, priority, share],
+            client=pipeline if pipeline is not None else self.connection,
+        )
+        return super().remove(job.id, pipeline)
+
+    # 排队中的作业数，需要遍历所有活跃的份额
+    @property
+    def count(self) -> int:
+        keys = self._share_keys()
+        with self.connection.pipeline(transaction=False) as pipeline:
+            pipeline.llen(self.key)
+            for key in keys:
+                pipeline.llen(key)
+            return sum(pipeline.execute())
+
+    # 接下来出队的作业ID的近似顺序：rq 列表中的作业，然后按优先级从高到低、在份额之间轮流
+    def get_job_ids(self, offset: int = 0, length: int = -1) -> list[str]:
+        if length == 0:
+            return []
+        # 每个列表最多需要读取前 offset + length 个作业
+        end = -1 if length < 0 else offset + length - 1
+        limit = math.inf if length < 0 else offset + length
+        job_ids = [as_text(job_id) for job_id in self.connection.lrange(self.key, 0, end)]
+        for keys in self._share_keys_by_priority():
+            if len(job_ids) >= limit:
+                break
+            with self.connection.pipeline(transaction=False) as pipeline:
+                for key in keys:
+                    pipeline.lrange(key, 0, end)
+                share_job_ids = pipeline.execute()
+            for i in range(max(map(len, share_job_ids), default=0)):
+                job_ids.extend(as_text(ids[i]) for ids in share_job_ids if i < len(ids))
+        return job_ids[offset : None if length < 0 else offset + length]
+
+    # 每个份额中最早排队的作业ID
+    def head_job_ids(self) -> list[str]:
+        keys = [self.key, *self._share_keys()]
+        with self.connection.pipeline(transaction=False) as pipeline:
+            for key in keys:
+                pipeline.lindex(key, 0)
+            return [as_text(job_id) for job_id in pipeline.execute() if job_id is not None]
+
+    # 删除队列中的所有作业
+    def empty(self) -> None:
+        keys = self._share_keys()
+        job_ids = [as_text(job_id) for key in keys for job_id in self.connection.lrange(key, 0, -1)]
+        with self.connection.pipeline() as pipeline:
+            for job_id in job_ids:
+                pipeline.delete(self.job_class.key_for(job_id))
+            for key in self.connection.scan_iter(self.fair_prefix + "*"):
+                pipeline.delete(key)
+            pipeline.execute()
+        super().empty()
+
+    @classmethod
+    def dequeue_any(
+        cls,
+        queues: list["FairQueue"],
+        timeout: int | None,
+        connection: Redis | None = None,
+        job_class: type[Job] | None = None,
+        serializer: Any = None,
+        death_penalty_class: Any = None,
+    ) -> tuple[Job, "FairQueue"] | None:
+        job_class = backend_class(cls, "job_class", override=job_class)
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            job_id, queue = None, None
+            for queue in queues:
+                job_id = queue.pop_job_id()
+                if job_id is not None:
+                    break
+            if job_id is None:
+                if deadline is None:
+                    return None
+                remaining = math.ceil(deadline - time.monotonic())
+                if remaining <= 0:
+                    raise DequeueTimeout(timeout, [queue.key for queue in queues])
+                # 调度器直接推入 rq 列表的作业也会唤醒工作进程，此时直接取得作业
+                result = connection.blpop(
+                    [queue.wakeup_key for queue in queues] + [queue.key for queue in queues], remaining
+                )
+                if result is None:
+                    continue
+                key, value = map(as_text, result)
+                queue = next((queue for queue in queues if queue.key == key), None)
+                if queue is None:
+                    continue
+                job_id = value
+
+            try:
+                job = job_class.fetch(job_id, connection=connection, serializer=serializer)
+            except NoSuchJobError:
+                continue
+            except Exception as e:
+                e.job_id = job_id
+                e.queue = queue
+                raise e
+            return job, queue
+
+    def _share_keys(self) -> list[str]:
+        return [key for keys in self._share_keys_by_priority() for key in keys]
+
+    def _share_keys_by_priority(self) -> list[list[str]]:
+        priorities = [
+            as_text(priority) for priority in self.connection.zrevrange(self.fair_prefix + "priorities", 0, -1)
+        ]
+        with self.connection.pipeline(transaction=False) as pipeline:
+            for priority in priorities:
+                pipeline.lrange(f"{self.fair_prefix}{priority}:ring", 0, -1)
+            rings = pipeline.execute()
+        return [
+            [f"{self.fair_prefix}{priority}:jobs:{as_text(share)}" for share in ring]
+            for priority, ring in zip(priorities, rings)
+        ]
+
+    def _script(self, script: str) -> Any:
+        scripts = self.connection.__dict__.setdefault("_tasker_fair_scripts", {})
+        if script not in scripts:
+            scripts[script] = self.connection.register_script(script)
+        return scripts[script]
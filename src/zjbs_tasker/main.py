@@ -1,24 +1,29 @@
 import logging
 import sys
 
-from fastapi import FastAPI, HTTPException, Request
+from fastapi import Depends, FastAPI, HTTPException, Request
 from fastapi.middleware.gzip import GZipMiddleware
-from fastapi.responses import JSONResponse, RedirectResponse
+from fastapi.responses import JSONResponse, RedirectResponse, Response
 from fastapi_crudrouter import OrmarCRUDRouter
 from loguru import logger
 from ormar import Model, NoMatch
+from prometheus_client import CONTENT_TYPE_LATEST
 from zjbs_file_client import close_client, init_client
 
 from zjbs_tasker.api import router as api_router
 from zjbs_tasker.api.interpreter import router as interpreter_router
 from zjbs_tasker.api.template import router as template_router
-from zjbs_tasker.db import Task, TaskRun, database
+from zjbs_tasker.db import Task, TaskRun, database, use_read_replica
+from zjbs_tasker.exporter import RequestMetricsMiddleware, render_server_metrics
+from zjbs_tasker.model_cache import invalidation_listener
 from zjbs_tasker.settings import settings
 
 app: FastAPI = FastAPI(title="ZJBrainSciencePlatform Tasker", description="之江实验室 Brain Science 平台任务平台")
 
 # 中间件
 app.add_middleware(GZipMiddleware, minimum_size=1024)
+# 最后添加的中间件在最外层，记录的时间包含压缩响应的时间
+app.add_middleware(RequestMetricsMiddleware)
 
 # 日志
 logger.remove()
@@ -37,12 +42,28 @@ if settings.DEBUG_MODE:
 async def connect_database() -> None:
     if not database.is_connected:
         await database.connect()
+    # 只有 API 服务器连接只读副本，工作进程的查询都发送到主库
+    if database.replica is not None and not database.replica.is_connected:
+        await database.replica.connect()
 
 
 @app.on_event("shutdown")
 async def disconnect_database() -> None:
     if database.is_connected:
         await database.disconnect()
+    if database.replica is not None and database.replica.is_connected:
+        await database.replica.disconnect()
+
+
+# 接收解释器和模板缓存的失效消息
+@app.on_event("startup")
+async def start_cache_invalidation_listener() -> None:
+    invalidation_listener.start()
+
+
+@app.on_event("shutdown")
+async def stop_cache_invalidation_listener() -> None:
+    await invalidation_listener.stop()
 
 
 # 文件服务客户端
@@ -64,6 +85,12 @@ async def index() -> RedirectResponse:
     raise HTTPException(status_code=404, detail="/ Not Found")
 
 
+# Prometheus 指标
+@app.get("/metrics", include_in_schema=False)
+async def metrics() -> Response:
+    return Response(await render_server_metrics(), media_type=CONTENT_TYPE_LATEST)
+
+
 app.include_router(api_router)
 app.include_router(interpreter_router)
 app.include_router(template_router)
@@ -80,11 +107,14 @@ def crud_router(model: type[Model], *include: str) -> None:
             create_schema=create_update_schema,
             update_schema=create_update_schema,
             tags=["CRUD"],
+            # 查询接口从只读副本读取
+            get_all_route=[Depends(use_read_replica)],
+            get_one_route=[Depends(use_read_replica)],
         )
     )
 
 
-crud_router(Task, "template", "name", "argument", "environment", "retry_times")
+crud_router(Task, "template", "name", "argument", "environment", "retry_times", "cpu", "memory", "disk")
 crud_router(TaskRun, "task", "index", "status", "start_at", "end_at")
 
 
@@ -0,0 +1,79 @@
+import json
+import sys
+import time
+from collections.abc import Iterator
+from contextlib import contextmanager
+from contextvars import ContextVar
+from pathlib import Path
+
+from loguru import logger
+
+from zjbs_tasker.model import TaskRunMetrics
+
+# 当前任务运行的指标，预取等后台协程中为 None
+current_metrics: ContextVar[TaskRunMetrics | None] = ContextVar("current_metrics", default=None)
+
+# 包装进程：启动任务的命令，通过 os.wait4 得到子进程的资源使用并写入文件，以相同的返回值退出。
+# 用法：python -I -S -c RUSAGE_LAUNCHER <资源使用文件> <可执行文件> <参数>...
+RUSAGE_LAUNCHER = """
+import json, os, signal, sys
+try:
+    pid = os.posix_spawnp(sys.argv[2], sys.argv[2:], os.environ)
+except OSError as e:
+    print(f"failed to execute {sys.argv[2]}: {e}", file=sys.stderr)
+    sys.exit(127)
+# 取消时整个进程组收到 SIGTERM，包装进程等待子进程退出后再退出
+signal.signal(signal.SIGTERM, signal.SIG_IGN)
+signal.signal(signal.SIGINT, signal.SIG_IGN)
+_, status, usage = os.wait4(pid, 0)
+with open(sys.argv[1], "w") as file:
+    json.dump(
+        {
+            "cpu_user_seconds": usage.ru_utime,
+            "cpu_system_seconds": usage.ru_stime,
+            "max_rss_bytes": usage.ru_maxrss * 1024,
+            "io_read_bytes": usage.ru_inblock * 512,
+            "io_write_bytes": usage.ru_oublock * 512,
+        },
+        file,
+    )
+code = os.waitstatus_to_exitcode(status)
+if code < 0:
+    signal.signal(-code, signal.SIG_DFL)
+    os.kill(os.getpid(), -code)
+sys.exit(code)
+"""
+
+
+# 记录代码块的耗时，同名的阶段累加
+@contextmanager
+def record_phase(name: str) -> Iterator[None]:
+    start = time.monotonic()
+    try:
+        yield
+    finally:
+        metrics = current_metrics.get()
+        if metrics is not None:
+            metrics.phases[name] = round(metrics.phases.get(name, 0.0) + time.monotonic() - start, 3)
+
+
+def record_bytes_downloaded(size: int) -> None:
+    metrics = current_metrics.get()
+    if metrics is not None:
+        metrics.bytes_downloaded += size
+
+
+# 用包装进程执行命令，资源使用写入 rusage_path
+def wrap_command(exe: str, args: list[str], rusage_path: Path) -> tuple[str, list[str]]:
+    return sys.executable, ["-I", "-S", "-c", RUSAGE_LAUNCHER, str(rusage_path), exe, *args]
+
+
+# 读取包装进程写入的资源使用，包装进程被强制结束时没有结果
+def read_rusage(metrics: TaskRunMetrics, rusage_path: Path) -> None:
+    try:
+        usage = json.loads(rusage_path.read_text(encoding="utf-8"))
+    except (OSError, ValueError) as e:
+        logger.warning(f"resource usage of task run is not available: {e}")
+        return
+    for name, value in usage.items():
+        setattr(metrics, name, value)
@@ -1,10 +1,14 @@
 from datetime import datetime
 from enum import StrEnum
+from typing import Generic, TypeVar
 
 from pydantic import BaseModel, Field
+from pydantic.generics import GenericModel
 
 from zjbs_tasker.db import TaskRun
 
+T = TypeVar("T")
+
 
 def short_string():
     return Field(max_length=255)
@@ -19,6 +23,10 @@ class CompressMethod(StrEnum):
     zip = "zip"
     tgz = "tgz"
     txz = "txz"
+    # 不压缩的 tar 包
+    tar = "tar"
+    # zstd 压缩的 tar 包，支持多线程压缩
+    tzst = "tzst"
 
 
 class BaseTaskRun(BaseModel):
@@ -27,3 +35,113 @@ class BaseTaskRun(BaseModel):
     status: TaskRun.Status
     start_at: datetime | None = None
     end_at: datetime | None = None
+
+
+class StartTaskResult(BaseModel):
+    task_id: int
+    task_run_id: int | None = None
+    index: int | None = None
+    error: str | None = None
+
+
+class TaskRunResponse(BaseModel):
+    id: int
+    task: int
+    index: int
+    status: TaskRun.Status
+    create_at: datetime
+    modified_at: datetime
+    start_at: datetime | None
+    end_at: datetime | None
+
+
+# 任务运行各阶段的耗时和资源使用，时间单位为秒。子进程的资源使用来自 os.wait4，包括它等待过的后代进程
+class TaskRunMetrics(BaseModel):
+    # 作业从入队到开始执行的时间
+    queue_wait_seconds: float | None = None
+    # 各阶段的耗时：load_spec、download:<输入>（流式下载时包括解压）、extract:<输入>、exec、upload
+    phases: dict[str, float] = {}
+    # 使用预取的输入
+    prefetched: list[str] = []
+    # 下载的压缩包字节数
+    bytes_downloaded: int = 0
+    # 上传的结果文件字节数（未压缩）
+    bytes_uploaded: int = 0
+    cpu_user_seconds: float | None = None
+    cpu_system_seconds: float | None = None
+    max_rss_bytes: int | None = None
+    io_read_bytes: int | None = None
+    io_write_bytes: int | None = None
+
+
+# 一项指标在多个任务运行中的统计
+class MetricSummary(BaseModel):
+    name: str
+    count: int
+    total: float
+    mean: float
+    p50: float
+    p95: float
+    max: float
+
+
+# 分页查询的结果，next_cursor 为 None 时没有下一页。total_estimated 为 True 时 total 是根据统计信息得到的估计值
+class Page(GenericModel, Generic[T]):
+    items: list[T]
+    next_cursor: int | None = None
+    total: int | None = None
+    total_estimated: bool = False
+
+
+# 需要下载到工作进程的压缩包
+class ArtifactSpec(BaseModel):
+    # 工作进程缓存中的 key，为 None 时不缓存
+    cache_key: str | None = None
+    # 文件服务器上的路径
+    server_path: str
+    compress_method: CompressMethod
+    # 压缩包中包裹内容的顶层目录名称，支持通配符
+    wrapper: str
+
+
+# 任务运行的资源需求，cpu 为核数，memory 和 disk 为字节数
+class ResourceRequirement(BaseModel):
+    cpu: int = Field(default=1, ge=0)
+    memory: int = Field(default=0, ge=0)
+    disk: int = Field(default=0, ge=0)
+
+
+# 队列的排队情况和作业在队列中的等待时间
+class QueueStats(BaseModel):
+    queue: str
+    # 正在排队的作业数
+    queued: int
+    # 最早排队的作业已经等待的时间（秒）
+    oldest_wait_seconds: float | None = None
+    # 已经开始执行的作业数及其等待时间
+    wait_count: int = 0
+    wait_seconds_total: float = 0.0
+    wait_seconds_avg: float | None = None
+
+
+# 开始任务时确定的执行规格，工作进程只根据它执行任务，不再查询数据库
+class ExecutionSpec(BaseModel):
+    task_id: int
+    task_name: str
+    index: int
+    interpreter: ArtifactSpec | None = None
+    template: ArtifactSpec | None = None
+    source: ArtifactSpec | None = None
+    # 命令行，第一项为可执行文件，在解释器和模板目录中查找
+    command: list[str]
+    # 合并后的环境变量：解释器、模板、任务依次覆盖
+    environment: dict[str, str]
+    # 资源需求，任务的设置覆盖模板的设置
+    resources: ResourceRequirement = Field(default_factory=ResourceRequirement)
+    # 优先级，越大越优先
+    priority: int = 0
+    # 公平分配的份额，同一优先级中不同份额的任务运行轮流执行
+    share: str = "default"
+    # 失败后最多自动重试的次数，以及当前是第几次重试
+    retry_times: int = 0
+    attempt: int = 0
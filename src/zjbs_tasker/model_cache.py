@@ -0,0 +1,171 @@
+import asyncio
+import time
+from collections import OrderedDict
+from collections.abc import Awaitable, Callable
+from typing import Generic, TypeVar
+
+from loguru import logger
+from pydantic import BaseModel
+from redis import RedisError
+
+from zjbs_tasker.server import async_redis_connection
+
+# 缓存失效的 Redis 频道，消息为 "<缓存名称>:<ID>"
+INVALIDATE_CHANNEL: str = "tasker:cache:invalidate"
+# 共享缓存的键前缀
+SHARED_PREFIX: str = "tasker:cache:"
+
+# 一次读取共享缓存的版本号和该版本的缓存项，版本号不存在时为 0
+SHARED_GET_SCRIPT = """
+local version = redis.call('GET', KEYS[1]) or '0'
+return {version, redis.call('GET', KEYS[1] .. ':' .. version)}
+"""
+
+Response = TypeVar("Response", bound=BaseModel)
+
+# 所有缓存，键为缓存名称
+model_caches: dict[str, "ModelCache"] = {}
+
+# 缓存使用的异步 Redis 客户端
+async_redis = async_redis_connection()
+
+
+# 解释器和模板等很少修改的记录的读缓存，缓存的是接口的响应
+#
+# 进程内按最近使用淘汰，可选在 Redis 中共享。修改记录的接口调用 invalidate，通过 INVALIDATE_CHANNEL 通知所有进程删除本地缓存项。
+# 本地缓存项在 ttl 秒后过期，Redis 断开期间错过的失效消息最多影响 ttl 秒。
+# 版本号：invalidate 增加本地的代数和 Redis 中该记录的版本号。读取数据库前后代数不同时不写入本地缓存，
+# 共享缓存项的键包含读取数据库前的版本号，并发的读取不会把修改前的记录放回缓存；旧版本的共享缓存项不会再被读取，过期后由 Redis 删除。
+class ModelCache(Generic[Response]):
+    def __init__(self, name: str, response_class: type[Response], max_size: int, ttl: float, shared: bool) -> None:
+        self.name = name
+        self.response_class = response_class
+        self.max_size = max_size
+        self.ttl = ttl
+        self.shared = shared
+        self.hits = 0
+        self.shared_hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        # ID -> (读取时间, 响应)
+        self._entries: OrderedDict[int, tuple[float, Response]] = OrderedDict()
+        self._generation = 0
+        self._shared_get = async_redis.register_script(SHARED_GET_SCRIPT)
+        model_caches[name] = self
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def _version_key(self, id_: int) -> str:
+        return f"{SHARED_PREFIX}{self.name}:{id_}"
+
+    # 读取 ID 为 id_ 的记录的响应，缓存中没有时调用 load 读取数据库。不缓存不存在的记录
+    async def get(self, id_: int, load: Callable[[int], Awaitable[Response | None]]) -> Response | None:
+        entry = self._entries.get(id_)
+        if entry is not None:
+            if time.monotonic() - entry[0] < self.ttl:
+                self._entries.move_to_end(id_)
+                self.hits += 1
+                return entry[1]
+            del self._entries[id_]
+
+        generation = self._generation
+        version = None
+        if self.shared:
+            try:
+                version, data = await self._shared_get(keys=[self._version_key(id_)])
+                if data is not None:
+                    self.shared_hits += 1
+                    response = self.response_class.parse_raw(data)
+                    self._put(id_, response, generation)
+                    return response
+            except (RedisError, OSError) as e:
+                logger.warning(f"failed to read shared {self.name} cache: {e}")
+
+        self.misses += 1
+        response = await load(id_)
+        if response is None:
+            return None
+        self._put(id_, response, generation)
+        if version is not None:
+            try:
+                await async_redis.set(f"{self._version_key(id_)}:{int(version)}", response.json(), ex=int(self.ttl))
+            except (RedisError, OSError) as e:
+                logger.warning(f"failed to write shared {self.name} cache: {e}")
+        return response
+
+    def _put(self, id_: int, response: Response, generation: int) -> None:
+        # 读取期间有缓存项失效时，读到的可能是修改前的记录
+        if self.max_size <= 0 or generation != self._generation:
+            return
+        self._entries[id_] = (time.monotonic(), response)
+        self._entries.move_to_end(id_)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    # 删除本地缓存项
+    def discard(self, id_: int) -> None:
+        self._generation += 1
+        self._entries.pop(id_, None)
+
+    # 删除所有本地缓存项
+    def clear(self) -> None:
+        self._generation += 1
+        self._entries.clear()
+
+    # 记录被修改后调用：删除本地缓存项，使共享缓存项失效，并通知其他进程
+    async def invalidate(self, id_: int) -> None:
+        self.invalidations += 1
+        self.discard(id_)
+        try:
+            async with async_redis.pipeline(transaction=False) as pipeline:
+                if self.shared:
+                    # 版本号比缓存项多保留一段时间，过期前以旧版本号写入的缓存项都已经过期
+                    pipeline.incr(self._version_key(id_))
+                    pipeline.expire(self._version_key(id_), 2 * int(self.ttl))
+                pipeline.publish(INVALIDATE_CHANNEL, f"{self.name}:{id_}")
+                await pipeline.execute()
+        except (RedisError, OSError) as e:
+            logger.warning(f"failed to invalidate {self.name} {id_} in other processes: {e}")
+
+
+# 处理一条失效消息
+def handle_invalidation(message: str) -> None:
+    name, _, id_ = message.rpartition(":")
+    cache = model_caches.get(name)
+    if cache is not None:
+        cache.discard(int(id_))
+
+
+# 在后台接收失效消息，直到事件循环关闭
+class InvalidationListener:
+    def __init__(self) -> None:
+        self._listener: asyncio.Task | None = None
+
+    def start(self) -> None:
+        if self._listener is None or self._listener.done():
+            self._listener = asyncio.create_task(self.listen())
+
+    async def stop(self) -> None:
+        if self._listener is not None:
+            self._listener.cancel()
+            await asyncio.gather(self._listener, return_exceptions=True)
+            self._listener = None
+
+    # 订阅失效频道，连接断开时重新订阅。断开期间可能错过了消息，订阅后清空本地缓存
+    async def listen(self) -> None:
+        while True:
+            try:
+                async with async_redis_connection(socket_timeout=None) as redis, redis.pubsub() as pubsub:
+                    await pubsub.subscribe(INVALIDATE_CHANNEL)
+                    for cache in model_caches.values():
+                        cache.clear()
+                    async for message in pubsub.listen():
+                        if message["type"] == "message":
+                            handle_invalidation(message["data"].decode())
+            except (RedisError, OSError) as e:
+                logger.warning(f"cache invalidation channel disconnected, resubscribe: {e}")
+                await asyncio.sleep(5)
+
+
+invalidation_listener = InvalidationListener()
@@ -0,0 +1,161 @@
+import asyncio
+import codecs
+import json
+import re
+from collections.abc import AsyncIterator
+from typing import Any, BinaryIO
+
+from httpx import HTTPStatusError
+from loguru import logger
+from redis import RedisError
+from redis import asyncio as async_redis
+from sqlalchemy import select
+from zjbs_file_client import async_client as file_client_module
+
+from zjbs_tasker.db import TaskRun, database
+from zjbs_tasker.settings import FileServerPath, settings
+
+# 任务运行的输出流
+OUTPUT_STREAMS: tuple[str, ...] = ("stdout", "stderr")
+# 读取输出时每次阻塞等待的时间（毫秒），超时后发送心跳并检查任务运行是否已经结束
+TAIL_BLOCK_MILLISECONDS: int = 15000
+# 读取输出时每次最多读取的条数
+TAIL_BATCH_SIZE: int = 100
+# 写入输出时一个 pipeline 中最多写入的条数
+WRITE_BATCH_SIZE: int = 100
+# Redis stream 条目ID的格式：<毫秒时间>-<序号>
+STREAM_ID_PATTERN: re.Pattern = re.compile(r"(\d{1,20})-(\d{1,20})")
+# 运行结束的状态
+FINISHED_STATUSES: frozenset[TaskRun.Status] = frozenset(
+    {TaskRun.Status.success, TaskRun.Status.failed, TaskRun.Status.canceled}
+)
+
+
+def output_stream_key(task_run_id: int) -> str:
+    return f"tasker:output:{task_run_id}"
+
+
+# 把任务运行的输出写入 Redis stream，只保留最近的 max_len 条。Redis 出错时只记录日志，不影响任务运行
+#
+# 输出先放入最多 queue_size 条的队列，由后台协程批量写入 Redis，读取子进程输出的协程不等待 Redis。
+# Redis 变慢或者没有响应时队列满，丢弃新的输出，子进程不会因为管道写满而阻塞
+class OutputStream:
+    def __init__(self, redis: async_redis.Redis, task_run_id: int, max_len: int, ttl: int, queue_size: int) -> None:
+        self.redis = redis
+        self.key = output_stream_key(task_run_id)
+        self.max_len = max_len
+        self.ttl = ttl
+        self.dropped = 0
+        self._broken = False
+        # 结束标记之后放入 None，后台协程收到后退出
+        self._queue: asyncio.Queue[dict[str, Any] | None] = asyncio.Queue(queue_size)
+        self._writer = asyncio.create_task(self._write_entries())
+
+    def write(self, stream: str, data: bytes) -> None:
+        if self._broken:
+            return
+        try:
+            self._queue.put_nowait({"stream": stream, "data": data})
+        except asyncio.QueueFull:
+            self.dropped += 1
+
+    # 写入结束标记，读取方收到后结束。等待队列中的输出写入 Redis，Redis 没有响应时最多等待客户端的超时时间
+    async def close(self, return_code: int | None) -> None:
+        if not self._writer.done():
+            await self._queue.put({"event": "end", "return_code": "" if return_code is None else str(return_code)})
+            await self._queue.put(None)
+            await self._writer
+        if self.dropped:
+            logger.warning(f"dropped {self.dropped} output chunks because redis could not keep up")
+
+    async def _write_entries(self) -> None:
+        while True:
+            entries = [await self._queue.get()]
+            while len(entries) < WRITE_BATCH_SIZE and not self._queue.empty():
+                entries.append(self._queue.get_nowait())
+            closed = entries[-1] is None
+            if not self._broken:
+                await self._add([fields for fields in entries if fields is not None])
+            if closed:
+                return
+
+    async def _add(self, entries: list[dict[str, Any]]) -> None:
+        try:
+            async with self.redis.pipeline(transaction=False) as pipeline:
+                for fields in entries:
+                    pipeline.xadd(self.key, fields, maxlen=self.max_len, approximate=True)
+                pipeline.expire(self.key, self.ttl)
+                await pipeline.execute()
+        except (RedisError, OSError) as e:
+            logger.warning(f"failed to write output to redis, stop streaming output: {e}")
+            self._broken = True
+
+
+# 把子进程的输出同时写入文件和 Redis
+async def tee_output(
+    reader: asyncio.StreamReader, file: BinaryIO, stream: str, output: OutputStream, chunk_size: int
+) -> None:
+    while chunk := await reader.read(chunk_size):
+        file.write(chunk)
+        output.write(stream, chunk)
+
+
+# 是否为合法的 Redis stream 条目ID，用于校验客户端传入的 Last-Event-ID
+def is_stream_id(value: str) -> bool:
+    match = STREAM_ID_PATTERN.fullmatch(value)
+    return match is not None and all(int(part) < 2**64 for part in match.groups())
+
+
+def sse_event(event: str, data: Any, event_id: str | None = None) -> str:
+    lines = [] if event_id is None else [f"id: {event_id}"]
+    lines.append(f"event: {event}")
+    lines.append(f"data: {json.dumps(data, ensure_ascii=False)}")
+    return "\n".join(lines) + "\n\n"
+
+
+# 以 Server-Sent Events 的格式实时读取任务运行的输出，从 last_event_id 之后开始。
+# 输出事件的 data 为 JSON 字符串；运行结束时发送 end 事件。Redis 中的输出过期后读取上传的结果文件中的输出
+async def tail_output(
+    redis: async_redis.Redis, task_run: TaskRun, last_event_id: str | None = None
+) -> AsyncIterator[str]:
+    key = output_stream_key(task_run.id)
+    last_id = last_event_id or "0-0"
+    decoders = {stream: codecs.getincrementaldecoder("utf-8")("replace") for stream in OUTPUT_STREAMS}
+    while True:
+        response = await redis.xread({key: last_id}, count=TAIL_BATCH_SIZE, block=TAIL_BLOCK_MILLISECONDS)
+        if response:
+            for entry_id, fields in response[0][1]:
+                last_id = entry_id.decode()
+                if b"event" in fields:
+                    yield sse_event("end", {"return_code": fields[b"return_code"].decode() or None}, last_id)
+                    return
+                stream = fields[b"stream"].decode()
+                yield sse_event(stream, decoders[stream].decode(fields[b"data"]), last_id)
+            continue
+
+        # 没有新的输出时检查运行是否已经结束。工作进程异常退出时没有结束标记
+        task_run_table = TaskRun.Meta.table
+        status = await database.fetch_val(select(task_run_table.c.status).where(task_run_table.c.id == task_run.id))
+        if status in FINISHED_STATUSES:
+            if last_event_id is None and not await redis.exists(key):
+                async for event in uploaded_output(task_run):
+                    yield event
+            yield sse_event("end", {"return_code": None})
+            return
+        yield ": keep-alive\n\n"
+
+
+# 从文件服务器上读取运行结束后上传的输出
+async def uploaded_output(task_run: TaskRun) -> AsyncIterator[str]:
+    run_dir = FileServerPath.run_dir(task_run.task.id, task_run.task.name, task_run.index)
+    for stream in OUTPUT_STREAMS:
+        decoder = codecs.getincrementaldecoder("utf-8")("replace")
+        try:
+            async with file_client_module.client.stream(
+                "POST", "/download-file", params={"path": f"{run_dir}/{stream}.txt"}
+            ) as response:
+                response.raise_for_status()
+                async for chunk in response.aiter_bytes(settings.OUTPUT_CHUNK_SIZE):
+                    yield sse_event(stream, decoder.decode(chunk))
+        except HTTPStatusError as e:
+            logger.info(f"output {stream} of task run {task_run.id} is not available: {e}")
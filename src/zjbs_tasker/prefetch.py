@@ -0,0 +1,144 @@
+import asyncio
+import contextvars
+from collections.abc import Awaitable, Callable
+from typing import NamedTuple
+
+from loguru import logger
+
+from zjbs_tasker.model import ExecutionSpec
+
+
+# 任务运行需要的一个输入，key 在所有输入中唯一
+class PrefetchInput(NamedTuple):
+    key: str
+    # 下载输入，返回下载的字节数；输入已经存在时返回 None
+    fetch: Callable[[], Awaitable[int | None]]
+    # 预取的输入不再需要时删除，None 表示由缓存自行淘汰
+    discard: Callable[[], None] | None = None
+
+
+# 在当前任务运行时预取队列中接下来几个作业的输入
+#
+# 只查看队列而不取出作业，作业可能被其他工作进程取走，因此已预取但还没有使用的输入总大小不超过 max_size，
+# 不在队列前 depth 个作业中的输入会被丢弃。任务运行开始时调用 claim 领取输入：正在预取时等待预取完成，
+# 预取过的输入计入 hits；前台下载的输入由调用方计入 misses
+class Prefetcher:
+    def __init__(
+        self,
+        depth: int,
+        max_size: int,
+        peek: Callable[[int], list[tuple[int, ExecutionSpec]]],
+        inputs: Callable[[ExecutionSpec], list[PrefetchInput]],
+    ) -> None:
+        self.depth = depth
+        self.max_size = max_size
+        self.peek = peek
+        self.inputs = inputs
+        self.hits = 0
+        self.misses = 0
+        self.errors = 0
+        self.skipped = 0
+        self.discarded = 0
+        self.bytes_prefetched = 0
+        # 已预取但还没有被领取的输入 -> (大小, 删除函数)
+        self._prefetched: dict[str, tuple[int, Callable[[], None] | None]] = {}
+        self._fetching: dict[str, asyncio.Task] = {}
+        self._wanted: set[str] = set()
+        self._task: asyncio.Task | None = None
+        self._requested = False
+
+    @property
+    def enabled(self) -> bool:
+        return self.depth > 0 and self.max_size > 0
+
+    @property
+    def pending_size(self) -> int:
+        return sum(size for size, _ in self._prefetched.values())
+
+    @property
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    # 输入是否被队列中的作业需要
+    def wanted(self, key: str) -> bool:
+        return key in self._wanted or key in self._fetching
+
+    # 在后台查看队列并预取，正在预取时在本轮结束后重新查看一次
+    def schedule(self) -> None:
+        if not self.enabled:
+            return
+        if self._task is not None and not self._task.done():
+            self._requested = True
+            return
+        # 不继承调用方任务运行的上下文，预取的日志不写入该任务运行的日志文件
+        self._task = asyncio.create_task(self._run(), context=contextvars.Context())
+
+    # 领取输入，返回输入是否是预取的
+    async def claim(self, key: str) -> bool:
+        self._wanted.discard(key)
+        fetching = self._fetching.get(key)
+        if fetching is not None:
+            await asyncio.wait([fetching])
+        prefetched = self._prefetched.pop(key, None)
+        if prefetched is None:
+            return False
+        self.hits += 1
+        return True
+
+    async def close(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def _run(self) -> None:
+        while True:
+            self._requested = False
+            try:
+                queued = await asyncio.to_thread(self.peek, self.depth)
+            except Exception as e:
+                self.errors += 1
+                logger.warning(f"failed to peek queued task runs: {e}")
+                return
+
+            inputs: dict[str, PrefetchInput] = {}
+            for _, spec in queued:
+                for prefetch_input in self.inputs(spec):
+                    inputs.setdefault(prefetch_input.key, prefetch_input)
+            self._wanted = set(inputs)
+            self._discard_unwanted()
+
+            for key, prefetch_input in inputs.items():
+                if key in self._prefetched:
+                    continue
+                if self.pending_size >= self.max_size:
+                    self.skipped += 1
+                    continue
+                await self._fetch(prefetch_input)
+
+            if not self._requested:
+                return
+
+    async def _fetch(self, prefetch_input: PrefetchInput) -> None:
+        task = asyncio.create_task(prefetch_input.fetch())
+        self._fetching[prefetch_input.key] = task
+        try:
+            size = await task
+        except Exception as e:
+            self.errors += 1
+            logger.warning(f"failed to prefetch {prefetch_input.key}: {e}")
+            return
+        finally:
+            del self._fetching[prefetch_input.key]
+        if size is not None:
+            self._prefetched[prefetch_input.key] = (size, prefetch_input.discard)
+            self.bytes_prefetched += size
+            logger.info(f"prefetched {prefetch_input.key}, size {size}")
+
+    def _discard_unwanted(self) -> None:
+        for key in [key for key in self._prefetched if key not in self._wanted]:
+            _, discard = self._prefetched.pop(key)
+            self.discarded += 1
+            if discard is not None:
+                discard()
@@ -0,0 +1,146 @@
+import os
+import shutil
+
+from redis import Redis
+from rq.job import Job
+from rq.utils import utcnow
+
+from zjbs_tasker.fair_queue import FairQueue
+from zjbs_tasker.model import QueueStats, ResourceRequirement
+from zjbs_tasker.server import redis_connection
+from zjbs_tasker.settings import ResourceClass, settings
+
+# 之前版本使用的唯一队列，其中的作业没有资源需求；工作进程监听该队列时自动加入容量允许的资源类别队列
+LEGACY_QUEUE_NAME: str = "tasker"
+# 作业在队列中等待时间的统计，每个队列一个 Redis hash
+QUEUE_WAIT_KEY_PREFIX: str = "tasker:queue-wait:"
+# 每个工作进程自己的队列，用于把重试交给之前执行失败的工作进程
+WORKER_QUEUE_PREFIX: str = "tasker:worker:"
+
+
+def resource_queue_name(resource_class: ResourceClass) -> str:
+    return f"{LEGACY_QUEUE_NAME}:{resource_class.name}"
+
+
+def worker_queue_name(worker_name: str) -> str:
+    return WORKER_QUEUE_PREFIX + worker_name
+
+
+def fits(requirement: ResourceRequirement | ResourceClass, capacity: ResourceRequirement | ResourceClass) -> bool:
+    return (
+        requirement.cpu <= capacity.cpu and requirement.memory <= capacity.memory and requirement.disk <= capacity.disk
+    )
+
+
+# 能满足资源需求的最小类别，没有时返回 None
+def resource_class_for(requirement: ResourceRequirement) -> ResourceClass | None:
+    return next(
+        (resource_class for resource_class in settings.RESOURCE_CLASSES if fits(requirement, resource_class)), None
+    )
+
+
+# 作业按资源需求进入的资源类别队列
+def job_queue_name(requirement: ResourceRequirement) -> str:
+    resource_class = resource_class_for(requirement)
+    if resource_class is None:
+        raise ValueError(f"no resource class fits requirement {requirement}")
+    return resource_queue_name(resource_class)
+
+
+# 从队列取出作业前剩余容量需要满足的资源，旧队列和其他队列使用默认的资源需求。
+# 资源类别队列为该类别的资源上限；最小的类别不超过工作进程的容量，因此任何工作进程都会运行最小类别的作业，
+# 容量小于最小类别上限的工作进程不会因为容量不够而不运行任何作业
+def queue_limit(queue_name: str, capacity: ResourceRequirement) -> ResourceRequirement | ResourceClass:
+    for i, resource_class in enumerate(settings.RESOURCE_CLASSES):
+        if resource_queue_name(resource_class) == queue_name:
+            if i > 0:
+                return resource_class
+            return ResourceRequirement(
+                cpu=min(resource_class.cpu, capacity.cpu),
+                memory=min(resource_class.memory, capacity.memory),
+                disk=min(resource_class.disk, capacity.disk),
+            )
+    return ResourceRequirement()
+
+
+# 作业的资源需求，之前版本提交的作业使用默认的资源需求
+def job_requirement(job: Job) -> ResourceRequirement:
+    if len(job.args) >= 2 and isinstance(job.args[1], dict) and "resources" in job.args[1]:
+        return ResourceRequirement.parse_obj(job.args[1]["resources"])
+    return ResourceRequirement()
+
+
+# 当前工作进程的资源容量，未配置的部分自动检测。磁盘空间为工作目录所在磁盘当前的剩余空间，每次调用时重新检测
+def worker_capacity() -> ResourceRequirement:
+    memory = settings.WORKER_MEMORY
+    if not memory:
+        memory = os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES")
+    disk = settings.WORKER_DISK
+    if not disk:
+        settings.WORKER_WORKING_DIR.mkdir(parents=True, exist_ok=True)
+        disk = shutil.disk_usage(settings.WORKER_WORKING_DIR).free
+    return ResourceRequirement(cpu=settings.WORKER_CPU or os.cpu_count() or 1, memory=memory, disk=disk)
+
+
+# 所有可能运行的队列。旧队列在前，其余按资源类别从大到小排列，使容量大的工作进程优先运行大作业
+def all_queue_names() -> list[str]:
+    return [LEGACY_QUEUE_NAME, *(resource_queue_name(c) for c in reversed(settings.RESOURCE_CLASSES))]
+
+
+# 容量能够运行的队列，顺序同 all_queue_names，总是包含旧队列和最小的资源类别
+def queue_names_for_capacity(capacity: ResourceRequirement) -> list[str]:
+    return [name for name in all_queue_names() if fits(queue_limit(name, capacity), capacity)]
+
+
+# 容量能否满足最小资源类别的上限。不满足时仍然运行最小类别的作业，但其中资源需求较大的作业可能资源不足
+def covers_smallest_class(capacity: ResourceRequirement) -> bool:
+    return fits(settings.RESOURCE_CLASSES[0], capacity)
+
+
+# 记录作业开始执行前在队列中等待的时间
+def record_queue_wait(connection: Redis, job: Job) -> None:
+    if job.enqueued_at is None:
+        return
+    seconds = max((utcnow() - job.enqueued_at).total_seconds(), 0.0)
+    with connection.pipeline(transaction=False) as pipeline:
+        pipeline.hincrby(QUEUE_WAIT_KEY_PREFIX + job.origin, "count", 1)
+        pipeline.hincrbyfloat(QUEUE_WAIT_KEY_PREFIX + job.origin, "seconds_total", seconds)
+        pipeline.execute()
+
+
+# 所有资源类别队列和旧队列的排队情况，最早排队的作业在各份额的头部作业中
+def collect_queue_stats() -> list[QueueStats]:
+    queues = [
+        FairQueue(name, connection=redis_connection)
+        for name in (LEGACY_QUEUE_NAME, *(resource_queue_name(c) for c in settings.RESOURCE_CLASSES))
+    ]
+    head_job_ids = [queue.head_job_ids() for queue in queues]
+    with redis_connection.pipeline(transaction=False) as pipeline:
+        for queue in queues:
+            pipeline.hgetall(QUEUE_WAIT_KEY_PREFIX + queue.name)
+        waits = pipeline.execute()
+
+    enqueued_at = {
+        job.id: job.enqueued_at
+        for job in Job.fetch_many(
+            [job_id for job_ids in head_job_ids for job_id in job_ids], connection=redis_connection
+        )
+        if job is not None and job.enqueued_at is not None
+    }
+    now = utcnow()
+    stats = []
+    for queue, job_ids, wait in zip(queues, head_job_ids, waits):
+        oldest = min((enqueued_at[job_id] for job_id in job_ids if job_id in enqueued_at), default=None)
+        wait_count = int(wait.get(b"count", 0))
+        wait_seconds_total = float(wait.get(b"seconds_total", 0.0))
+        stats.append(
+            QueueStats(
+                queue=queue.name,
+                queued=queue.count,
+                oldest_wait_seconds=(now - oldest).total_seconds() if oldest is not None else None,
+                wait_count=wait_count,
+                wait_seconds_total=wait_seconds_total,
+                wait_seconds_avg=wait_seconds_total / wait_count if wait_count else None,
+            )
+        )
+    return stats
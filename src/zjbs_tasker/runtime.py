@@ -0,0 +1,338 @@
+import asyncio
+import os
+import threading
+from collections.abc import Coroutine
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import wait as wait_futures
+from contextlib import nullcontext
+from contextvars import ContextVar
+from typing import Any
+
+from rq import SimpleWorker
+from rq.exceptions import NoSuchJobError
+from rq.job import Job
+from rq.queue import Queue
+from rq.registry import ScheduledJobRegistry
+from rq.timeouts import TimerDeathPenalty
+from rq.worker import StopRequested, WorkerStatus
+from zjbs_file_client import close_client, init_client
+
+from zjbs_tasker.cancel import running_processes
+from zjbs_tasker.db import database
+from zjbs_tasker.exporter import worker_exporter
+from zjbs_tasker.fair_queue import FairQueue
+from zjbs_tasker.model import ResourceRequirement
+from zjbs_tasker.resource import (
+    LEGACY_QUEUE_NAME,
+    all_queue_names,
+    covers_smallest_class,
+    fits,
+    job_queue_name,
+    job_requirement,
+    queue_limit,
+    record_queue_wait,
+    worker_capacity,
+    worker_queue_name,
+)
+from zjbs_tasker.settings import settings
+
+
+# 长期运行的事件循环，在整个工作进程生命周期内共享数据库连接池和文件服务客户端
+class WorkerRuntime:
+    def __init__(self, worker: "TaskerWorker") -> None:
+        self.worker = worker
+        self.loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self.loop.run_forever, name="tasker-runtime", daemon=True)
+
+    def start(self) -> None:
+        self._thread.start()
+        self.run(self._open())
+
+    def stop(self) -> None:
+        try:
+            self.run(self._close())
+        finally:
+            self.loop.call_soon_threadsafe(self.loop.stop)
+            self._thread.join()
+            self.loop.close()
+
+    def run(self, coroutine: Coroutine) -> Any:
+        future = asyncio.run_coroutine_threadsafe(coroutine, self.loop)
+        try:
+            # 定期醒来，使 TimerDeathPenalty 从其他线程发出的超时异常能够送达
+            while not future.done():
+                wait_futures([future], timeout=1)
+            return future.result()
+        except BaseException:
+            # 任务超时或者工作进程被要求退出时，取消正在运行的协程
+            future.cancel()
+            raise
+
+    @staticmethod
+    async def _open() -> None:
+        if not database.is_connected:
+            await database.connect()
+        await init_client(settings.FILE_SERVER_URL, timeout=60)
+        running_processes.start()
+
+    @staticmethod
+    async def _close() -> None:
+        # 取消预取、接收取消消息等后台协程
+        background = [task for task in asyncio.all_tasks() if task is not asyncio.current_task()]
+        for task in background:
+            task.cancel()
+        await asyncio.gather(*background, return_exceptions=True)
+        await close_client()
+        if database.is_connected:
+            await database.disconnect()
+
+
+# 当前工作进程的运行时，只在 TaskerWorker 中存在
+runtime: WorkerRuntime | None = None
+
+
+# 正在执行的作业，协程在事件循环中执行时复制调用线程的上下文，因此也能读取
+current_job: ContextVar[Job | None] = ContextVar("current_job", default=None)
+
+
+class TaskerJob(Job):
+    def _execute(self) -> Any:
+        token = current_job.set(self)
+        try:
+            result = self.func(*self.args, **self.kwargs)
+            if asyncio.iscoroutine(result):
+                if runtime is not None:
+                    return runtime.run(result)
+                return asyncio.run(result)
+            return result
+        finally:
+            current_job.reset(token)
+
+
+# 不再为每个任务 fork 进程，而是在同一个事件循环中以协程方式执行任务
+#
+# 监听 tasker 队列时自动加入所有资源类别队列，每次取出作业前按资源容量（WORKER_CPU、WORKER_MEMORY、WORKER_DISK）
+# 选择能够运行的队列，最小的资源类别总是可以运行。未配置 WORKER_DISK 时磁盘容量为当前的剩余空间，每次重新检测。
+# 工作进程信息中记录启动时的资源容量。队列中的作业按优先级和份额公平出队。
+# 工作进程优先从自己的队列 tasker:worker:<名称> 取出作业，其中是交给它的重试
+# 用法：rq worker --worker-class zjbs_tasker.runtime.TaskerWorker tasker
+class TaskerWorker(SimpleWorker):
+    job_class = TaskerJob
+    queue_class = FairQueue
+    # 同时执行的任务运行数
+    slots: int = 1
+
+    def __init__(self, queues: Any, *args, **kwargs) -> None:
+        # rq 命令行默认会传入 rq.job.Job，这里替换为能够复用事件循环的 TaskerJob
+        if kwargs.get("job_class") in (None, Job, "rq.job.Job"):
+            kwargs["job_class"] = TaskerJob
+        # 同样把默认的 rq.Queue 替换为按优先级和份额公平出队的 FairQueue
+        if kwargs.get("queue_class") in (None, Queue, "rq.Queue", "rq.queue.Queue"):
+            kwargs["queue_class"] = FairQueue
+        super().__init__(expand_queues(queues), *args, **kwargs)
+        self.worker_queue = self.queue_class(
+            worker_queue_name(self.name),
+            connection=self.connection,
+            job_class=self.job_class,
+            serializer=self.serializer,
+        )
+        self.queues.insert(0, self.worker_queue)
+        self._ordered_queues = self.queues[:]
+        self._covers_smallest_class = True
+
+    # 当前的资源容量
+    @property
+    def capacity(self) -> ResourceRequirement:
+        return worker_capacity()
+
+    # 剩余容量 free 能够运行的队列，自己的队列中交给自己的重试在开始前已经确认过资源足够
+    def eligible_queues(self, capacity: ResourceRequirement, free: ResourceRequirement) -> list[Queue]:
+        if covers_smallest_class(capacity) != self._covers_smallest_class:
+            self._covers_smallest_class = not self._covers_smallest_class
+            if not self._covers_smallest_class:
+                self.log.warning(
+                    f"Worker {self.key}: capacity {capacity} is below the smallest resource class "
+                    f"{settings.RESOURCE_CLASSES[0]}, only running its jobs on a best-effort basis"
+                )
+        return [
+            queue
+            for queue in self.queues
+            if queue is self.worker_queue or fits(queue_limit(queue.name, capacity), free)
+        ]
+
+    def dequeue_job_and_maintain_ttl(self, timeout: int | None, max_idle_time: int | None = None) -> Any:
+        capacity = self.capacity
+        self._ordered_queues = self.eligible_queues(capacity, capacity)
+        return super().dequeue_job_and_maintain_ttl(timeout, max_idle_time)
+
+    def work(self, *args, **kwargs) -> bool:
+        global runtime
+        runtime = WorkerRuntime(self)
+        runtime.start()
+        port = settings.WORKER_METRICS_PORT
+        try:
+            with worker_exporter(self, port) if port is not None else nullcontext():
+                return super().work(*args, **kwargs)
+        finally:
+            try:
+                runtime.stop()
+            finally:
+                runtime = None
+
+    def register_birth(self) -> None:
+        super().register_birth()
+        self.connection.hset(self.key, "capacity", self.capacity.json())
+
+    def prepare_job_execution(self, job: Job, remove_from_intermediate_queue: bool = False) -> None:
+        super().prepare_job_execution(job, remove_from_intermediate_queue)
+        record_queue_wait(self.connection, job)
+
+    # 现在能否立即开始资源需求为 requirement 的作业
+    def accepts(self, requirement: ResourceRequirement) -> bool:
+        return self.get_state() != WorkerStatus.BUSY and fits(requirement, self.capacity)
+
+    # 正在执行的作业数
+    def running_jobs(self) -> int:
+        return 1 if self.get_state() == WorkerStatus.BUSY else 0
+
+    # 把等待重试的作业从调度队列移到自己的队列，作业已经被调度器入队时返回 False
+    def claim_retry(self, job_id: str) -> bool:
+        try:
+            job = self.job_class.fetch(job_id, connection=self.connection, serializer=self.serializer)
+        except NoSuchJobError:
+            return False
+        registry = ScheduledJobRegistry(
+            job.origin, connection=self.connection, job_class=self.job_class, serializer=self.serializer
+        )
+        if not registry.remove(job):
+            return False
+        self.worker_queue.enqueue_job(job)
+        return True
+
+    # 退出前把自己队列中还没有执行的作业放回资源类别队列
+    def teardown(self) -> None:
+        for job_id in self.worker_queue.get_job_ids():
+            job = self.worker_queue.fetch_job(job_id)
+            if job is None:
+                continue
+            self.worker_queue.remove(job)
+            queue = self.queue_class(
+                job_queue_name(job_requirement(job)), connection=self.connection, serializer=self.serializer
+            )
+            queue.enqueue_job(job)
+            self.log.info(f"Worker {self.key}: moved job {job.id} back to queue {queue.name}")
+        super().teardown()
+
+
+# 把 tasker 队列展开为旧队列和所有资源类别队列，其他队列保持不变。
+# 返回队列名称，由工作进程创建 queue_class 的队列，命令行传入的 rq.Queue 也会被替换
+def expand_queues(queues: Any) -> list[str]:
+    expanded = []
+    for queue in [queues] if isinstance(queues, (str, Queue)) else queues:
+        name = queue.name if isinstance(queue, Queue) else queue
+        if name == LEGACY_QUEUE_NAME:
+            expanded.extend(all_queue_names())
+        else:
+            expanded.append(name)
+    return expanded
+
+
+# 在一个工作进程中同时执行多个任务运行
+#
+# 主线程负责从队列取出作业，每个作业在一个执行槽线程中运行，协程都在共享的事件循环中执行，
+# 因此所有任务运行共享数据库连接池和文件服务客户端。执行槽数由 WORKER_SLOTS 决定，0 表示使用 CPU 数。
+# 正在运行的作业占用各自需求的资源，只从资源上限不超过剩余容量的队列取出作业。
+# 收到 SIGTERM 后不再取出新的作业，等待正在运行的作业结束后退出；再次收到时立即退出。
+# rq 的 max_jobs 限制的是取出的作业数：取出 max_jobs 个作业后不再取出新的作业，等待它们执行完后退出。
+# 用法：rq worker --worker-class zjbs_tasker.runtime.ConcurrentTaskerWorker tasker
+class ConcurrentTaskerWorker(TaskerWorker):
+    # 信号只能在主线程中处理，作业超时改为由计时器线程抛出异常
+    death_penalty_class = TimerDeathPenalty
+
+    def __init__(self, *args, **kwargs) -> None:
+        super().__init__(*args, **kwargs)
+        self.slots = settings.WORKER_SLOTS or os.cpu_count() or 1
+        self._running: dict[str, ResourceRequirement] = {}
+        self._changed = threading.Condition()
+        self._slot_executor: ThreadPoolExecutor | None = None
+
+    def work(self, *args, **kwargs) -> bool:
+        self._slot_executor = ThreadPoolExecutor(self.slots, thread_name_prefix="slot")
+        self.log.info(f"Worker {self.key}: running up to {self.slots} jobs concurrently, capacity {self.capacity}")
+        return super().work(*args, **kwargs)
+
+    # 剩余的资源容量
+    def free_capacity(self, capacity: ResourceRequirement | None = None) -> ResourceRequirement:
+        capacity = capacity or self.capacity
+        running = self._running.values()
+        return ResourceRequirement(
+            cpu=capacity.cpu - sum(requirement.cpu for requirement in running),
+            memory=capacity.memory - sum(requirement.memory for requirement in running),
+            disk=capacity.disk - sum(requirement.disk for requirement in running),
+        )
+
+    # 有空闲的执行槽，且有队列中的作业一定能放下时才从这些队列取出作业
+    def dequeue_job_and_maintain_ttl(self, timeout: int | None, max_idle_time: int | None = None) -> Any:
+        while True:
+            with self._changed:
+                while True:
+                    if self._stop_requested:
+                        raise StopRequested()
+                    if len(self._running) < self.slots:
+                        capacity = self.capacity
+                        self._ordered_queues = self.eligible_queues(capacity, self.free_capacity(capacity))
+                        if self._ordered_queues:
+                            break
+                    if not self._changed.wait(timeout=5):
+                        self.heartbeat()
+                restricted = len(self._ordered_queues) < len(self.queues)
+            # 有队列因为正在运行的作业占用资源而被排除时，每秒重新选择一次队列，作业结束后能及时从这些队列取出作业。
+            # 此时有作业在运行，工作进程不是空闲的，不需要计算空闲时间。burst 模式不等待，保持原来的行为
+            restricted = restricted and timeout is not None
+            # 队列已经按剩余容量选择，不再使用 TaskerWorker 按整个容量的选择
+            result = SimpleWorker.dequeue_job_and_maintain_ttl(self, timeout, 1 if restricted else max_idle_time)
+            if result is not None or not restricted:
+                break
+        # 取出作业时状态被设置为空闲，还有作业在运行时恢复为忙碌，使 SIGTERM 等待作业结束
+        if self._running:
+            self.set_state(WorkerStatus.BUSY)
+        return result
+
+    def accepts(self, requirement: ResourceRequirement) -> bool:
+        with self._changed:
+            return len(self._running) < self.slots and fits(requirement, self.free_capacity())
+
+    def running_jobs(self) -> int:
+        return len(self._running)
+
+    def execute_job(self, job: Job, queue: Queue) -> None:
+        with self._changed:
+            self._running[job.id] = job_requirement(job)
+        self.set_state(WorkerStatus.BUSY)
+        self._slot_executor.submit(self._execute_in_slot, job, queue)
+
+    def _execute_in_slot(self, job: Job, queue: Queue) -> None:
+        try:
+            self.perform_job(job, queue)
+        except Exception:
+            self.log.exception(f"Worker {self.key}: failed to perform job {job.id}")
+        finally:
+            with self._changed:
+                del self._running[job.id]
+                idle = not self._running
+                self._changed.notify_all()
+            if idle and not self._stop_requested:
+                self.set_state(WorkerStatus.IDLE)
+
+    # 停止前等待正在运行的作业结束，此时事件循环仍在运行
+    def teardown(self) -> None:
+        if self._slot_executor is not None:
+            with self._changed:
+                if self._running:
+                    self.log.info(f"Worker {self.key}: waiting for {len(self._running)} running jobs to finish")
+                while self._running:
+                    if not self._changed.wait(timeout=5):
+                        self.heartbeat()
+            self._slot_executor.shutdown(wait=True)
+            self._slot_executor = None
+        super().teardown()
@@ -1,4 +1,5 @@
 from redis import Redis
+from redis import asyncio as async_redis
 from rq import Queue
 
 from zjbs_tasker.settings import settings
@@ -6,3 +7,14 @@ from zjbs_tasker.settings import settings
 redis_config = settings.REDIS_HOST_PORT.split(":")
 redis_connection = Redis(host=redis_config[0], port=redis_config[1])
 queue = Queue(name="tasker", connection=redis_connection)
+
+
+# 异步 Redis 客户端绑定创建时的事件循环，每个事件循环需要单独创建。
+# 订阅频道的连接长时间没有消息，需要传入 socket_timeout=None
+def async_redis_connection(socket_timeout: float | None = settings.REDIS_SOCKET_TIMEOUT) -> async_redis.Redis:
+    return async_redis.Redis(
+        host=redis_config[0],
+        port=redis_config[1],
+        socket_connect_timeout=settings.REDIS_CONNECT_TIMEOUT,
+        socket_timeout=socket_timeout,
+    )
@@ -0,0 +1,488 @@
+import asyncio
+from collections import defaultdict
+from collections.abc import Collection, Mapping
+from datetime import datetime, timedelta
+from typing import Any
+
+from loguru import logger
+from rq.job import Job, JobStatus
+from rq.queue import EnqueueData
+from sqlalchemy import Float, Text, cast, false, func, literal, select, true, union_all
+from sqlalchemy.dialects.postgresql import JSONB
+from sqlalchemy.sql import Select
+
+from zjbs_tasker.cancel import CANCEL_CHANNEL
+from zjbs_tasker.db import Task, TaskInterpreter, TaskRun, TaskTemplate, database
+from zjbs_tasker.fair_queue import PRIORITY_META, SHARE_META, FairQueue
+from zjbs_tasker.model import (
+    ArtifactSpec,
+    CompressMethod,
+    ExecutionSpec,
+    ResourceRequirement,
+    StartTaskResult,
+    TaskRunMetrics,
+    TaskRunResponse,
+)
+from zjbs_tasker.resource import job_queue_name, queue_names_for_capacity, resource_class_for, worker_capacity
+from zjbs_tasker.server import redis_connection
+from zjbs_tasker.settings import FileServerPath, settings
+
+# 工作进程执行任务的函数，使用字符串避免导入工作进程模块
+EXECUTE_TASK_RUN: str = "zjbs_tasker.worker.execute_task_run"
+
+
+# 还没有开始执行的作业状态
+PENDING_JOB_STATUSES: frozenset[JobStatus] = frozenset({JobStatus.QUEUED, JobStatus.SCHEDULED, JobStatus.DEFERRED})
+
+
+def task_run_job_id(task_run_id: int) -> str:
+    return f"task_run_{task_run_id}"
+
+
+# 批量开始任务：一次查询校验任务、计算下一个序号并得到执行规格，一条 INSERT 创建所有运行记录，
+# 一次 Redis pipeline 提交所有作业。单个任务的错误记录在对应的结果中，不影响其他任务。
+# 指定提交者时按提交者公平分配，否则按模板公平分配
+async def start_task_runs(task_ids: list[int], priority: int = 0, owner: str | None = None) -> list[StartTaskResult]:
+    results = [StartTaskResult(task_id=task_id) for task_id in task_ids]
+    if not task_ids:
+        return results
+
+    # 锁住任务行直到插入运行记录，同一个任务并发开始或重试时依次计算序号。
+    # 加锁后的查询使用新的快照，能读到之前持有锁的事务插入的运行记录
+    async with database.transaction():
+        await database.fetch_all(lock_tasks(task_ids))
+        rows = {row["task_id"]: row for row in await database.fetch_all(select_task_specs(set(task_ids)))}
+        next_indexes = {task_id: row["next_index"] for task_id, row in rows.items()}
+
+        # 同一个任务在请求中出现多次时依次使用后面的序号
+        pending: list[tuple[StartTaskResult, ExecutionSpec]] = []
+        for result in results:
+            if result.task_id not in rows:
+                result.error = "task not found"
+                continue
+            spec = build_execution_spec(rows[result.task_id], next_indexes[result.task_id], priority, owner)
+            if resource_class_for(spec.resources) is None:
+                result.error = f"no resource class fits requirement {spec.resources}"
+                continue
+            result.index = spec.index
+            next_indexes[result.task_id] += 1
+            pending.append((result, spec))
+        if not pending:
+            return results
+
+        task_run_table = TaskRun.Meta.table
+        inserted = await database.fetch_all(
+            task_run_table.insert()
+            .values(
+                [
+                    {
+                        "task": result.task_id,
+                        "index": result.index,
+                        "status": TaskRun.Status.pending,
+                        "spec": spec.dict(),
+                    }
+                    for result, spec in pending
+                ]
+            )
+            .returning(task_run_table.c.id, task_run_table.c.task, task_run_table.c.index)
+        )
+    task_run_ids = {(row["task"], row["index"]): row["id"] for row in inserted}
+    for result, _ in pending:
+        result.task_run_id = task_run_ids[result.task_id, result.index]
+
+    try:
+        await asyncio.to_thread(enqueue_task_runs, [(result.task_run_id, spec) for result, spec in pending])
+    except Exception as e:
+        logger.exception(f"failed to enqueue {len(pending)} task runs")
+        await database.execute(
+            task_run_table.update()
+            .where(task_run_table.c.id.in_([result.task_run_id for result, _ in pending]))
+            .values(status=TaskRun.Status.failed)
+        )
+        for result, _ in pending:
+            result.error = f"failed to enqueue task run: {e}"
+    return results
+
+
+# 按 ID 顺序锁住任务行，避免并发的请求互相等待对方的锁
+def lock_tasks(task_ids: Collection[int]) -> Select:
+    task_table = Task.Meta.table
+    return (
+        select(task_table.c.id)
+        .where(task_table.c.id.in_(set(task_ids)))
+        .order_by(task_table.c.id)
+        .with_for_update(of=task_table)
+    )
+
+
+# 一次查询得到任务、模板和解释器中执行需要的列，以及任务下一次运行的序号（已删除的运行记录也占用序号）
+def select_task_specs(task_ids: Collection[int]) -> Select:
+    task_table = Task.Meta.table
+    template_table = TaskTemplate.Meta.table
+    interpreter_table = TaskInterpreter.Meta.table
+    task_run_table = TaskRun.Meta.table
+    next_index = (
+        select(func.coalesce(func.max(task_run_table.c.index) + 1, 0))
+        .where(task_run_table.c.task == task_table.c.id)
+        .scalar_subquery()
+    )
+    return (
+        select(
+            task_table.c.id.label("task_id"),
+            task_table.c.name.label("task_name"),
+            task_table.c.has_source_file,
+            task_table.c.source_compress_method,
+            task_table.c.arguments.label("task_arguments"),
+            task_table.c.environment.label("task_environment"),
+            task_table.c.cpu.label("task_cpu"),
+            task_table.c.memory.label("task_memory"),
+            task_table.c.disk.label("task_disk"),
+            task_table.c.retry_times,
+            template_table.c.id.label("template_id"),
+            template_table.c.name.label("template_name"),
+            template_table.c.has_script,
+            template_table.c.script_hash,
+            template_table.c.script_compress_method,
+            template_table.c.modified_at.label("template_modified_at"),
+            template_table.c.arguments.label("template_arguments"),
+            template_table.c.environment.label("template_environment"),
+            template_table.c.cpu.label("template_cpu"),
+            template_table.c.memory.label("template_memory"),
+            template_table.c.disk.label("template_disk"),
+            interpreter_table.c.id.label("interpreter_id"),
+            interpreter_table.c.name.label("interpreter_name"),
+            interpreter_table.c.has_executable,
+            interpreter_table.c.executable_hash,
+            interpreter_table.c.executable_compress_method,
+            interpreter_table.c.modified_at.label("interpreter_modified_at"),
+            interpreter_table.c.executable.label("interpreter_executable"),
+            interpreter_table.c.environment.label("interpreter_environment"),
+            next_index.label("next_index"),
+        )
+        .select_from(
+            task_table.join(template_table, template_table.c.id == task_table.c.template).outerjoin(
+                interpreter_table, interpreter_table.c.id == template_table.c.interpreter
+            )
+        )
+        .where(task_table.c.id.in_(task_ids), task_table.c.is_deleted == false())
+    )
+
+
+# 由 select_task_specs 查询的一行得到执行规格
+def build_execution_spec(
+    row: Mapping[str, Any], index: int, priority: int = 0, owner: str | None = None
+) -> ExecutionSpec:
+    interpreter = None
+    if row["interpreter_id"] is not None and row["has_executable"]:
+        interpreter = ArtifactSpec(
+            cache_key=f"interpreter/{row['interpreter_id']}_"
+            f"{artifact_version(row['executable_hash'], row['interpreter_modified_at'])}",
+            server_path=FileServerPath.interpreter_executable_path(
+                row["interpreter_id"], row["interpreter_name"], row["executable_compress_method"]
+            ),
+            compress_method=CompressMethod(row["executable_compress_method"]),
+            wrapper=f"{row['interpreter_id']}_*",
+        )
+    template = None
+    if row["has_script"]:
+        template = ArtifactSpec(
+            cache_key=f"template/{row['template_id']}_"
+            f"{artifact_version(row['script_hash'], row['template_modified_at'])}",
+            server_path=FileServerPath.template_script_path(
+                row["template_id"], row["template_name"], row["script_compress_method"]
+            ),
+            compress_method=CompressMethod(row["script_compress_method"]),
+            wrapper=f"{row['template_id']}_*",
+        )
+    source = None
+    if row["has_source_file"]:
+        source = ArtifactSpec(
+            server_path=FileServerPath.task_source_file_path(
+                row["task_id"], row["task_name"], row["source_compress_method"]
+            ),
+            compress_method=CompressMethod(row["source_compress_method"]),
+            wrapper="source",
+        )
+
+    environment = {}
+    for name in ("interpreter_environment", "template_environment", "task_environment"):
+        environment.update({key: str(value) for key, value in (row[name] or {}).items()})
+    resources = {}
+    for name in ("cpu", "memory", "disk"):
+        value = row[f"task_{name}"] if row[f"task_{name}"] is not None else row[f"template_{name}"]
+        if value is not None:
+            resources[name] = value
+    return ExecutionSpec(
+        task_id=row["task_id"],
+        task_name=row["task_name"],
+        index=index,
+        interpreter=interpreter,
+        template=template,
+        source=source,
+        command=[*(row["interpreter_executable"] or []), *row["template_arguments"], *row["task_arguments"]],
+        environment=environment,
+        resources=ResourceRequirement(**resources),
+        priority=priority,
+        share=fair_share(row["template_id"], owner),
+        retry_times=row["retry_times"],
+    )
+
+
+# 公平分配的份额：提交者或模板
+def fair_share(template_id: int, owner: str | None) -> str:
+    return f"owner:{owner}" if owner else f"template:{template_id}"
+
+
+# 早期上传的文件没有记录哈希，使用修改时间作为版本
+def artifact_version(pack_hash: str | None, modified_at: datetime) -> str:
+    return pack_hash if pack_hash else modified_at.strftime("%Y%m%d%H%M%S%f")
+
+
+# 读取运行记录中保存的执行规格，没有保存时（之前版本创建的运行记录）根据当前的任务生成并保存
+async def load_execution_spec(task_run_id: int) -> ExecutionSpec:
+    task_run_table = TaskRun.Meta.table
+    task_run = await database.fetch_one(
+        select(task_run_table.c.task, task_run_table.c.index, task_run_table.c.spec).where(
+            task_run_table.c.id == task_run_id
+        )
+    )
+    if task_run is None:
+        raise ValueError(f"task run {task_run_id} not found")
+    if task_run["spec"] is not None:
+        return ExecutionSpec.parse_obj(task_run["spec"])
+
+    row = await database.fetch_one(select_task_specs([task_run["task"]]))
+    if row is None:
+        raise ValueError(f"task {task_run['task']} of task run {task_run_id} not found")
+    spec = build_execution_spec(row, task_run["index"])
+    await database.execute(task_run_table.update().where(task_run_table.c.id == task_run_id).values(spec=spec.dict()))
+    return spec
+
+
+# 只在运行记录处于 from_statuses 中的状态时更新状态，返回是否更新成功
+async def update_task_run_status(
+    task_run_id: int, status: TaskRun.Status, from_statuses: Collection[TaskRun.Status], **values: Any
+) -> bool:
+    task_run_table = TaskRun.Meta.table
+    row = await database.fetch_one(
+        task_run_table.update()
+        .where(task_run_table.c.id == task_run_id, task_run_table.c.status.in_(list(from_statuses)))
+        .values(status=status, **values)
+        .returning(task_run_table.c.id)
+    )
+    return row is not None
+
+
+async def is_task_run_canceled(task_run_id: int) -> bool:
+    task_run_table = TaskRun.Meta.table
+    status = await database.fetch_val(select(task_run_table.c.status).where(task_run_table.c.id == task_run_id))
+    return status == TaskRun.Status.canceled
+
+
+# 取消等待或运行中的运行记录，按ID或者按任务选择。记录取消状态和结束时间，从队列中删除等待的作业，
+# 并通知工作进程终止运行中的子进程。返回被取消的运行记录ID
+async def cancel_active_task_runs(task_run_ids: Collection[int] | None = None, task_id: int | None = None) -> list[int]:
+    task_run_table = TaskRun.Meta.table
+    query = task_run_table.update().where(task_run_table.c.status.in_([TaskRun.Status.pending, TaskRun.Status.running]))
+    if task_run_ids is not None:
+        query = query.where(task_run_table.c.id.in_(list(task_run_ids)))
+    if task_id is not None:
+        query = query.where(task_run_table.c.task == task_id)
+    rows = await database.fetch_all(
+        query.values(status=TaskRun.Status.canceled, end_at=datetime.now()).returning(task_run_table.c.id)
+    )
+    canceled = [row["id"] for row in rows]
+    if canceled:
+        await asyncio.to_thread(remove_task_run_jobs, canceled)
+    return canceled
+
+
+# 在一个 Redis pipeline 中删除还没有开始的作业（包括等待重试的作业），并在取消频道上通知所有工作进程
+def remove_task_run_jobs(task_run_ids: list[int]) -> None:
+    jobs = Job.fetch_many([task_run_job_id(task_run_id) for task_run_id in task_run_ids], connection=redis_connection)
+    with redis_connection.pipeline() as pipeline:
+        for job in jobs:
+            if job is None or job.get_status(refresh=False) not in PENDING_JOB_STATUSES:
+                continue
+            FairQueue(job.origin, connection=redis_connection).remove(job, pipeline=pipeline)
+            job.delete(pipeline=pipeline)
+        for task_run_id in task_run_ids:
+            pipeline.publish(CANCEL_CHANNEL, task_run_id)
+        pipeline.execute()
+
+
+async def save_task_run_metrics(task_run_id: int, metrics: TaskRunMetrics) -> None:
+    task_run_table = TaskRun.Meta.table
+    await database.execute(
+        task_run_table.update().where(task_run_table.c.id == task_run_id).values(metrics=metrics.dict())
+    )
+
+
+# 汇总运行记录的指标，用于容量规划。阶段耗时的名称为 phase:<阶段>，其他数值指标使用 TaskRunMetrics 中的字段名
+def select_metric_summaries(
+    task_id: int | None = None,
+    template_id: int | None = None,
+    status: TaskRun.Status | None = None,
+    ended_since: datetime | None = None,
+    ended_before: datetime | None = None,
+) -> Select:
+    task_table = Task.Meta.table
+    task_run_table = TaskRun.Meta.table
+    conditions = [task_run_table.c.metrics.isnot(None), task_run_table.c.is_deleted == false()]
+    if task_id is not None:
+        conditions.append(task_run_table.c.task == task_id)
+    if template_id is not None:
+        conditions.append(task_table.c.template == template_id)
+    if status is not None:
+        conditions.append(task_run_table.c.status == status)
+    if ended_since is not None:
+        conditions.append(task_run_table.c.end_at >= ended_since)
+    if ended_before is not None:
+        conditions.append(task_run_table.c.end_at < ended_before)
+
+    # 参数显式转换为 text，避免 jsonb 运算符的重载有歧义
+    metrics = cast(task_run_table.c.metrics, JSONB)
+    phases, prefetched = cast(literal("phases"), Text), cast(literal("prefetched"), Text)
+    values = []
+    for prefix, source in (("", metrics.op("-")(phases).op("-")(prefetched)), ("phase:", metrics.op("->")(phases))):
+        fields = func.jsonb_each_text(source).table_valued("key", "value").lateral()
+        values.append(
+            select((literal(prefix) + fields.c.key).label("name"), cast(fields.c.value, Float).label("value"))
+            .select_from(task_run_table.join(task_table, task_table.c.id == task_run_table.c.task).join(fields, true()))
+            .where(*conditions, fields.c.value.isnot(None))
+        )
+    values = union_all(*values).subquery()
+    return (
+        select(
+            values.c.name,
+            func.count().label("count"),
+            func.sum(values.c.value).label("total"),
+            func.avg(values.c.value).label("mean"),
+            func.percentile_cont(0.5).within_group(values.c.value).label("p50"),
+            func.percentile_cont(0.95).within_group(values.c.value).label("p95"),
+            func.max(values.c.value).label("max"),
+        )
+        .group_by(values.c.name)
+        .order_by(values.c.name)
+    )
+
+
+# 各状态未删除的运行记录数，没有记录的状态为 0
+async def count_task_runs_by_status() -> dict[TaskRun.Status, int]:
+    task_run_table = TaskRun.Meta.table
+    rows = await database.fetch_all(
+        select(task_run_table.c.status, func.count().label("count"))
+        .where(task_run_table.c.is_deleted == false())
+        .group_by(task_run_table.c.status)
+    )
+    counts = dict.fromkeys(TaskRun.Status, 0)
+    for row in rows:
+        counts[TaskRun.Status(row["status"])] = row["count"]
+    return counts
+
+
+# 按序号列出任务未删除的运行记录，只查询响应中的列
+def select_task_runs(
+    task_id: int,
+    status: TaskRun.Status | None = None,
+    after_index: int | None = None,
+    updated_since: datetime | None = None,
+    limit: int = 100,
+) -> Select:
+    task_table = Task.Meta.table
+    task_run_table = TaskRun.Meta.table
+    query = (
+        select(*(task_run_table.c[name] for name in TaskRunResponse.__fields__))
+        .select_from(task_run_table.join(task_table, task_table.c.id == task_run_table.c.task))
+        .where(
+            task_run_table.c.task == task_id,
+            task_run_table.c.is_deleted == false(),
+            task_table.c.is_deleted == false(),
+        )
+        .order_by(task_run_table.c.index)
+        .limit(limit)
+    )
+    if status is not None:
+        query = query.where(task_run_table.c.status == status)
+    if after_index is not None:
+        query = query.where(task_run_table.c.index > after_index)
+    if updated_since is not None:
+        query = query.where(task_run_table.c.modified_at > updated_since)
+    return query
+
+
+# 在一个 Redis pipeline 中提交作业，作业按资源需求进入对应资源类别的队列，按优先级和份额公平出队。
+# 作业ID由运行记录ID决定，执行规格随作业参数传给工作进程
+def enqueue_task_runs(task_runs: list[tuple[int, ExecutionSpec]]) -> None:
+    jobs: defaultdict[str, list[EnqueueData]] = defaultdict(list)
+    for task_run_id, spec in task_runs:
+        jobs[job_queue_name(spec.resources)].append(
+            FairQueue.prepare_data(
+                EXECUTE_TASK_RUN,
+                args=(task_run_id, spec.dict()),
+                job_id=task_run_job_id(task_run_id),
+                meta=job_meta(spec),
+            )
+        )
+    with redis_connection.pipeline() as pipeline:
+        for queue_name, queue_jobs in jobs.items():
+            FairQueue(queue_name, connection=redis_connection).enqueue_many(queue_jobs, pipeline=pipeline)
+        pipeline.execute()
+
+
+def job_meta(spec: ExecutionSpec) -> dict[str, Any]:
+    return {PRIORITY_META: spec.priority, SHARE_META: spec.share}
+
+
+# 失败后第 attempt 次重试前等待的时间（秒），指数退避
+def retry_delay(attempt: int) -> float:
+    return min(settings.TASK_RETRY_BACKOFF_SECONDS * 2 ** (attempt - 1), settings.TASK_RETRY_BACKOFF_MAX_SECONDS)
+
+
+# 为失败的任务运行创建重试的运行记录，使用任务的下一个序号，执行规格中的输入与失败的运行相同
+async def create_retry_task_run(spec: ExecutionSpec) -> tuple[int, ExecutionSpec]:
+    task_run_table = TaskRun.Meta.table
+    next_index = (
+        select(func.coalesce(func.max(task_run_table.c.index) + 1, 0))
+        .where(task_run_table.c.task == spec.task_id)
+        .scalar_subquery()
+    )
+    async with database.transaction():
+        await database.fetch_all(lock_tasks([spec.task_id]))
+        row = await database.fetch_one(
+            task_run_table.insert()
+            .values(task=spec.task_id, index=next_index, status=TaskRun.Status.pending)
+            .returning(task_run_table.c.id, task_run_table.c.index)
+        )
+        retry_spec = spec.copy(update={"index": row["index"], "attempt": spec.attempt + 1})
+        await database.execute(
+            task_run_table.update().where(task_run_table.c.id == row["id"]).values(spec=retry_spec.dict())
+        )
+    return row["id"], retry_spec
+
+
+# 在 delay 秒后把重试的作业加入资源类别队列，由 rq 调度器（rq worker --with-scheduler）到期时入队
+def schedule_task_run(task_run_id: int, spec: ExecutionSpec, delay: float) -> Job:
+    queue = FairQueue(job_queue_name(spec.resources), connection=redis_connection)
+    return queue.enqueue_in(
+        timedelta(seconds=delay),
+        EXECUTE_TASK_RUN,
+        args=(task_run_id, spec.dict()),
+        job_id=task_run_job_id(task_run_id),
+        meta=job_meta(spec),
+    )
+
+
+# 查看当前工作进程能够运行的队列中接下来的 count 个作业的执行规格，不取出作业。之前版本提交的作业没有执行规格，跳过
+def peek_task_runs(count: int) -> list[tuple[int, ExecutionSpec]]:
+    job_ids = []
+    for queue_name in queue_names_for_capacity(worker_capacity()):
+        if len(job_ids) >= count:
+            break
+        job_ids.extend(FairQueue(queue_name, connection=redis_connection).get_job_ids(0, count - len(job_ids)))
+    task_runs = []
+    for job in Job.fetch_many(job_ids, connection=redis_connection):
+        if job is None or job.func_name != EXECUTE_TASK_RUN or len(job.args) < 2 or job.args[1] is None:
+            continue
+        task_runs.append((job.args[0], ExecutionSpec.parse_obj(job.args[1])))
+    return task_runs
@@ -0,0 +1,128 @@
+import asyncio
+import hashlib
+import json
+import os
+import time
+from asyncio import TaskGroup
+from collections.abc import AsyncIterator
+from contextlib import asynccontextmanager
+from pathlib import Path, PurePosixPath
+
+from loguru import logger
+from zjbs_file_client import delete
+
+from zjbs_tasker.util import UPLOAD_CHUNK_SIZE, upload_stream
+
+# 结果文件清单的文件名，最后上传
+MANIFEST_FILENAME = "tasker-manifest.json"
+
+
+# 任务运行时增量上传结果文件
+#
+# 定期扫描结果目录，上传超过 quiescent_seconds 没有修改的文件；任务结束后只上传还没有上传或者上传后又被修改的文件，
+# 最后上传记录所有文件大小和SHA-256的清单。文件按 (大小, 修改时间) 判断是否变化。
+# 后台上传后被任务删除或重命名的文件不写入清单，并从文件服务器删除
+class ResultUploader:
+    def __init__(
+        self, run_dir: Path, server_dir: str, quiescent_seconds: float, scan_interval: float, concurrency: int
+    ) -> None:
+        self.run_dir = run_dir
+        self.server_dir = server_dir
+        self.quiescent_seconds = quiescent_seconds
+        self.scan_interval = scan_interval
+        self.files_uploaded = 0
+        self.bytes_uploaded = 0
+        self._semaphore = asyncio.Semaphore(concurrency)
+        # 已上传文件的相对路径 -> (大小, 修改时间, SHA-256)
+        self._uploaded: dict[str, tuple[int, int, str]] = {}
+
+    # 在上下文中后台上传已经完成的文件
+    @asynccontextmanager
+    async def watching(self) -> AsyncIterator[None]:
+        watcher = asyncio.create_task(self._watch())
+        try:
+            yield
+        finally:
+            watcher.cancel()
+            try:
+                await watcher
+            except asyncio.CancelledError:
+                pass
+
+    # 上传剩余的文件和清单
+    async def finish(self) -> None:
+        files = await self.upload_changed(quiescent_before=None)
+        for path in [path for path in self._uploaded if path not in files]:
+            del self._uploaded[path]
+            try:
+                await delete(str(PurePosixPath(self.server_dir) / path))
+            except Exception as e:
+                logger.warning(f"failed to delete removed result file {path}: {e}")
+        manifest = {
+            "files": [
+                {"path": path, "size": size, "sha256": sha256}
+                for path, (size, _, sha256) in sorted(self._uploaded.items())
+            ]
+        }
+        data = json.dumps(manifest, ensure_ascii=False, indent=2).encode()
+
+        async def chunks() -> AsyncIterator[bytes]:
+            yield data
+
+        await upload_stream(self.server_dir, chunks(), MANIFEST_FILENAME, mkdir=True, allow_overwrite=True)
+
+    # 上传新增或者变化的文件，quiescent_before 不为 None 时只上传在该时间之前修改的文件。返回扫描到的文件
+    async def upload_changed(self, quiescent_before: int | None) -> dict[str, tuple[int, int]]:
+        files = await asyncio.to_thread(self._scan)
+        async with TaskGroup() as tg:
+            for path, (size, mtime_ns) in files.items():
+                uploaded = self._uploaded.get(path)
+                if uploaded is not None and uploaded[:2] == (size, mtime_ns):
+                    continue
+                if quiescent_before is not None and mtime_ns > quiescent_before:
+                    continue
+                tg.create_task(self._upload(path, size, mtime_ns, background=quiescent_before is not None))
+        return files
+
+    async def _watch(self) -> None:
+        while True:
+            await asyncio.sleep(self.scan_interval)
+            await self.upload_changed(quiescent_before=time.time_ns() - int(self.quiescent_seconds * 1e9))
+
+    async def _upload(self, path: str, size: int, mtime_ns: int, background: bool) -> None:
+        relative_path = PurePosixPath(path)
+        directory = str(PurePosixPath(self.server_dir) / relative_path.parent)
+        sha256 = hashlib.sha256()
+
+        async def chunks() -> AsyncIterator[bytes]:
+            with open(self.run_dir / relative_path, "rb") as file:
+                while chunk := await asyncio.to_thread(file.read, UPLOAD_CHUNK_SIZE):
+                    sha256.update(chunk)
+                    yield chunk
+
+        async with self._semaphore:
+            try:
+                await upload_stream(directory, chunks(), relative_path.name, mkdir=True, allow_overwrite=True)
+            except Exception as e:
+                # 后台上传失败时在任务结束后重试
+                if not background:
+                    raise
+                logger.warning(f"failed to upload result file {path}, will retry after task run: {e}")
+                return
+        self._uploaded[path] = (size, mtime_ns, sha256.hexdigest())
+        self.files_uploaded += 1
+        self.bytes_uploaded += size
+
+    def _scan(self) -> dict[str, tuple[int, int]]:
+        files = {}
+        for parent, _, filenames in os.walk(self.run_dir):
+            for filename in filenames:
+                path = Path(parent) / filename
+                try:
+                    stat = path.lstat()
+                except OSError:
+                    continue
+                if path.is_symlink():
+                    continue
+                files[path.relative_to(self.run_dir).as_posix()] = (stat.st_size, stat.st_mtime_ns)
+        return files
@@ -1,14 +1,29 @@
+import asyncio
+import hashlib
+import os
 import tarfile
-import tempfile
+import threading
+import time
+import uuid
 import zipfile
-from pathlib import Path
+from asyncio import TaskGroup
+from collections.abc import AsyncIterator
+from datetime import datetime
+from pathlib import Path, PurePosixPath
 from tempfile import SpooledTemporaryFile
 from typing import BinaryIO
 
 from fastapi import HTTPException
-from zjbs_file_client import upload
+from zjbs_file_client import async_client as file_client_module
 
+from zjbs_tasker.codec import FILE_SUFFIXES, PACK_COMPRESS_METHODS, open_tar_reader, open_tar_writer
+from zjbs_tasker.executor import ArchiveExecutorBusy, archive_executor, service_unavailable_exception
+from zjbs_tasker.exporter import record_transfer
 from zjbs_tasker.model import CompressMethod
+from zjbs_tasker.settings import settings
+
+# 上传时每次从管道读取的大小
+UPLOAD_CHUNK_SIZE: int = 1024 * 1024
 
 
 def invalid_request_exception(message: str) -> HTTPException:
@@ -26,41 +41,384 @@ def decompress_file(
         case CompressMethod.zip:
             with zipfile.ZipFile(file_path_or_obj, "r") as zip_file:
                 zip_file.extractall(target_parent_directory)
-        case CompressMethod.tgz | CompressMethod.txz:
-            tar_open_args = {"mode": "r:gz" if compress_method is CompressMethod.tgz else "r:xz"}
-            if isinstance(file_path_or_obj, Path | str):
-                tar_open_args["name"] = file_path_or_obj
-            else:
-                tar_open_args["fileobj"] = file_path_or_obj
-            with tarfile.open(**tar_open_args) as tar_file:
-                tar_file.extractall(target_parent_directory)
         case CompressMethod.not_compressed:
             raise ValueError("cannot decompress not compressed file")
+        case _:
+            if isinstance(file_path_or_obj, Path | str):
+                with open(file_path_or_obj, "rb") as file:
+                    extract_tar_stream(file, compress_method, target_parent_directory)
+            else:
+                extract_tar_stream(file_path_or_obj, compress_method, target_parent_directory)
+
+
+# 以流的方式解压 tar 压缩包，fileobj 只需要支持顺序读取
+def extract_tar_stream(fileobj: BinaryIO, compress_method: CompressMethod, target_parent_directory: Path | str) -> None:
+    target_parent_directory = Path(target_parent_directory)
+    target_parent_directory.mkdir(parents=True, exist_ok=True)
+    with open_tar_reader(fileobj, compress_method) as tar_file:
+        # data 过滤器拒绝指向目标目录外的路径和链接、设备文件，并去掉 setuid 等权限位
+        tar_file.extractall(target_parent_directory, filter="data")
+
+
+# 线程间的有界字节管道，写入方在缓冲区满时阻塞，读取方在缓冲区空时阻塞。
+# 事件循环中的一方使用 read_async/write_async，等待时不占用线程
+class BytePipe:
+    def __init__(self, max_size: int) -> None:
+        self.max_size = max_size
+        self._buffer = bytearray()
+        self._condition = threading.Condition()
+        self._closed = False
+        self._aborted = False
+        self._error: BaseException | None = None
+        self._waiters: list[tuple[asyncio.AbstractEventLoop, asyncio.Future]] = []
+
+    def write(self, data: bytes) -> int:
+        with self._condition:
+            while not self._writable():
+                self._condition.wait()
+            return self._write(data)
+
+    def read(self, size: int = -1) -> bytes:
+        with self._condition:
+            while not self._readable():
+                self._condition.wait()
+            return self._read(size)
+
+    async def write_async(self, data: bytes) -> int:
+        while True:
+            with self._condition:
+                if self._writable():
+                    return self._write(data)
+                waiter = self._add_waiter()
+            await waiter
+
+    async def read_async(self, size: int = -1) -> bytes:
+        while True:
+            with self._condition:
+                if self._readable():
+                    return self._read(size)
+                waiter = self._add_waiter()
+            await waiter
+
+    def _writable(self) -> bool:
+        return len(self._buffer) < self.max_size or self._aborted
+
+    def _readable(self) -> bool:
+        return bool(self._buffer) or self._closed
+
+    def _write(self, data: bytes) -> int:
+        if self._aborted:
+            raise BrokenPipeError("reader of pipe has been closed")
+        self._buffer += data
+        self._notify()
+        return len(data)
+
+    def _read(self, size: int) -> bytes:
+        if self._error is not None:
+            raise self._error
+        size = len(self._buffer) if size < 0 else min(size, len(self._buffer))
+        data = bytes(self._buffer[:size])
+        del self._buffer[:size]
+        self._notify()
+        return data
+
+    def _add_waiter(self) -> asyncio.Future:
+        loop = asyncio.get_running_loop()
+        waiter = loop.create_future()
+        self._waiters.append((loop, waiter))
+        return waiter
+
+    # 在持有锁时调用，唤醒所有等待的线程和协程
+    def _notify(self) -> None:
+        self._condition.notify_all()
+        for loop, waiter in self._waiters:
+            loop.call_soon_threadsafe(_wake_waiter, waiter)
+        self._waiters.clear()
+
+    @property
+    def error(self) -> BaseException | None:
+        return self._error
+
+    # 写入方结束写入，error 不为 None 时读取方会收到该异常
+    def close(self, error: BaseException | None = None) -> None:
+        with self._condition:
+            self._closed = True
+            self._error = error
+            self._notify()
+
+    # 读取方不再读取，之后的写入会失败
+    def abort(self) -> None:
+        with self._condition:
+            self._aborted = True
+            self._buffer.clear()
+            self._notify()
+
+
+def _wake_waiter(waiter: asyncio.Future) -> None:
+    if not waiter.done():
+        waiter.set_result(None)
+
+
+# 从文件服务器下载文件并写入管道
+# 返回下载的字节数
+async def download_to_pipe(server_path: str, pipe: BytePipe, chunk_size: int) -> int:
+    size = 0
+    start = time.perf_counter()
+    try:
+        async with file_client_module.client.stream("POST", "/download-file", params={"path": server_path}) as response:
+            response.raise_for_status()
+            async for chunk in response.aiter_bytes(chunk_size):
+                await pipe.write_async(chunk)
+                size += len(chunk)
+    except BrokenPipeError:
+        # 读取方已经出错退出，由读取方报告错误
+        return size
+    except BaseException as e:
+        pipe.close(e)
+        raise
+    pipe.close()
+    record_transfer("download", size, time.perf_counter() - start)
+    return size
 
 
 def compress_directory(
-    directory: Path | str, target_parent_directory: Path | str | None = None, arcname: str | None = None
+    directory: Path | str,
+    target_parent_directory: Path | str | None = None,
+    arcname: str | None = None,
+    compress_method: CompressMethod = CompressMethod.txz,
 ) -> Path:
+    directory = Path(directory)
     target_parent_directory = Path(target_parent_directory) if target_parent_directory else directory.parent
     arcname = directory.name if arcname is None else arcname
-    with tarfile.open(target_parent_directory / f"{arcname}.tar.xz", "w:xz") as tar_file:
+    target_path = target_parent_directory / f"{arcname}{FILE_SUFFIXES[compress_method]}"
+    with open(target_path, "wb") as target_file, open_tar_writer(target_file, compress_method) as tar_file:
         tar_file.add(directory, arcname=arcname)
-    return target_parent_directory / f"{arcname}.tar.xz"
+    return target_path
 
 
+# 以流的方式上传文件，保存为 pack_compress_method 压缩的 tar 包：压缩方式相同时校验后原样转发，
+# 否则边转换边上传。返回上传的压缩包的SHA-256
 async def upload_file(
-    file: BinaryIO, filename: str, compress_method: CompressMethod, base_dir: str, target_basename: str
+    file: BinaryIO,
+    filename: str,
+    compress_method: CompressMethod,
+    base_dir: str,
+    target_basename: str,
+    pack_compress_method: CompressMethod = CompressMethod.txz,
+) -> str:
+    if pack_compress_method not in PACK_COMPRESS_METHODS:
+        raise invalid_request_exception(f"cannot store pack as {pack_compress_method}")
+    pipe = BytePipe(settings.UPLOAD_BUFFER_SIZE)
+
+    def produce() -> str:
+        writer = HashingWriter(pipe)
+        try:
+            if compress_method is pack_compress_method:
+                forward_tar_stream(file, compress_method, writer)
+            else:
+                with open_tar_writer(writer, pack_compress_method) as tar_file:
+                    transcode_to_tar(file, filename, compress_method, target_basename, tar_file)
+        except BaseException as e:
+            pipe.close(e)
+            raise
+        pipe.close()
+        return writer.hexdigest()
+
+    async def consume() -> None:
+        try:
+            await upload_from_pipe(
+                base_dir, pipe, f"{target_basename}.{pack_compress_method}", mkdir=True, allow_overwrite=False
+            )
+        except Exception:
+            # 生成压缩包失败导致的上传失败只报告前者
+            if pipe.error is None:
+                raise
+        finally:
+            pipe.abort()
+
+    # 在开始上传前占用压缩线程池的名额，排队的任务过多时直接拒绝
+    try:
+        produced = archive_executor.submit(produce)
+    except ArchiveExecutorBusy as e:
+        raise service_unavailable_exception(str(e))
+
+    async def wait_producer() -> str:
+        return await produced
+
+    try:
+        async with TaskGroup() as tg:
+            producer = tg.create_task(wait_producer())
+            tg.create_task(consume())
+    except ExceptionGroup as group:
+        invalid = group.subgroup((tarfile.TarError, zipfile.BadZipFile, InvalidPackError))
+        if invalid is not None:
+            raise invalid_request_exception(f"invalid {compress_method} file: {invalid.exceptions[0]}")
+        # 上传失败后生成压缩包的线程写入管道时得到 BrokenPipeError，只报告上传的错误
+        errors = [e for e in group.exceptions if not isinstance(e, BrokenPipeError)]
+        raise (errors or group.exceptions)[0]
+    return producer.result()
+
+
+class InvalidPackError(ValueError):
+    pass
+
+
+# 按字面合并路径中的 . 和 ..，得到相对压缩包根目录的路径，超出根目录时返回 None
+def normalize_pack_path(path: PurePosixPath) -> PurePosixPath | None:
+    parts: list[str] = []
+    for part in path.parts:
+        if part == "..":
+            if not parts:
+                return None
+            parts.pop()
+        elif part != ".":
+            parts.append(part)
+    return PurePosixPath(*parts)
+
+
+# 校验压缩包中的文件，拒绝绝对路径、指向上级目录的路径、指向压缩包外的链接和设备文件。
+# 符号链接的目标相对链接所在的目录，硬链接的目标相对压缩包根目录
+def check_tar_member(member: tarfile.TarInfo) -> None:
+    path = PurePosixPath(member.name)
+    if path.is_absolute() or ".." in path.parts:
+        raise InvalidPackError(f"unsafe path in pack: {member.name}")
+    if not (member.isreg() or member.isdir() or member.issym() or member.islnk()):
+        raise InvalidPackError(f"unsupported file type in pack: {member.name}")
+    if member.issym() or member.islnk():
+        link = PurePosixPath(member.linkname)
+        if link.is_absolute() or normalize_pack_path(path.parent / link if member.issym() else link) is None:
+            raise InvalidPackError(f"unsafe link in pack: {member.name} -> {member.linkname}")
+
+
+# 读取时把数据同时写入 writer 的文件包装
+class TeeReader:
+    def __init__(self, file: BinaryIO, writer: BinaryIO) -> None:
+        self.file = file
+        self.writer = writer
+
+    def read(self, size: int = -1) -> bytes:
+        data = self.file.read(size)
+        if data:
+            self.writer.write(data)
+        return data
+
+
+# 写入时计算SHA-256的文件包装
+class HashingWriter:
+    def __init__(self, writer: BinaryIO) -> None:
+        self.writer = writer
+        self._hash = hashlib.sha256()
+
+    def write(self, data: bytes) -> int:
+        self._hash.update(data)
+        return self.writer.write(data)
+
+    def hexdigest(self) -> str:
+        return self._hash.hexdigest()
+
+
+# 只读取一遍 tar 压缩包，校验所有文件头的同时把原始字节转发给 writer
+def forward_tar_stream(file: BinaryIO, compress_method: CompressMethod, writer: BinaryIO) -> None:
+    tee = TeeReader(file, writer)
+    with open_tar_reader(tee, compress_method) as tar_file:
+        for member in tar_file:
+            check_tar_member(member)
+    # 转发压缩包末尾 tarfile 没有读取的填充数据
+    while tee.read(UPLOAD_CHUNK_SIZE):
+        pass
+
+
+# 把上传的文件逐个写入 tar_file，所有文件位于 arcname 目录下，不在磁盘上解压
+def transcode_to_tar(
+    file: BinaryIO, filename: str, compress_method: CompressMethod, arcname: str, tar_file: tarfile.TarFile
+) -> None:
+    root = tarfile.TarInfo(arcname)
+    root.type = tarfile.DIRTYPE
+    root.mode = 0o755
+    root.mtime = int(time.time())
+    tar_file.addfile(root)
+
+    match compress_method:
+        case CompressMethod.not_compressed:
+            file_info = tarfile.TarInfo(f"{arcname}/{PurePosixPath(filename).name}")
+            file.seek(0, os.SEEK_END)
+            file_info.size = file.tell()
+            file.seek(0)
+            file_info.mode = 0o644
+            file_info.mtime = root.mtime
+            tar_file.addfile(file_info, file)
+        case CompressMethod.zip:
+            with zipfile.ZipFile(file, "r") as zip_file:
+                for zip_info in zip_file.infolist():
+                    member = tarfile.TarInfo(f"{arcname}/{zip_info.filename.rstrip('/')}")
+                    check_tar_member(member)
+                    member.mtime = int(datetime(*zip_info.date_time).timestamp())
+                    unix_mode = zip_info.external_attr >> 16
+                    if zip_info.is_dir():
+                        member.type = tarfile.DIRTYPE
+                        member.mode = unix_mode & 0o7777 or 0o755
+                        tar_file.addfile(member)
+                    else:
+                        member.size = zip_info.file_size
+                        member.mode = unix_mode & 0o7777 or 0o644
+                        with zip_file.open(zip_info) as member_file:
+                            tar_file.addfile(member, member_file)
+        case _:
+            with open_tar_reader(file, compress_method) as source_tar:
+                for member in source_tar:
+                    check_tar_member(member)
+                    member_file = source_tar.extractfile(member) if member.isreg() else None
+                    member.name = f"{arcname}/{member.name}"
+                    if member.islnk():
+                        member.linkname = f"{arcname}/{member.linkname}"
+                    tar_file.addfile(member, member_file)
+
+
+# 以 multipart 的方式把管道中的数据上传到文件服务器，不需要预先知道文件大小
+async def upload_from_pipe(
+    directory: str, pipe: BytePipe, filename: str, mkdir: bool | None = None, allow_overwrite: bool | None = None
+) -> None:
+    async def chunks() -> AsyncIterator[bytes]:
+        while chunk := await pipe.read_async(UPLOAD_CHUNK_SIZE):
+            yield chunk
+
+    await upload_stream(directory, chunks(), filename, mkdir, allow_overwrite)
+
+
+# 以 multipart 的方式把 chunks 上传到文件服务器
+async def upload_stream(
+    directory: str,
+    chunks: AsyncIterator[bytes],
+    filename: str,
+    mkdir: bool | None = None,
+    allow_overwrite: bool | None = None,
 ) -> None:
-    with tempfile.TemporaryDirectory() as working_dir, tempfile.SpooledTemporaryFile() as recompressed_file:
-        if compress_method == CompressMethod.not_compressed:
-            not_compressed_path = Path(working_dir) / filename
-            with open(not_compressed_path, "wb") as not_compressed_file:
-                while chunk := file.read(1024 * 1024):
-                    not_compressed_file.write(chunk)
-        else:
-            decompress_file(file, compress_method, working_dir)
-
-        with tarfile.open(fileobj=recompressed_file, mode="w:xz") as recompressed_tar:
-            recompressed_tar.add(working_dir, arcname=target_basename)
-        recompressed_file.seek(0)
-        await upload(base_dir, recompressed_file, f"{target_basename}.txz", mkdir=True, allow_overwrite=False)
+    params = {"directory": directory}
+    if mkdir is not None:
+        params["mkdir"] = mkdir
+    if allow_overwrite is not None:
+        params["allow_overwrite"] = allow_overwrite
+    boundary = uuid.uuid4().hex
+    size = 0
+    start = time.perf_counter()
+
+    async def body() -> AsyncIterator[bytes]:
+        nonlocal size
+        yield (
+            f"--{boundary}\r\n"
+            f'Content-Disposition: form-data; name="file"; filename="{filename}"\r\n'
+            f"Content-Type: application/octet-stream\r\n\r\n"
+        ).encode()
+        async for chunk in chunks:
+            size += len(chunk)
+            yield chunk
+        yield f"\r\n--{boundary}--\r\n".encode()
+
+    response = await file_client_module.client.post(
+        "/upload-file",
+        params=params,
+        content=body(),
+        headers={"Content-Type": f"multipart/form-data; boundary={boundary}"},
+    )
+    response.raise_for_status()
+    record_transfer("upload", size, time.perf_counter() - start)
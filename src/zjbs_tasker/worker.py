@@ -1,218 +1,519 @@
 import asyncio
+import contextvars
 import shutil
+import subprocess
 import tempfile
+import time
+import uuid
 from asyncio import TaskGroup
-from contextlib import asynccontextmanager, contextmanager
+from collections import Counter
+from collections.abc import Iterator
+from contextlib import AsyncExitStack, asynccontextmanager, contextmanager, nullcontext
 from datetime import datetime
+from fnmatch import fnmatch
+from functools import partial
 from pathlib import Path
 
 from loguru import logger
+from zjbs_file_client import async_client as file_client_module
 from zjbs_file_client import close_client, download_file, init_client, upload_directory
 
-from zjbs_tasker.db import Task, TaskInterpreter, TaskRun, TaskTemplate
-from zjbs_tasker.model import CompressMethod
+from zjbs_tasker import runtime as worker_runtime
+from zjbs_tasker.artifact import TEMP_PREFIX, ArtifactCache, directory_size
+from zjbs_tasker.cancel import running_processes
+from zjbs_tasker.db import TaskRun
+from zjbs_tasker.executor import worker_archive_executor
+from zjbs_tasker.exporter import record_transfer
+from zjbs_tasker.metrics import current_metrics, read_rusage, record_bytes_downloaded, record_phase, wrap_command
+from zjbs_tasker.model import ArtifactSpec, CompressMethod, ExecutionSpec, ResourceRequirement, TaskRunMetrics
+from zjbs_tasker.output import OutputStream, tee_output
+from zjbs_tasker.prefetch import Prefetcher, PrefetchInput
+from zjbs_tasker.runtime import TaskerWorker
+from zjbs_tasker.server import async_redis_connection
 from zjbs_tasker.settings import FileServerPath, settings
-from zjbs_tasker.util import decompress_file
-
-
-def sync_execute_task_run(task_run_id: int) -> None:
-    asyncio.run(execute_task_run(task_run_id))
-
-
-async def execute_task_run(task_run_id: int) -> None:
+from zjbs_tasker.task_run import (
+    create_retry_task_run,
+    is_task_run_canceled,
+    load_execution_spec,
+    peek_task_runs,
+    retry_delay,
+    save_task_run_metrics,
+    schedule_task_run,
+    update_task_run_status,
+)
+from zjbs_tasker.uploader import ResultUploader
+from zjbs_tasker.util import BytePipe, decompress_file, download_to_pipe, extract_tar_stream
+
+artifact_cache = ArtifactCache(settings.WORKER_WORKING_DIR / "cache", settings.WORKER_CACHE_MAX_SIZE)
+# 每个任务的源文件正在被多少个任务运行使用
+active_sources: Counter[str] = Counter()
+# 等待把重试交给当前工作进程的协程
+retry_tasks: set[asyncio.Task] = set()
+prefetcher = Prefetcher(
+    settings.WORKER_PREFETCH_DEPTH,
+    settings.WORKER_PREFETCH_MAX_SIZE,
+    peek_task_runs,
+    lambda spec: prefetch_inputs(spec),
+)
+
+
+def sync_execute_task_run(task_run_id: int, spec: dict | None = None) -> None:
+    asyncio.run(execute_task_run(task_run_id, spec))
+
+
+# spec 为开始任务时确定的执行规格，之前版本提交的作业没有 spec，从数据库读取
+async def execute_task_run(task_run_id: int, spec: dict | None = None) -> None:
+    metrics = TaskRunMetrics(queue_wait_seconds=job_queue_wait())
+    current_metrics.set(metrics)
     # 连接数据库和文件服务器
-    async with connect_database(), file_client():
-        # 更新TaskRun状态
-        task_run: TaskRun = await TaskRun.objects.get(id=task_run_id)
-        await task_run.update(status=TaskRun.Status.running, start_at=datetime.now())
-
-        task = await task_run.task.load()
-        task_template = await task.template.load()
-        task_interpreter = task_template.interpreter
-        if task_interpreter is not None:
-            await task_interpreter.load()
-
-        # 并行下载解释器，模板和源文件
-        async with TaskGroup() as tg:
-            if task_interpreter is not None:
-                tg.create_task(
-                    download_pack_and_extract_as_dir(
-                        FileServerPath.interpreter_executable_path(task_interpreter.id, task_interpreter.name),
-                        settings.WORKER_WORKING_DIR / "interpreter",
-                        f"{task_interpreter.id}_{task_interpreter.name}",
-                    )
-                )
-            tg.create_task(
-                download_pack_and_extract_as_dir(
-                    FileServerPath.template_script_path(task_template.id, task_template.name),
-                    settings.WORKER_WORKING_DIR / "template",
-                    f"{task_template.id}_{task_template.name}",
-                )
-            )
-            tg.create_task(
-                download_pack_and_extract_as_dir(
-                    FileServerPath.task_source_file_path(task.id, task.name), worker_task_dir(task_run), "source"
-                )
-            )
-
-        # 执行任务
-        return_code = await execute_external_executable(task_run, task, task_template, task_interpreter)
-        end_at = datetime.now()
+    async with connect_database(), file_client(), AsyncExitStack() as artifact_stack:
+        with record_phase("load_spec"):
+            spec = ExecutionSpec.parse_obj(spec) if spec is not None else await load_execution_spec(task_run_id)
 
-        # 上传结果文件
-        await upload_result_file(task_run)
+        # 更新TaskRun状态，运行记录已经被取消或者已经在运行时不再执行
+        started = await update_task_run_status(
+            task_run_id, TaskRun.Status.running, [TaskRun.Status.pending], start_at=datetime.now()
+        )
+        if not started:
+            logger.warning(f"task run {task_run_id} is not pending, skip")
+            return
+        # 无论任务运行是否成功，结束时都保存指标
+        artifact_stack.push_async_callback(save_metrics, task_run_id, metrics)
+        artifact_stack.enter_context(using_source(spec))
+
+        try:
+            # 领取预取的输入，并行下载没有预取的解释器，模板和源文件，解释器和模板在任务结束前不会被缓存淘汰
+            for prefetch_input in prefetch_inputs(spec):
+                if await prefetcher.claim(prefetch_input.key):
+                    metrics.prefetched.append(prefetch_input.key)
+            async with TaskGroup() as tg:
+                for artifact in (spec.interpreter, spec.template):
+                    if artifact is not None:
+                        tg.create_task(
+                            artifact_stack.enter_async_context(
+                                artifact_cache.acquire(artifact.cache_key, partial(foreground_download, artifact))
+                            )
+                        )
+                source_dir = worker_task_source_dir(spec)
+                if spec.source is not None and not (source_dir.is_dir() and any(source_dir.iterdir())):
+                    tg.create_task(foreground_download(spec.source, source_dir))
+
+            # 在任务运行时预取队列中接下来的作业的输入，只在长期运行的工作进程中预取
+            if worker_runtime.runtime is not None:
+                prefetcher.schedule()
+
+            # 执行任务，增量上传时在运行过程中上传已经完成的结果文件
+            uploader = result_uploader(spec) if settings.WORKER_INCREMENTAL_UPLOAD else None
+            async with uploader.watching() if uploader is not None else nullcontext():
+                return_code = await execute_external_executable(task_run_id, spec)
+            end_at = datetime.now()
+
+            # 被取消时记录结束时间，按配置上传或者删除已经产生的结果文件，不再重试
+            if running_processes.pop_canceled(task_run_id):
+                await update_task_run_status(
+                    task_run_id, TaskRun.Status.canceled, [TaskRun.Status.canceled], end_at=end_at
+                )
+                if settings.WORKER_UPLOAD_CANCELED_RESULTS:
+                    await upload_result_file(spec, uploader)
+                else:
+                    shutil.rmtree(worker_task_run_dir(spec), ignore_errors=True)
+                logger.info(f"task run {task_run_id} canceled")
+                return
+
+            # 上传结果文件
+            await upload_result_file(spec, uploader)
+        except (Exception, asyncio.CancelledError):
+            # 下载输入失败、执行出错、作业超时或工作进程退出时标记为失败。运行记录已经被取消时不会更新状态，也不再重试
+            running_processes.pop_canceled(task_run_id)
+            if await update_task_run_status(
+                task_run_id, TaskRun.Status.failed, [TaskRun.Status.running], end_at=datetime.now()
+            ):
+                await retry_task_run(task_run_id, spec)
+            raise
 
         # 更新TaskRun的状态
-        await task_run.update(
-            status=TaskRun.Status.success if return_code == 0 else TaskRun.Status.failed, end_at=end_at
+        updated = await update_task_run_status(
+            task_run_id,
+            TaskRun.Status.success if return_code == 0 else TaskRun.Status.failed,
+            [TaskRun.Status.running],
+            end_at=end_at,
         )
 
-        # 如果任务执行成功，删除源文件
-        if return_code == 0:
-            shutil.rmtree(worker_task_source_dir(task_run), ignore_errors=True)
+        # 如果任务执行成功，删除源文件，同一个任务的其他运行还在使用或者队列中的作业还需要时保留；
+        # 执行失败时保留源文件，重试时不需要重新下载
+        if return_code == 0 and active_sources[source_key(spec)] == 1 and not prefetcher.wanted(source_key(spec)):
+            shutil.rmtree(worker_task_source_dir(spec), ignore_errors=True)
+        elif return_code != 0 and updated:
+            await retry_task_run(task_run_id, spec)
+
 
+# 任务运行失败且还有重试次数时，创建新的运行记录并在退避时间后重新执行。
+# 到期时如果当前工作进程能够立即执行，则把作业交给它，复用已经下载的输入；
+# 否则在 TASK_RETRY_AFFINITY_SECONDS 后由 rq 调度器放入资源类别队列，交给其他工作进程
+async def retry_task_run(task_run_id: int, spec: ExecutionSpec) -> None:
+    if spec.attempt >= spec.retry_times:
+        return
+    try:
+        retry_id, retry_spec = await create_retry_task_run(spec)
+        delay = retry_delay(retry_spec.attempt)
+        worker = worker_runtime.runtime.worker if worker_runtime.runtime is not None else None
+        affinity = settings.TASK_RETRY_AFFINITY_SECONDS if worker is not None else 0
+        job = await asyncio.to_thread(schedule_task_run, retry_id, retry_spec, delay + affinity)
+    except Exception as e:
+        logger.exception(f"failed to retry task run {task_run_id}: {e}")
+        return
+    logger.info(
+        f"task run {task_run_id} failed, retry {retry_spec.attempt}/{spec.retry_times} "
+        f"as task run {retry_id} in {delay} seconds"
+    )
+    if worker is not None:
+        task = asyncio.create_task(
+            claim_retry(worker, job.id, retry_spec.resources, delay, affinity), context=contextvars.Context()
+        )
+        retry_tasks.add(task)
+        task.add_done_callback(retry_tasks.discard)
+
+
+async def claim_retry(
+    worker: TaskerWorker, job_id: str, requirement: ResourceRequirement, delay: float, window: float
+) -> None:
+    await asyncio.sleep(delay)
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + window
+    while loop.time() < deadline:
+        if worker.accepts(requirement):
+            try:
+                if await asyncio.to_thread(worker.claim_retry, job_id):
+                    logger.info(f"claimed retry {job_id}")
+            except Exception as e:
+                logger.warning(f"failed to claim retry {job_id}: {e}")
+            return
+        await asyncio.sleep(1)
+
+
+# 作业从入队到开始执行的时间，不是由 TaskerJob 执行时为 None
+def job_queue_wait() -> float | None:
+    job = worker_runtime.current_job.get()
+    if job is None or job.enqueued_at is None or job.started_at is None:
+        return None
+    return round(max((job.started_at - job.enqueued_at).total_seconds(), 0.0), 3)
+
+
+async def save_metrics(task_run_id: int, metrics: TaskRunMetrics) -> None:
+    try:
+        await save_task_run_metrics(task_run_id, metrics)
+    except Exception as e:
+        logger.warning(f"failed to save metrics of task run {task_run_id}: {e}")
 
+
+# 如果连接已经由长期运行的工作进程打开，则直接复用，且不在退出时关闭
 @asynccontextmanager
 async def connect_database() -> None:
     database = TaskRun.Meta.database
+    connected_here = False
     try:
         if not database.is_connected:
             await database.connect()
+            connected_here = True
         yield
     finally:
-        if database.is_connected:
+        if connected_here and database.is_connected:
             await database.disconnect()
 
 
 @asynccontextmanager
 async def file_client() -> None:
+    initialized_here = False
     try:
-        await init_client(settings.FILE_SERVER_URL, timeout=60)
+        if file_client_module.client is None:
+            await init_client(settings.FILE_SERVER_URL, timeout=60)
+            initialized_here = True
         yield
     finally:
-        await close_client()
+        if initialized_here:
+            await close_client()
 
 
+# 下载压缩包并原子地解压为 target_dir：先解压到同级的临时目录，再重命名。
+# 上传时压缩包内的内容位于名称匹配 wrapper 的唯一顶层目录中，解压后去掉这一层目录
+# name 为记录指标时输入的名称
 async def download_pack_and_extract_as_dir(
-    server_path: str, target_parent_dir: Path, dedup_name: str | None = None
-) -> bool:
-    target_parent_dir.mkdir(parents=True, exist_ok=True)
-    if dedup_name is not None:
-        dedup_path = target_parent_dir / dedup_name
-        if dedup_path.is_dir() and any(dedup_path.iterdir()):
-            return False
-
-    with tempfile.SpooledTemporaryFile() as pack_file:
-        await download_file(server_path, pack_file)
-        pack_file.seek(0)
-        decompress_file(pack_file, CompressMethod.txz, target_parent_dir)
-        return True
-
-
-async def execute_external_executable(
-    task_run: TaskRun, task: Task, task_template: TaskTemplate, task_interpreter: TaskInterpreter | None
-) -> int:
-    run_dir = worker_task_run_dir(task_run)
+    server_path: str,
+    target_dir: Path,
+    wrapper: str,
+    compress_method: CompressMethod = CompressMethod.txz,
+    name: str = "pack",
+) -> None:
+    target_dir.parent.mkdir(parents=True, exist_ok=True)
+    temp_dir = target_dir.with_name(f"{TEMP_PREFIX}{uuid.uuid4().hex}")
+    try:
+        if settings.WORKER_STREAMING_DOWNLOAD:
+            with record_phase(f"download:{name}"):
+                record_bytes_downloaded(await download_and_extract_stream(server_path, compress_method, temp_dir))
+        else:
+            with tempfile.SpooledTemporaryFile(max_size=settings.WORKER_DOWNLOAD_BUFFER_SIZE) as pack_file:
+                start = time.perf_counter()
+                with record_phase(f"download:{name}"):
+                    await download_file(server_path, pack_file)
+                record_transfer("download", pack_file.tell(), time.perf_counter() - start)
+                record_bytes_downloaded(pack_file.tell())
+                pack_file.seek(0)
+                with record_phase(f"extract:{name}"):
+                    await worker_archive_executor.run(decompress_file, pack_file, compress_method, temp_dir)
+
+        content_dir = temp_dir
+        children = list(temp_dir.iterdir())
+        if len(children) == 1 and children[0].is_dir() and fnmatch(children[0].name, wrapper):
+            content_dir = children[0]
+        try:
+            content_dir.rename(target_dir)
+        except OSError:
+            # 其他进程已经解压了相同的内容
+            if not target_dir.is_dir():
+                raise
+    finally:
+        shutil.rmtree(temp_dir, ignore_errors=True)
+
+
+# 下载的同时解压，内存占用不超过 WORKER_DOWNLOAD_BUFFER_SIZE 加上解压器的缓冲区。返回下载的字节数
+async def download_and_extract_stream(server_path: str, compress_method: CompressMethod, target_dir: Path) -> int:
+    pipe = BytePipe(settings.WORKER_DOWNLOAD_BUFFER_SIZE)
+
+    def extract() -> None:
+        try:
+            extract_tar_stream(pipe, compress_method, target_dir)
+        finally:
+            pipe.abort()
+
+    try:
+        async with TaskGroup() as tg:
+            download = tg.create_task(download_to_pipe(server_path, pipe, settings.WORKER_DOWNLOAD_CHUNK_SIZE))
+            tg.create_task(worker_archive_executor.run(extract))
+    except ExceptionGroup as group:
+        # 下载失败时解压线程从管道读到同一个异常，解压失败时下载方忽略 BrokenPipeError，只报告第一个错误
+        raise group.exceptions[0]
+    return download.result()
+
+
+async def execute_external_executable(task_run_id: int, spec: ExecutionSpec) -> int:
+    run_dir = worker_task_run_dir(spec)
     run_dir.mkdir(parents=True, exist_ok=True)
 
-    with context_logger(run_dir / "worker.log", "INFO"):
+    with context_logger(run_dir / "worker.log", "INFO", task_run_id):
         logger.info(f"start execute task run")
 
-        exe, args = build_command(task, task_template, task_interpreter)
-        env = build_environment(task, task_template, task_interpreter, run_dir)
+        exe, args = build_command(spec)
+        env = build_environment(spec, run_dir)
         logger.info(f"executable: {exe}")
         logger.info(f"arguments: {args}")
         logger.info(f"environment variables: {env}")
-
-        # 运行任务，并把stdout和stderr输出到文件
-        with (
-            open(run_dir / "stdout.txt", "w", encoding="utf-8") as stdout_file,
-            open(run_dir / "stderr.txt", "w", encoding="utf-8") as stderr_file,
-        ):
-            process = await asyncio.create_subprocess_exec(
-                exe, *args, stdout=stdout_file, stderr=stderr_file, env=env, cwd=run_dir
+        # 资源使用写在结果目录之外，不会被上传
+        rusage_path = run_dir.with_name(f"{run_dir.name}.rusage.json")
+        if settings.WORKER_RECORD_RUSAGE:
+            exe, args = wrap_command(exe, args, rusage_path)
+
+        # 运行任务，并把stdout和stderr同时输出到文件和 Redis，以便实时查看
+        async with async_redis_connection() as redis:
+            output = OutputStream(
+                redis,
+                task_run_id,
+                settings.OUTPUT_STREAM_MAX_LEN,
+                settings.OUTPUT_STREAM_TTL,
+                settings.OUTPUT_STREAM_QUEUE_SIZE,
             )
-            return await process.wait()
-
-
+            return_code = None
+            try:
+                with (
+                    open(run_dir / "stdout.txt", "wb") as stdout_file,
+                    open(run_dir / "stderr.txt", "wb") as stderr_file,
+                    record_phase("exec"),
+                ):
+                    # 子进程在新的进程组中运行，取消时终止整个进程组
+                    process = await asyncio.create_subprocess_exec(
+                        exe,
+                        *args,
+                        stdout=subprocess.PIPE,
+                        stderr=subprocess.PIPE,
+                        env=env,
+                        cwd=run_dir,
+                        start_new_session=True,
+                    )
+                    async with running_processes.register(task_run_id, process):
+                        async with TaskGroup() as tg:
+                            tg.create_task(cancel_if_canceled(task_run_id))
+                            for reader, file, stream in (
+                                (process.stdout, stdout_file, "stdout"),
+                                (process.stderr, stderr_file, "stderr"),
+                            ):
+                                tg.create_task(tee_output(reader, file, stream, output, settings.OUTPUT_CHUNK_SIZE))
+                        return_code = await process.wait()
+                    return return_code
+            finally:
+                await output.close(return_code)
+                metrics = current_metrics.get()
+                if settings.WORKER_RECORD_RUSAGE and metrics is not None:
+                    read_rusage(metrics, rusage_path)
+                rusage_path.unlink(missing_ok=True)
+
+
+# 在子进程启动前被取消时没有收到取消消息，启动后检查一次
+async def cancel_if_canceled(task_run_id: int) -> None:
+    if await is_task_run_canceled(task_run_id):
+        await running_processes.cancel(task_run_id)
+
+
+# 把当前任务运行的日志写入 log_path。同一个工作进程中的多个任务运行并发执行，
+# 因此只记录在当前上下文（及其创建的协程）中产生的日志
 @contextmanager
-def context_logger(log_path: Path | str, level: int | str) -> None:
+def context_logger(log_path: Path | str, level: int | str, task_run_id: int) -> None:
     from loguru import logger
 
     handle = None
-    try:
-        handle = logger.add(log_path, level=level)
-        yield
-    except Exception as e:
-        logger.exception(e)
-    finally:
-        if handle is not None:
-            logger.remove(handle)
+    with logger.contextualize(task_run_id=task_run_id):
+        try:
+            handle = logger.add(
+                log_path, level=level, filter=lambda record: record["extra"].get("task_run_id") == task_run_id
+            )
+            yield
+        except Exception as e:
+            logger.exception(e)
+        finally:
+            if handle is not None:
+                logger.remove(handle)
 
 
-def build_command(
-    task: Task, task_template: TaskTemplate, task_interpreter: TaskInterpreter | None
-) -> tuple[str, list[str]]:
-    cmd = []
-    if task_interpreter is not None:
-        cmd.extend(task_interpreter.executable)
-    cmd.extend(task_template.executable)
-    cmd.extend(task.argument)
+def build_command(spec: ExecutionSpec) -> tuple[str, list[str]]:
+    if not spec.command:
+        raise ValueError("command of task run is empty")
 
-    # 把可执行文件转换为实际路径
-    if task.template.interpreter is None:
-        exe = str(worker_template_dir(task_template) / cmd[0])
-    else:
-        exe = str(worker_interpreter_dir(task_interpreter) / cmd[0])
+    # 把可执行文件转换为实际路径，依次在解释器和模板目录中查找，都不存在时保持原样
+    exe = spec.command[0]
+    for artifact in (spec.interpreter, spec.template):
+        if artifact is not None and (artifact_cache.path(artifact.cache_key) / exe).exists():
+            exe = str(artifact_cache.path(artifact.cache_key) / exe)
+            break
 
-    return exe, cmd[1:]
+    return exe, spec.command[1:]
 
 
-def build_environment(
-    task: Task, task_template: TaskTemplate, task_interpreter: TaskInterpreter | None, run_dir: Path | str
-) -> dict[str, str]:
+def build_environment(spec: ExecutionSpec, run_dir: Path | str) -> dict[str, str]:
     run_dir = Path(run_dir).absolute()
     env = {"INPUT_DIR": str(run_dir.parent / "source"), "OUTPUT_DIR": str(run_dir)}
-    if task_interpreter is not None:
-        env.update(task_interpreter.environment)
-    env.update(task_template.environment)
-    env.update(task.environment)
+    if spec.interpreter is not None:
+        env["INTERPRETER_DIR"] = str(artifact_cache.path(spec.interpreter.cache_key).absolute())
+    if spec.template is not None:
+        env["TEMPLATE_DIR"] = str(artifact_cache.path(spec.template.cache_key).absolute())
+    env.update(spec.environment)
     return env
 
 
-async def upload_result_file(task_run: TaskRun) -> None:
-    run_dir = worker_task_run_dir(task_run)
-    await upload_directory(
-        FileServerPath.task_dir(task_run.task.id, task_run.task.name), run_dir, CompressMethod.txz, mkdir=True
-    )
+async def upload_result_file(spec: ExecutionSpec, uploader: ResultUploader | None = None) -> None:
+    run_dir = worker_task_run_dir(spec)
+    metrics = current_metrics.get()
+    # 不增量上传时由文件服务客户端压缩并上传，压缩的耗时包含在 upload 阶段中
+    with record_phase("upload"):
+        if uploader is not None:
+            await uploader.finish()
+            logger.info(f"uploaded {uploader.files_uploaded} result files, {uploader.bytes_uploaded} bytes")
+            size = uploader.bytes_uploaded
+        else:
+            size = await asyncio.to_thread(directory_size, run_dir)
+            start = time.perf_counter()
+            await upload_directory(
+                FileServerPath.task_dir(spec.task_id, spec.task_name),
+                run_dir,
+                CompressMethod(settings.RESULT_COMPRESS_METHOD),
+                mkdir=True,
+            )
+            # 压缩后的大小未知，记录压缩前的大小
+            record_transfer("upload", size, time.perf_counter() - start)
+    if metrics is not None:
+        metrics.bytes_uploaded += size
     shutil.rmtree(run_dir, ignore_errors=True)
 
 
-def worker_interpreter_dir(task_interpreter: TaskInterpreter) -> Path:
-    return settings.WORKER_WORKING_DIR / "interpreter" / f"{task_interpreter.id}_{task_interpreter.name}"
+def result_uploader(spec: ExecutionSpec) -> ResultUploader:
+    return ResultUploader(
+        worker_task_run_dir(spec),
+        FileServerPath.run_dir(spec.task_id, spec.task_name, spec.index),
+        quiescent_seconds=settings.WORKER_UPLOAD_QUIESCENT_SECONDS,
+        scan_interval=settings.WORKER_UPLOAD_SCAN_INTERVAL,
+        concurrency=settings.WORKER_UPLOAD_CONCURRENCY,
+    )
+
+
+async def download_artifact(artifact: ArtifactSpec, target_dir: Path) -> None:
+    await download_pack_and_extract_as_dir(
+        artifact.server_path,
+        target_dir,
+        wrapper=artifact.wrapper,
+        compress_method=artifact.compress_method,
+        name=artifact.cache_key.split("/")[0] if artifact.cache_key is not None else "source",
+    )
 
 
-def worker_task_dir(task_run: TaskRun) -> Path:
-    return settings.WORKER_WORKING_DIR / "task" / f"{task_run.task.id}_{task_run.task.name}"
+# 前台下载没有预取的输入
+async def foreground_download(artifact: ArtifactSpec, target_dir: Path) -> None:
+    prefetcher.misses += 1
+    await download_artifact(artifact, target_dir)
+
+
+def prefetch_inputs(spec: ExecutionSpec) -> list[PrefetchInput]:
+    inputs = [
+        PrefetchInput(artifact.cache_key, partial(prefetch_artifact, artifact))
+        for artifact in (spec.interpreter, spec.template)
+        if artifact is not None
+    ]
+    if spec.source is not None:
+        inputs.append(
+            PrefetchInput(
+                source_key(spec),
+                partial(prefetch_source, spec),
+                partial(shutil.rmtree, worker_task_source_dir(spec), ignore_errors=True),
+            )
+        )
+    return inputs
 
 
-def worker_task_run_dir(task_run: TaskRun) -> Path:
-    return worker_task_dir(task_run) / f"run_{task_run.index}"
+async def prefetch_artifact(artifact: ArtifactSpec) -> int | None:
+    if artifact_cache.path(artifact.cache_key).is_dir():
+        return None
+    async with artifact_cache.acquire(artifact.cache_key, partial(download_artifact, artifact)) as path:
+        return await asyncio.to_thread(directory_size, path)
 
 
-def worker_task_source_dir(task_run: TaskRun) -> Path:
-    return worker_task_dir(task_run) / "source"
+async def prefetch_source(spec: ExecutionSpec) -> int | None:
+    source_dir = worker_task_source_dir(spec)
+    if source_dir.is_dir() and any(source_dir.iterdir()):
+        return None
+    await download_artifact(spec.source, source_dir)
+    return await asyncio.to_thread(directory_size, source_dir)
 
 
-def worker_template_dir(task_template: TaskTemplate) -> Path:
-    return settings.WORKER_WORKING_DIR / "template" / f"{task_template.id}_{task_template.name}"
+def source_key(spec: ExecutionSpec) -> str:
+    return f"source/{spec.task_id}_{spec.task_name}"
 
 
-def worker_executable(task_run: TaskRun) -> str:
-    exe_path = (
-        settings.WORKER_WORKING_DIR
-        / "template"
-        / f"{task_run.task.template.id}_{task_run.task.template.name}"
-        / task_run.task.template.executable[0]
-    )
-    return str(exe_path)
+# 记录正在使用源文件的任务运行数
+@contextmanager
+def using_source(spec: ExecutionSpec) -> Iterator[None]:
+    key = source_key(spec)
+    active_sources[key] += 1
+    try:
+        yield
+    finally:
+        active_sources[key] -= 1
+        if active_sources[key] <= 0:
+            del active_sources[key]
+
+
+def worker_task_dir(spec: ExecutionSpec) -> Path:
+    return settings.WORKER_WORKING_DIR / "task" / f"{spec.task_id}_{spec.task_name}"
+
+
+def worker_task_run_dir(spec: ExecutionSpec) -> Path:
+    return worker_task_dir(spec) / f"run_{spec.index}"
+
+
+def worker_task_source_dir(spec: ExecutionSpec) -> Path:
+    return worker_task_dir(spec) / "source"
@@ -20,7 +20,19 @@ subprocess.run(
 )
 
 rq_process = subprocess.Popen(
-    [shutil.which("rq"), "worker", "--with-scheduler", "--url", redis_url, "--verbose", "tasker"],
+    [
+        shutil.which("rq"),
+        "worker",
+        "--worker-class",
+        "zjbs_tasker.runtime.TaskerWorker",
+        "--job-class",
+        "zjbs_tasker.runtime.TaskerJob",
+        "--with-scheduler",
+        "--url",
+        redis_url,
+        "--verbose",
+        "tasker",
+    ],
     env={"PYTHONPATH": os.pathsep.join([os.environ.get("PYTHONPATH", ""), str(cwd / "src")]), "DEBUG_MODE": "on"},
 )
 rq_dashboard_process = subprocess.Popen([shutil.which("rq-dashboard"), "--redis-url", redis_url, "--port", "7400"])
@@ -1,9 +1,14 @@
 import pytest
+import pytest_asyncio
+from fastapi import FastAPI, HTTPException, Response, UploadFile
 from fastapi.testclient import TestClient
+from httpx import ASGITransport, AsyncClient
 from rq import SimpleWorker, Worker
 from rq.command import send_shutdown_command
 from rq.timeouts import TimerDeathPenalty
+from zjbs_file_client import async_client as file_client_module
 
+from zjbs_tasker.db import database
 from zjbs_tasker.main import app
 from zjbs_tasker.server import queue
 
@@ -23,3 +28,39 @@ def rq_worker() -> Worker:
     worker = WindowsWorker([queue], connection=queue.connection)
     yield worker
     send_shutdown_command(queue.connection, worker.name)
+
+
+# 连接测试数据库，数据库不可用时跳过测试
+@pytest_asyncio.fixture
+async def db() -> None:
+    try:
+        await database.connect()
+    except OSError as e:
+        pytest.skip(f"database is not available: {e}")
+    yield
+    await database.disconnect()
+
+
+# 进程内的文件服务器，记录上传的文件
+@pytest.fixture
+def file_server() -> dict[str, bytes]:
+    uploaded: dict[str, bytes] = {}
+    file_server_app = FastAPI()
+
+    @file_server_app.post("/upload-file")
+    async def upload(directory: str, file: UploadFile) -> None:
+        uploaded[f"{directory}/{file.filename}"] = await file.read()
+
+    @file_server_app.post("/delete")
+    async def delete(path: str) -> bool:
+        return uploaded.pop(path, None) is not None
+
+    @file_server_app.post("/download-file")
+    async def download(path: str) -> Response:
+        if path not in uploaded:
+            raise HTTPException(status_code=404, detail="file not found")
+        return Response(uploaded[path], media_type="application/octet-stream")
+
+    file_client_module.client = AsyncClient(transport=ASGITransport(app=file_server_app), base_url="http://file-server")
+    yield uploaded
+    file_client_module.client = None
@@ -0,0 +1,67 @@
+from pathlib import Path
+
+import pytest
+
+from zjbs_tasker.artifact import ArtifactCache
+
+
+def fill_with(size: int):
+    async def fill(path: Path) -> None:
+        path.mkdir()
+        (path / "data.bin").write_bytes(b"0" * size)
+
+    return fill
+
+
+@pytest.mark.asyncio
+async def test_artifact_cache_hit_and_miss(tmp_path: Path) -> None:
+    cache = ArtifactCache(tmp_path, max_size=1024)
+    async with cache.acquire("template/1_a", fill_with(10)) as path:
+        assert (path / "data.bin").read_bytes() == b"0" * 10
+    async with cache.acquire("template/1_a", fill_with(20)) as path:
+        assert (path / "data.bin").stat().st_size == 10
+    assert (cache.hits, cache.misses, cache.evictions) == (1, 1, 0)
+
+
+@pytest.mark.asyncio
+async def test_artifact_cache_evicts_least_recently_used(tmp_path: Path) -> None:
+    cache = ArtifactCache(tmp_path, max_size=250)
+    async with cache.acquire("interpreter/1_a", fill_with(100)):
+        pass
+    async with cache.acquire("interpreter/2_b", fill_with(100)):
+        pass
+    async with cache.acquire("interpreter/1_a", fill_with(100)):
+        pass
+    async with cache.acquire("interpreter/3_c", fill_with(100)):
+        pass
+    assert cache.path("interpreter/1_a").is_dir()
+    assert not cache.path("interpreter/2_b").exists()
+    assert cache.path("interpreter/3_c").is_dir()
+    assert cache.evictions == 1
+
+
+@pytest.mark.asyncio
+async def test_artifact_cache_keeps_pinned_entries(tmp_path: Path) -> None:
+    cache = ArtifactCache(tmp_path, max_size=150)
+    async with cache.acquire("template/1_a", fill_with(100)) as pinned:
+        async with cache.acquire("template/2_b", fill_with(100)):
+            pass
+        assert pinned.is_dir()
+    assert cache.evictions == 0
+
+
+@pytest.mark.asyncio
+async def test_artifact_cache_keeps_entries_used_by_other_processes(tmp_path: Path) -> None:
+    other = ArtifactCache(tmp_path, max_size=150)
+    cache = ArtifactCache(tmp_path, max_size=150)
+    async with other.acquire("template/1_a", fill_with(100)) as pinned:
+        async with cache.acquire("template/2_b", fill_with(100)):
+            pass
+        assert pinned.is_dir()
+    assert cache.evictions == 0
+
+    async with cache.acquire("template/3_c", fill_with(100)):
+        pass
+    assert not cache.path("template/1_a").exists() and not cache.path("template/2_b").exists()
+    assert cache.evictions == 2
+    assert not cache._locks and not cache._users
@@ -0,0 +1,63 @@
+import asyncio
+import sys
+import time
+
+import pytest
+
+from zjbs_tasker.cancel import RunningProcesses, terminate_process_group
+
+
+@pytest.mark.asyncio
+async def test_terminate_process_group_kills_after_grace() -> None:
+    # 子进程忽略 SIGTERM，并启动一个同一进程组的孙进程
+    script = (
+        "import signal, subprocess, sys, time\n"
+        "signal.signal(signal.SIGTERM, signal.SIG_IGN)\n"
+        "subprocess.Popen([sys.executable, '-c', 'import time; time.sleep(60)'])\n"
+        "print('ready', flush=True)\n"
+        "time.sleep(60)\n"
+    )
+    process = await asyncio.create_subprocess_exec(
+        sys.executable, "-c", script, stdout=asyncio.subprocess.PIPE, start_new_session=True
+    )
+    await process.stdout.readline()
+    start = time.monotonic()
+    await terminate_process_group(process, grace_seconds=0.5)
+    assert process.returncode == -9
+    assert 0.5 <= time.monotonic() - start < 10
+
+
+@pytest.mark.asyncio
+async def test_running_processes_cancel() -> None:
+    running = RunningProcesses(grace_seconds=5)
+    assert not await running.cancel(1)
+    process = await asyncio.create_subprocess_exec(
+        sys.executable, "-c", "import time; time.sleep(60)", start_new_session=True
+    )
+    async with running.register(1, process):
+        assert await running.cancel(1)
+        assert process.returncode == -15
+    assert running.pop_canceled(1)
+    assert not running.pop_canceled(1)
+    assert running.canceled == 1
+
+
+@pytest.mark.asyncio
+async def test_running_processes_terminate_when_interrupted() -> None:
+    running = RunningProcesses(grace_seconds=5)
+    process = await asyncio.create_subprocess_exec(
+        sys.executable, "-c", "import time; time.sleep(60)", start_new_session=True
+    )
+
+    async def run() -> None:
+        async with running.register(1, process):
+            await process.wait()
+
+    # 作业超时或者工作进程退出时协程被取消
+    task = asyncio.create_task(run())
+    await asyncio.sleep(0.1)
+    task.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await task
+    assert process.returncode == -15
+    assert not running.pop_canceled(1)
@@ -0,0 +1,69 @@
+import os
+import tarfile
+from pathlib import Path
+
+import pytest
+from httpx import HTTPStatusError
+
+from zjbs_tasker.codec import FILE_SUFFIXES, PACK_COMPRESS_METHODS
+from zjbs_tasker.model import CompressMethod
+from zjbs_tasker.settings import settings
+from zjbs_tasker.util import compress_directory
+from zjbs_tasker.worker import download_pack_and_extract_as_dir
+
+FILES = {"a.bin": os.urandom(256 * 1024), "data/b.bin": os.urandom(256 * 1024)}
+
+
+# 在 source 目录中生成测试文件并打包，返回压缩包的内容
+def make_pack(tmp_path: Path, compress_method: CompressMethod) -> bytes:
+    for name, content in FILES.items():
+        path = tmp_path / "pack" / "source" / name
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_bytes(content)
+    return compress_directory(tmp_path / "pack" / "source", tmp_path, compress_method=compress_method).read_bytes()
+
+
+@pytest.fixture(autouse=True)
+def streaming_download(monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr(settings, "WORKER_STREAMING_DOWNLOAD", True)
+    # 缓冲区小于压缩包，下载和解压交替进行
+    monkeypatch.setattr(settings, "WORKER_DOWNLOAD_BUFFER_SIZE", 64 * 1024)
+    monkeypatch.setattr(settings, "WORKER_DOWNLOAD_CHUNK_SIZE", 16 * 1024)
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("compress_method", sorted(PACK_COMPRESS_METHODS))
+async def test_download_and_extract(
+    file_server: dict[str, bytes], tmp_path: Path, compress_method: CompressMethod
+) -> None:
+    server_path = f"/pack{FILE_SUFFIXES[compress_method]}"
+    file_server[server_path] = make_pack(tmp_path, compress_method)
+
+    target_dir = tmp_path / "cache" / "source"
+    await download_pack_and_extract_as_dir(server_path, target_dir, "source", compress_method)
+    assert {name: (target_dir / name).read_bytes() for name in FILES} == FILES
+    assert [path.name for path in target_dir.parent.iterdir()] == ["source"]
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize(
+    "corrupt",
+    [lambda pack: pack[: len(pack) * 3 // 4], lambda pack: pack[:1024] + bytes(len(pack) - 1024)],
+    ids=["truncated", "corrupt"],
+)
+async def test_download_and_extract_broken_pack(file_server: dict[str, bytes], tmp_path: Path, corrupt) -> None:
+    file_server["/pack.txz"] = corrupt(make_pack(tmp_path, CompressMethod.txz))
+
+    # 解压的错误原样抛出，已经解压的部分被删除
+    target_dir = tmp_path / "cache" / "source"
+    with pytest.raises(tarfile.ReadError):
+        await download_pack_and_extract_as_dir("/pack.txz", target_dir, "source")
+    assert not any(target_dir.parent.iterdir())
+
+
+@pytest.mark.asyncio
+async def test_download_missing_pack(file_server: dict[str, bytes], tmp_path: Path) -> None:
+    target_dir = tmp_path / "cache" / "source"
+    with pytest.raises(HTTPStatusError):
+        await download_pack_and_extract_as_dir("/missing.txz", target_dir, "source")
+    assert not any(target_dir.parent.iterdir())
@@ -0,0 +1,50 @@
+import asyncio
+import threading
+
+import pytest
+
+from zjbs_tasker.executor import ArchiveExecutor, ArchiveExecutorBusy
+from zjbs_tasker.util import BytePipe
+
+
+@pytest.mark.asyncio
+async def test_archive_executor_rejects_when_full() -> None:
+    executor = ArchiveExecutor(max_workers=1, max_pending=2)
+    release = threading.Event()
+    running = [executor.submit(release.wait), executor.submit(release.wait)]
+    with pytest.raises(ArchiveExecutorBusy):
+        executor.submit(release.wait)
+    release.set()
+    await asyncio.gather(*running)
+    assert await executor.run(sum, [1, 2]) == 3
+    assert (executor.pending, executor.completed, executor.rejected, executor.wait_count) == (0, 3, 1, 3)
+    executor.shutdown()
+
+
+@pytest.mark.asyncio
+async def test_archive_executor_without_pending_limit() -> None:
+    executor = ArchiveExecutor(max_workers=1, max_pending=None)
+    release = threading.Event()
+    running = [executor.submit(release.wait) for _ in range(100)]
+    assert executor.pending == 100
+    release.set()
+    await asyncio.gather(*running)
+    assert (executor.pending, executor.completed, executor.rejected) == (0, 100, 0)
+    executor.shutdown()
+
+
+@pytest.mark.asyncio
+async def test_byte_pipe_between_thread_and_event_loop() -> None:
+    pipe = BytePipe(4)
+
+    def produce() -> None:
+        for i in range(100):
+            pipe.write(bytes([i]) * 3)
+        pipe.close()
+
+    producer = asyncio.create_task(asyncio.to_thread(produce))
+    data = bytearray()
+    while chunk := await pipe.read_async(5):
+        data += chunk
+    await producer
+    assert data == b"".join(bytes([i]) * 3 for i in range(100))
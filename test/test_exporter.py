@@ -0,0 +1,67 @@
+import httpx
+import pytest
+from fastapi import FastAPI
+from httpx import ASGITransport, AsyncClient
+from prometheus_client import REGISTRY, generate_latest
+
+from zjbs_tasker.exporter import (
+    UNMATCHED_ROUTE,
+    RequestMetricsMiddleware,
+    WorkerCollector,
+    record_transfer,
+    worker_exporter,
+)
+
+
+@pytest.mark.asyncio
+async def test_request_metrics_middleware() -> None:
+    app = FastAPI()
+    app.add_middleware(RequestMetricsMiddleware)
+
+    @app.post("/GetTask/{task_id}")
+    async def get_task(task_id: int) -> int:
+        return task_id
+
+    async with AsyncClient(transport=ASGITransport(app=app), base_url="http://test") as client:
+        for task_id in (1, 2):
+            assert (await client.post(f"/GetTask/{task_id}")).status_code == 200
+        assert (await client.post("/Missing")).status_code == 404
+
+    labels = {"method": "POST", "route": "/GetTask/{task_id}", "status": "200"}
+    assert REGISTRY.get_sample_value("tasker_http_request_duration_seconds_count", labels) == 2
+    labels = {"method": "POST", "route": UNMATCHED_ROUTE, "status": "404"}
+    assert REGISTRY.get_sample_value("tasker_http_request_duration_seconds_count", labels) == 1
+
+
+def test_record_transfer() -> None:
+    before = REGISTRY.get_sample_value("tasker_file_transfer_bytes_total", {"direction": "upload"})
+    record_transfer("upload", 1000, 0.2)
+    assert REGISTRY.get_sample_value("tasker_file_transfer_bytes_total", {"direction": "upload"}) == before + 1000
+
+
+class IdleWorker:
+    slots = 4
+
+    @staticmethod
+    def running_jobs() -> int:
+        return 1
+
+
+def test_worker_collector() -> None:
+    collector = WorkerCollector(IdleWorker())
+    REGISTRY.register(collector)
+    try:
+        assert REGISTRY.get_sample_value("tasker_worker_slots") == 4
+        assert REGISTRY.get_sample_value("tasker_worker_busy_slots") == 1
+        assert REGISTRY.get_sample_value("tasker_artifact_cache_hits_total") is not None
+        assert b"tasker_prefetch_bytes_total" in generate_latest(REGISTRY)
+    finally:
+        REGISTRY.unregister(collector)
+
+
+def test_worker_exporter() -> None:
+    with worker_exporter(IdleWorker(), 0) as port:
+        response = httpx.get(f"http://127.0.0.1:{port}/metrics")
+        assert b"tasker_worker_busy_slots 1.0" in response.content
+    # 退出后停止服务器并注销指标
+    assert REGISTRY.get_sample_value("tasker_worker_slots") is None
@@ -0,0 +1,116 @@
+import pytest
+from rq.job import Job
+
+from zjbs_tasker.fair_queue import PRIORITY_META, SHARE_META, FairQueue, share_weight
+from zjbs_tasker.server import redis_connection
+from zjbs_tasker.settings import settings
+
+fakeredis = pytest.importorskip("fakeredis")
+
+
+@pytest.fixture
+def queue() -> FairQueue:
+    return FairQueue("tasker:small", connection=fakeredis.FakeRedis())
+
+
+def enqueue(queue: FairQueue, name: str, share: str = "default", priority: int = 0) -> Job:
+    return queue.enqueue_call(
+        "builtins.print", args=(name,), job_id=name, meta={PRIORITY_META: priority, SHARE_META: share}
+    )
+
+
+def pop_all(queue: FairQueue) -> list[str]:
+    job_ids = []
+    while (job_id := queue.pop_job_id()) is not None:
+        job_ids.append(job_id)
+    return job_ids
+
+
+def test_share_weight(monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr(settings, "FAIR_SHARE_WEIGHTS", {"owner:alice": 4, "owner:bob": 0})
+    assert share_weight("owner:alice") == 4
+    assert share_weight("owner:bob") == 1
+    assert share_weight("template:1") == settings.FAIR_SHARE_DEFAULT_WEIGHT
+
+
+def test_fair_queue_keys() -> None:
+    queue = FairQueue("tasker:small", connection=redis_connection)
+    assert queue.fair_prefix == "tasker:fair:tasker:small:"
+    assert queue.wakeup_key == "tasker:fair:tasker:small:wakeup"
+
+
+def test_fair_queue_pops_higher_priority_first(queue: FairQueue) -> None:
+    enqueue(queue, "low", priority=0)
+    enqueue(queue, "high", priority=5)
+    enqueue(queue, "negative", priority=-1)
+    enqueue(queue, "high-2", priority=5)
+    assert queue.count == 4
+    assert pop_all(queue) == ["high", "high-2", "low", "negative"]
+    assert queue.count == 0
+
+
+def test_fair_queue_rotates_shares_by_weight(queue: FairQueue, monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr(settings, "FAIR_SHARE_WEIGHTS", {"owner:alice": 2})
+    for i in range(5):
+        enqueue(queue, f"alice-{i}", "owner:alice")
+    for i in range(3):
+        enqueue(queue, f"bob-{i}", "owner:bob")
+    assert pop_all(queue) == [
+        "alice-0",
+        "alice-1",
+        "bob-0",
+        "alice-2",
+        "alice-3",
+        "bob-1",
+        "alice-4",
+        "bob-2",
+    ]
+
+
+def test_fair_queue_share_rejoins_ring_at_the_end(queue: FairQueue) -> None:
+    enqueue(queue, "a-0", "a")
+    enqueue(queue, "b-0", "b")
+    assert queue.pop_job_id() == "a-0"
+    # a 的列表已经为空，重新入队时排在 b 之后
+    enqueue(queue, "a-1", "a")
+    enqueue(queue, "b-1", "b")
+    assert pop_all(queue) == ["b-0", "a-1", "b-1"]
+
+
+def test_fair_queue_pops_plain_list_first(queue: FairQueue) -> None:
+    enqueue(queue, "fair")
+    # 调度器到期的作业直接推入 rq 的列表
+    queue.connection.rpush(queue.key, "scheduled")
+    assert queue.count == 2
+    assert queue.get_job_ids() == ["scheduled", "fair"]
+    assert pop_all(queue) == ["scheduled", "fair"]
+
+
+def test_fair_queue_remove(queue: FairQueue) -> None:
+    enqueue(queue, "a-0", "a")
+    enqueue(queue, "b-0", "b")
+    enqueue(queue, "b-1", "b")
+    queue.remove("a-0")
+    assert queue.count == 2
+    # 移除后份额只在轮转队列中出现一次，不会得到额外的轮次
+    enqueue(queue, "a-1", "a")
+    enqueue(queue, "a-2", "a")
+    assert queue.connection.lrange(queue.fair_prefix + "0:ring", 0, -1) == [b"b", b"a"]
+    assert pop_all(queue) == ["b-0", "a-1", "b-1", "a-2"]
+
+
+def test_fair_queue_get_job_ids_with_offset(queue: FairQueue) -> None:
+    for i in range(3):
+        queue.connection.rpush(queue.key, f"plain-{i}")
+    for i in range(2):
+        enqueue(queue, f"a-{i}", "a")
+        enqueue(queue, f"b-{i}", "b")
+    job_ids = queue.get_job_ids()
+    assert job_ids == ["plain-0", "plain-1", "plain-2", "a-0", "b-0", "a-1", "b-1"]
+    assert [queue.get_job_ids(offset, 2) for offset in range(0, 7, 2)] == [
+        job_ids[0:2],
+        job_ids[2:4],
+        job_ids[4:6],
+        job_ids[6:7],
+    ]
+    assert queue.get_job_ids(1, 0) == []
@@ -0,0 +1,54 @@
+import pytest
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.sql import Select
+
+from zjbs_tasker.db import Task, TaskInterpreter, TaskRun, TaskTemplate, database, select_matched_ids
+from zjbs_tasker.task_run import select_task_runs, select_task_specs
+
+
+# 禁止顺序扫描后查看查询计划，确认查询可以使用索引
+async def explain(query: Select) -> str:
+    sql = query.compile(dialect=postgresql.dialect(), compile_kwargs={"literal_binds": True})
+    async with database.connection() as connection:
+        async with connection.transaction(force_rollback=True):
+            await connection.execute("SET LOCAL enable_seqscan = off")
+            rows = await connection.fetch_all(f"EXPLAIN {sql}")
+    return "\n".join(row[0] for row in rows)
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize(
+    "query, index",
+    [
+        (lambda: select_task_runs(1, TaskRun.Status.failed, after_index=10), "ix_task_run_task_index"),
+        (lambda: select_task_specs([1, 2, 3]), "ix_task_run_task_index"),
+        (
+            lambda: TaskInterpreter.objects.filter(is_deleted=False, id__gt=10)
+            .order_by("id")
+            .limit(11)
+            .build_select_expression(),
+            "ix_task_interpreter_active_id",
+        ),
+        # 列表接口按名称搜索时使用的查询
+        (
+            lambda: select_matched_ids(TaskInterpreter.objects.filter(is_deleted=False, name__icontains="fmri"), 0, 11),
+            "ix_task_interpreter_active_name_trgm",
+        ),
+        (
+            lambda: select_matched_ids(TaskTemplate.objects.filter(is_deleted=False, name__icontains="fmri"), 0, 11),
+            "ix_task_template_active_name_trgm",
+        ),
+        (
+            lambda: TaskTemplate.objects.filter(is_deleted=False, interpreter=1).build_select_expression(),
+            "ix_task_template_interpreter",
+        ),
+        (lambda: Task.objects.filter(template=1).build_select_expression(), "ix_task_by_template"),
+    ],
+)
+async def test_query_uses_index(db: None, query, index: str) -> None:
+    # 只有 pg_trgm 扩展不可用时才没有名称搜索的索引，其他索引缺失说明迁移有问题
+    if index.endswith("_trgm") and not await database.fetch_val(
+        "SELECT EXISTS (SELECT 1 FROM pg_available_extensions WHERE name = 'pg_trgm')"
+    ):
+        pytest.skip("pg_trgm extension is not available")
+    assert index in await explain(query())
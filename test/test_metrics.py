@@ -0,0 +1,52 @@
+import asyncio
+import sys
+from pathlib import Path
+
+import pytest
+
+from zjbs_tasker.metrics import current_metrics, read_rusage, record_phase, wrap_command
+from zjbs_tasker.model import TaskRunMetrics
+
+
+def test_record_phase() -> None:
+    with record_phase("exec"):
+        pass
+    metrics = TaskRunMetrics()
+    token = current_metrics.set(metrics)
+    try:
+        for _ in range(2):
+            with record_phase("download:template"):
+                pass
+    finally:
+        current_metrics.reset(token)
+    assert list(metrics.phases) == ["download:template"]
+
+
+@pytest.mark.asyncio
+async def test_wrap_command_records_rusage(tmp_path: Path) -> None:
+    rusage_path = tmp_path / "rusage.json"
+    script = "import sys; data = bytearray(64 * 1024 * 1024); sys.exit(3)"
+    exe, args = wrap_command(sys.executable, ["-c", script], rusage_path)
+    process = await asyncio.create_subprocess_exec(exe, *args)
+    assert await process.wait() == 3
+
+    metrics = TaskRunMetrics()
+    read_rusage(metrics, rusage_path)
+    assert metrics.max_rss_bytes >= 64 * 1024 * 1024
+    assert metrics.cpu_user_seconds is not None
+
+
+@pytest.mark.asyncio
+async def test_wrap_command_keeps_signal_and_missing_executable(tmp_path: Path) -> None:
+    exe, args = wrap_command(
+        sys.executable, ["-c", "import os, signal; os.kill(os.getpid(), signal.SIGTERM)"], tmp_path / "a.json"
+    )
+    process = await asyncio.create_subprocess_exec(exe, *args)
+    assert await process.wait() == -15
+
+    exe, args = wrap_command(str(tmp_path / "missing"), [], tmp_path / "b.json")
+    process = await asyncio.create_subprocess_exec(exe, *args, stderr=asyncio.subprocess.DEVNULL)
+    assert await process.wait() == 127
+    metrics = TaskRunMetrics()
+    read_rusage(metrics, tmp_path / "b.json")
+    assert metrics.max_rss_bytes is None
@@ -0,0 +1,113 @@
+import asyncio
+
+import pytest
+from pydantic import BaseModel
+
+from zjbs_tasker.api import template as template_module
+from zjbs_tasker.api.template import get_task_template, update_task_template
+from zjbs_tasker.db import TaskInterpreter, TaskTemplate
+from zjbs_tasker.model_cache import ModelCache, handle_invalidation
+
+
+class Item(BaseModel):
+    id: int
+    name: str
+
+
+class Loader:
+    def __init__(self) -> None:
+        self.names = {1: "a", 2: "b", 3: "c"}
+        self.loads = 0
+
+    async def __call__(self, id_: int) -> Item | None:
+        self.loads += 1
+        name = self.names.get(id_)
+        return Item(id=id_, name=name) if name is not None else None
+
+
+@pytest.mark.asyncio
+async def test_model_cache_hit_and_miss() -> None:
+    cache = ModelCache("test-hit", Item, max_size=10, ttl=60, shared=False)
+    load = Loader()
+    assert (await cache.get(1, load)).name == "a"
+    assert (await cache.get(1, load)).name == "a"
+    assert await cache.get(4, load) is None
+    assert await cache.get(4, load) is None
+    assert (cache.hits, cache.misses, load.loads) == (1, 3, 3)
+
+
+@pytest.mark.asyncio
+async def test_model_cache_evicts_least_recently_used() -> None:
+    cache = ModelCache("test-lru", Item, max_size=2, ttl=60, shared=False)
+    load = Loader()
+    for id_ in (1, 2, 1, 3):
+        await cache.get(id_, load)
+    assert len(cache) == 2
+    await cache.get(1, load)
+    await cache.get(2, load)
+    assert load.loads == 4
+
+
+@pytest.mark.asyncio
+async def test_model_cache_expires_entries() -> None:
+    cache = ModelCache("test-ttl", Item, max_size=10, ttl=0.05, shared=False)
+    load = Loader()
+    await cache.get(1, load)
+    await asyncio.sleep(0.1)
+    await cache.get(1, load)
+    assert load.loads == 2
+
+
+@pytest.mark.asyncio
+async def test_model_cache_invalidate() -> None:
+    cache = ModelCache("test-invalidate", Item, max_size=10, ttl=60, shared=False)
+    load = Loader()
+    await cache.get(1, load)
+    load.names[1] = "x"
+    # Redis 不可用时也会删除本地缓存项
+    await cache.invalidate(1)
+    assert (await cache.get(1, load)).name == "x"
+
+    load.names[1] = "y"
+    handle_invalidation("test-invalidate:1")
+    assert (await cache.get(1, load)).name == "y"
+
+
+@pytest.mark.asyncio
+async def test_model_cache_does_not_store_stale_load() -> None:
+    cache = ModelCache("test-stale", Item, max_size=10, ttl=60, shared=False)
+    load = Loader()
+
+    # 读取数据库期间记录被修改
+    async def load_then_modify(id_: int) -> Item | None:
+        item = await load(id_)
+        load.names[id_] = "x"
+        cache.discard(id_)
+        return item
+
+    assert (await cache.get(1, load_then_modify)).name == "a"
+    assert (await cache.get(1, load)).name == "x"
+
+
+@pytest.mark.asyncio
+async def test_update_task_template_invalidates_before_rename(db: None, monkeypatch: pytest.MonkeyPatch) -> None:
+    interpreter = await TaskInterpreter.objects.create(
+        name="test-cache", description="", has_executable=False, type="executable", executable=[], environment={}
+    )
+    template = await TaskTemplate.objects.create(
+        interpreter=interpreter, name="test-cache", description="", has_script=True, arguments=[], environment={}
+    )
+    try:
+        assert (await get_task_template(template.id)).name == "test-cache"
+
+        async def fail_rename(*args) -> None:
+            raise OSError("file server is not available")
+
+        monkeypatch.setattr(template_module, "rename", fail_rename)
+        with pytest.raises(OSError):
+            await update_task_template(template.id, name="test-cache-renamed")
+        # 重命名脚本失败时数据库已经修改，缓存中不能是修改前的模板
+        assert (await get_task_template(template.id)).name == "test-cache-renamed"
+    finally:
+        await template.delete()
+        await interpreter.delete()
@@ -0,0 +1,58 @@
+import asyncio
+import io
+
+import pytest
+from redis import asyncio as async_redis
+from redis.asyncio.retry import Retry
+from redis.backoff import NoBackoff
+
+from zjbs_tasker.output import OutputStream, is_stream_id, sse_event, tee_output
+
+
+def test_sse_event() -> None:
+    assert sse_event("stdout", "a\nb", "1-0") == 'id: 1-0\nevent: stdout\ndata: "a\\nb"\n\n'
+    assert sse_event("end", {"return_code": None}) == 'event: end\ndata: {"return_code": null}\n\n'
+
+
+def test_is_stream_id() -> None:
+    assert is_stream_id("1700000000000-0")
+    assert not is_stream_id("$")
+    assert not is_stream_id("1-x")
+    assert not is_stream_id(f"{2**64}-0")
+
+
+@pytest.mark.asyncio
+async def test_tee_output_without_redis() -> None:
+    # Redis 不可用时仍然写入文件
+    async with async_redis.Redis(host="127.0.0.1", port=1, socket_connect_timeout=1) as redis:
+        output = OutputStream(redis, 1, max_len=10, ttl=60, queue_size=10)
+        reader = asyncio.StreamReader()
+        reader.feed_data("输出\n".encode() * 100)
+        reader.feed_eof()
+        file = io.BytesIO()
+        await tee_output(reader, file, "stdout", output, chunk_size=7)
+        await output.close(0)
+    assert file.getvalue() == "输出\n".encode() * 100
+
+
+@pytest.mark.asyncio
+async def test_tee_output_with_hanging_redis() -> None:
+    # Redis 接受连接但是不响应时，读取输出不被阻塞，结束时最多等待客户端的超时时间
+    async def hang(reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        await reader.read()
+
+    server = await asyncio.start_server(hang, "127.0.0.1", 0)
+    port = server.sockets[0].getsockname()[1]
+    async with (
+        server,
+        async_redis.Redis(host="127.0.0.1", port=port, socket_timeout=0.1, retry=Retry(NoBackoff(), 0)) as redis,
+    ):
+        output = OutputStream(redis, 1, max_len=10, ttl=60, queue_size=4)
+        reader = asyncio.StreamReader()
+        reader.feed_data(b"x" * 1000)
+        reader.feed_eof()
+        file = io.BytesIO()
+        await asyncio.wait_for(tee_output(reader, file, "stdout", output, chunk_size=10), timeout=0.1)
+        await asyncio.wait_for(output.close(0), timeout=10)
+    assert file.getvalue() == b"x" * 1000
+    assert output.dropped > 0
@@ -0,0 +1,46 @@
+import pytest
+import pytest_asyncio
+
+from zjbs_tasker.api.interpreter import list_task_interpreters, list_task_interpreters_page
+from zjbs_tasker.db import TaskInterpreter
+
+NAME = "test-pagination"
+
+
+# 测试创建的解释器，测试结束后从共用的数据库中删除
+@pytest_asyncio.fixture
+async def interpreters(db: None) -> list[TaskInterpreter]:
+    created = [
+        await TaskInterpreter.objects.create(
+            name=NAME, description="", has_executable=False, type="executable", executable=[], environment={}
+        )
+        for _ in range(5)
+    ]
+    yield created
+    await TaskInterpreter.objects.filter(name=NAME).delete()
+
+
+@pytest.mark.asyncio
+async def test_list_task_interpreters_with_cursor(interpreters: list[TaskInterpreter]) -> None:
+    ids = []
+    cursor = None
+    while True:
+        page = await list_task_interpreters_page(name=NAME, cursor=cursor, limit=2, with_total=True)
+        assert page.total == 5 and not page.total_estimated
+        ids.extend(interpreter.id for interpreter in page.items)
+        if page.next_cursor is None:
+            break
+        cursor = page.next_cursor
+    assert ids == [interpreter.id for interpreter in interpreters]
+
+    unfiltered = await list_task_interpreters_page(limit=1, with_total=True)
+    assert unfiltered.total is not None
+
+
+@pytest.mark.asyncio
+async def test_list_task_interpreters_returns_list(interpreters: list[TaskInterpreter]) -> None:
+    # 原来的接口仍然返回列表
+    items = await list_task_interpreters(name=NAME, offset=1, limit=2)
+    assert [interpreter.id for interpreter in items] == [interpreter.id for interpreter in interpreters[1:3]]
+    items = await list_task_interpreters(name=NAME, cursor=interpreters[3].id)
+    assert [interpreter.id for interpreter in items] == [interpreters[4].id]
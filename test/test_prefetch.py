@@ -0,0 +1,45 @@
+import pytest
+
+from zjbs_tasker.model import ExecutionSpec
+from zjbs_tasker.prefetch import Prefetcher, PrefetchInput
+
+
+def make_spec(task_id: int) -> ExecutionSpec:
+    return ExecutionSpec(task_id=task_id, task_name=f"task-{task_id}", index=0, command=["run"], environment={})
+
+
+@pytest.mark.asyncio
+async def test_prefetcher_hits_budget_and_discard() -> None:
+    queued = [(1, make_spec(1)), (2, make_spec(2)), (3, make_spec(3))]
+    fetched: list[str] = []
+    discarded: list[str] = []
+
+    def inputs(spec: ExecutionSpec) -> list[PrefetchInput]:
+        key = f"source/{spec.task_id}"
+
+        async def fetch() -> int:
+            fetched.append(key)
+            return 100
+
+        return [PrefetchInput(key, fetch, lambda: discarded.append(key))]
+
+    prefetcher = Prefetcher(depth=3, max_size=200, peek=lambda count: queued[:count], inputs=inputs)
+    prefetcher.schedule()
+    await prefetcher.claim("source/1")
+    await prefetcher._task
+
+    # 超过磁盘上限时不再预取
+    assert fetched == ["source/1", "source/2"]
+    assert prefetcher.skipped == 1
+    assert await prefetcher.claim("source/1")
+    assert not await prefetcher.claim("source/3")
+    assert prefetcher.hits == 1
+
+    # 不再在队列中的输入被丢弃
+    queued = [(3, make_spec(3))]
+    prefetcher.schedule()
+    await prefetcher._task
+    assert discarded == ["source/2"]
+    assert fetched == ["source/1", "source/2", "source/3"]
+    assert prefetcher.wanted("source/3")
+    assert prefetcher.pending_size == 100
@@ -0,0 +1,36 @@
+import pytest
+from databases import Database
+from fastapi import Depends, FastAPI
+from httpx import ASGITransport, AsyncClient
+
+from zjbs_tasker.db import RoutingDatabase, use_read_replica
+from zjbs_tasker.settings import settings
+
+
+@pytest.mark.asyncio
+async def test_read_replica_routing() -> None:
+    database = RoutingDatabase(settings.DATABASE_URL, settings.DATABASE_URL, min_size=1, max_size=1)
+    app = FastAPI()
+
+    def used(db: Database) -> bool:
+        return database.connection()._backend is db._backend
+
+    @app.post("/Write")
+    async def write() -> bool:
+        return used(database)
+
+    @app.post("/Read", dependencies=[Depends(use_read_replica)])
+    async def read() -> list[bool]:
+        # 同一个请求中的查询都使用只读副本
+        return [used(database.replica), used(database.replica)]
+
+    # ASGITransport 在测试的上下文中处理请求，只读接口设置的标记会保留到之后的请求，因此最后请求只读接口
+    async with AsyncClient(transport=ASGITransport(app=app), base_url="http://test") as client:
+        await database.replica.connect()
+        try:
+            assert (await client.post("/Write")).json() is True
+            assert (await client.post("/Read")).json() == [True, True]
+        finally:
+            await database.replica.disconnect()
+        # 没有连接只读副本时使用主库
+        assert (await client.post("/Read")).json() == [False, False]
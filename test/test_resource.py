@@ -0,0 +1,70 @@
+import shutil
+
+import pytest
+from rq import Queue
+from rq.job import Job
+
+from zjbs_tasker import resource
+from zjbs_tasker.model import ResourceRequirement
+from zjbs_tasker.resource import job_requirement, queue_names_for_capacity, resource_class_for
+from zjbs_tasker.runtime import TaskerWorker, expand_queues
+from zjbs_tasker.server import redis_connection
+from zjbs_tasker.settings import settings
+
+GiB = 1024**3
+
+
+def test_resource_class_for() -> None:
+    assert resource_class_for(ResourceRequirement()).name == "small"
+    assert resource_class_for(ResourceRequirement(cpu=2)).name == "medium"
+    assert resource_class_for(ResourceRequirement(cpu=1, memory=100 * GiB)).name == "large"
+    assert resource_class_for(ResourceRequirement(cpu=1000)) is None
+
+
+def test_queue_names_for_capacity() -> None:
+    assert queue_names_for_capacity(ResourceRequirement(cpu=16, memory=64 * GiB, disk=1024 * GiB)) == [
+        "tasker",
+        "tasker:medium",
+        "tasker:small",
+    ]
+    # 容量小于最小类别的上限时仍然运行最小类别的作业
+    assert queue_names_for_capacity(ResourceRequirement(cpu=64, memory=2 * GiB, disk=1024 * GiB)) == [
+        "tasker",
+        "tasker:small",
+    ]
+
+
+def test_expand_queues() -> None:
+    all_queues = ["tasker", "tasker:large", "tasker:medium", "tasker:small"]
+    assert expand_queues(["tasker", "other"]) == [*all_queues, "other"]
+    assert expand_queues([Queue("tasker", connection=redis_connection)]) == all_queues
+
+
+def test_worker_rechecks_free_disk(monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr(settings, "WORKER_CPU", 16)
+    monkeypatch.setattr(settings, "WORKER_MEMORY", 64 * GiB)
+    monkeypatch.setattr(settings, "WORKER_DISK", 0)
+    free_disk = 1024 * GiB
+    monkeypatch.setattr(resource.shutil, "disk_usage", lambda path: shutil._ntuple_diskusage(0, 0, free_disk))
+    fakeredis = pytest.importorskip("fakeredis")
+    worker = TaskerWorker(["tasker"], connection=fakeredis.FakeRedis())
+
+    def eligible_queue_names() -> list[str]:
+        capacity = worker.capacity
+        return [queue.name for queue in worker.eligible_queues(capacity, capacity)]
+
+    assert eligible_queue_names() == [worker.worker_queue.name, "tasker", "tasker:medium", "tasker:small"]
+    # 磁盘剩余空间减少后不再运行中等类别的作业，但仍然运行最小类别的作业
+    free_disk = 10 * GiB
+    assert eligible_queue_names() == [worker.worker_queue.name, "tasker", "tasker:small"]
+
+
+def test_job_requirement() -> None:
+    job = Job.create("zjbs_tasker.worker.execute_task_run", args=(1,), connection=redis_connection)
+    assert job_requirement(job) == ResourceRequirement()
+    job = Job.create(
+        "zjbs_tasker.worker.execute_task_run",
+        args=(1, {"resources": {"cpu": 8, "memory": GiB, "disk": 0}}),
+        connection=redis_connection,
+    )
+    assert job_requirement(job) == ResourceRequirement(cpu=8, memory=GiB)
@@ -0,0 +1,63 @@
+import threading
+
+import pytest
+from rq.job import JobStatus
+
+from zjbs_tasker import runtime as runtime_module
+from zjbs_tasker.fair_queue import FairQueue
+from zjbs_tasker.runtime import ConcurrentTaskerWorker, TaskerWorker, WorkerRuntime
+
+fakeredis = pytest.importorskip("fakeredis")
+
+# 作业执行时使用的运行时，测试结束后检查是否已经关闭
+runtimes: list[WorkerRuntime] = []
+
+
+async def current_thread_name() -> str:
+    runtimes.append(runtime_module.runtime)
+    return threading.current_thread().name
+
+
+async def fail() -> None:
+    raise RuntimeError("job failed")
+
+
+# 在 burst 模式下运行工作进程直到队列为空，数据库不可用时跳过测试
+def work(worker: TaskerWorker, **kwargs) -> None:
+    try:
+        worker.work(burst=True, **kwargs)
+    except OSError as e:
+        pytest.skip(f"database is not available: {e}")
+
+
+@pytest.mark.parametrize("worker_class", [TaskerWorker, ConcurrentTaskerWorker])
+def test_worker_runs_jobs_on_shared_loop(worker_class: type[TaskerWorker]) -> None:
+    runtimes.clear()
+    connection = fakeredis.FakeRedis()
+    queue = FairQueue("tasker:small", connection=connection)
+    jobs = [queue.enqueue(current_thread_name), queue.enqueue(fail), queue.enqueue(current_thread_name)]
+
+    worker = worker_class(["tasker"], connection=connection)
+    work(worker)
+
+    # 作业中的异常只让该作业失败，之后的作业仍然在同一个事件循环中执行
+    assert [job.get_status(refresh=True) for job in jobs] == [JobStatus.FINISHED, JobStatus.FAILED, JobStatus.FINISHED]
+    assert [jobs[0].return_value(), jobs[2].return_value()] == ["tasker-runtime", "tasker-runtime"]
+    assert len(runtimes) == 2 and runtimes[0] is runtimes[1]
+
+    # 退出时关闭事件循环和它的线程
+    assert runtime_module.runtime is None
+    assert runtimes[0].loop.is_closed()
+    assert not runtimes[0]._thread.is_alive()
+
+
+def test_concurrent_worker_max_jobs_waits_for_dispatched_jobs() -> None:
+    connection = fakeredis.FakeRedis()
+    queue = FairQueue("tasker:small", connection=connection)
+    jobs = [queue.enqueue(current_thread_name) for _ in range(3)]
+
+    worker = ConcurrentTaskerWorker(["tasker"], connection=connection)
+    work(worker, max_jobs=2)
+
+    # 取出两个作业后不再取出新的作业，退出前等待它们执行完
+    assert [job.get_status(refresh=True) for job in jobs] == [JobStatus.FINISHED, JobStatus.FINISHED, JobStatus.QUEUED]
@@ -0,0 +1,221 @@
+import asyncio
+import contextvars
+from datetime import datetime
+
+import pytest
+from ormar import NoMatch
+
+from zjbs_tasker import task_run as task_run_module
+from zjbs_tasker import worker as worker_module
+from zjbs_tasker.api import aggregate_task_run_metrics, list_task_runs
+from zjbs_tasker.db import Task, TaskInterpreter, TaskRun, TaskTemplate
+from zjbs_tasker.model import ExecutionSpec, ResourceRequirement, TaskRunMetrics
+from zjbs_tasker.settings import settings
+from zjbs_tasker.task_run import (
+    build_execution_spec,
+    cancel_active_task_runs,
+    create_retry_task_run,
+    retry_delay,
+    save_task_run_metrics,
+    start_task_runs,
+)
+from zjbs_tasker.worker import execute_task_run
+
+
+async def create_task() -> Task:
+    interpreter = await TaskInterpreter.objects.create(
+        name="test", description="", has_executable=False, type="executable", executable=[], environment={}
+    )
+    template = await TaskTemplate.objects.create(
+        name="test", description="", has_script=False, arguments=[], environment={}, interpreter=interpreter
+    )
+    return await Task.objects.create(
+        name="test",
+        description="",
+        has_source_file=False,
+        arguments=[],
+        environment={},
+        retry_times=0,
+        template=template,
+    )
+
+
+@pytest.mark.asyncio
+async def test_start_task_runs(db: None, monkeypatch: pytest.MonkeyPatch) -> None:
+    enqueued: list[tuple[int, ExecutionSpec]] = []
+    monkeypatch.setattr(task_run_module, "enqueue_task_runs", enqueued.extend)
+    task = await create_task()
+
+    results = await start_task_runs([task.id, 2**31 - 1, task.id])
+    assert [result.index for result in results] == [0, None, 1]
+    assert results[1].error == "task not found"
+    assert [task_run_id for task_run_id, _ in enqueued] == [results[0].task_run_id, results[2].task_run_id]
+    task_run = await TaskRun.objects.get(id=results[2].task_run_id)
+    assert (task_run.task.id, task_run.index, task_run.status) == (task.id, 1, TaskRun.Status.pending)
+    assert ExecutionSpec.parse_obj(task_run.spec) == enqueued[1][1]
+
+
+@pytest.mark.asyncio
+async def test_concurrent_start_task_runs_use_distinct_indexes(db: None, monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr(task_run_module, "enqueue_task_runs", lambda task_runs: None)
+    task = await create_task()
+    (result,) = await start_task_runs([task.id])
+    spec = ExecutionSpec.parse_obj((await TaskRun.objects.get(id=result.task_run_id)).spec)
+
+    # 每个协程使用新的上下文，和请求一样使用各自的数据库连接
+    coroutines = [start_task_runs([task.id, task.id]) for _ in range(5)] + [
+        create_retry_task_run(spec) for _ in range(5)
+    ]
+    results = await asyncio.gather(
+        *[asyncio.create_task(coroutine, context=contextvars.Context()) for coroutine in coroutines]
+    )
+    indexes = [result.index for batch in results[:5] for result in batch] + [spec.index for _, spec in results[5:]]
+    assert sorted(indexes) == list(range(1, 16))
+
+
+@pytest.mark.asyncio
+async def test_create_retry_task_run(db: None, monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr(task_run_module, "enqueue_task_runs", lambda task_runs: None)
+    task = await create_task()
+    (result,) = await start_task_runs([task.id])
+    spec = ExecutionSpec.parse_obj((await TaskRun.objects.get(id=result.task_run_id)).spec)
+
+    retry_id, retry_spec = await create_retry_task_run(spec)
+    assert (retry_spec.index, retry_spec.attempt) == (1, 1)
+    task_run = await TaskRun.objects.get(id=retry_id)
+    assert (task_run.index, task_run.status) == (1, TaskRun.Status.pending)
+    assert ExecutionSpec.parse_obj(task_run.spec) == retry_spec
+
+
+@pytest.mark.asyncio
+async def test_cancel_active_task_runs(db: None, monkeypatch: pytest.MonkeyPatch) -> None:
+    removed: list[int] = []
+    monkeypatch.setattr(task_run_module, "remove_task_run_jobs", removed.extend)
+    task = await create_task()
+    for index, status in enumerate([TaskRun.Status.pending, TaskRun.Status.running, TaskRun.Status.success]):
+        await TaskRun.objects.create(task=task, index=index, status=status)
+
+    canceled = await cancel_active_task_runs(task_id=task.id)
+    assert sorted(removed) == sorted(canceled)
+    task_runs = await TaskRun.objects.filter(task=task.id).order_by("index").all()
+    assert [task_run.id for task_run in task_runs[:2]] == sorted(canceled)
+    assert [task_run.status for task_run in task_runs] == [
+        TaskRun.Status.canceled,
+        TaskRun.Status.canceled,
+        TaskRun.Status.success,
+    ]
+    assert all(task_run.end_at is not None for task_run in task_runs[:2])
+    assert await cancel_active_task_runs([task_runs[0].id]) == []
+
+
+@pytest.mark.asyncio
+async def test_aggregate_task_run_metrics(db: None) -> None:
+    task = await create_task()
+    for index, exec_seconds in enumerate([1.0, 3.0]):
+        task_run = await TaskRun.objects.create(task=task, index=index, status=TaskRun.Status.success)
+        await save_task_run_metrics(
+            task_run.id, TaskRunMetrics(phases={"exec": exec_seconds}, bytes_downloaded=100, max_rss_bytes=None)
+        )
+
+    summaries = {summary.name: summary for summary in await aggregate_task_run_metrics(task_id=task.id)}
+    assert (summaries["phase:exec"].count, summaries["phase:exec"].mean, summaries["phase:exec"].max) == (2, 2.0, 3.0)
+    assert summaries["bytes_downloaded"].total == 200
+    assert "max_rss_bytes" not in summaries
+
+
+@pytest.mark.asyncio
+async def test_execute_task_run_fails_when_download_fails(
+    db: None, file_server: dict[str, bytes], monkeypatch: pytest.MonkeyPatch
+) -> None:
+    monkeypatch.setattr(task_run_module, "enqueue_task_runs", lambda task_runs: None)
+    retried: list[int] = []
+
+    async def retry_task_run(task_run_id: int, spec: ExecutionSpec) -> None:
+        retried.append(task_run_id)
+
+    monkeypatch.setattr(worker_module, "retry_task_run", retry_task_run)
+    task = await create_task()
+    await task.update(has_source_file=True)
+    (result,) = await start_task_runs([task.id])
+    spec = (await TaskRun.objects.get(id=result.task_run_id)).spec
+
+    # 文件服务器上没有源文件，下载失败
+    with pytest.raises(Exception):
+        await execute_task_run(result.task_run_id, spec)
+    task_run = await TaskRun.objects.get(id=result.task_run_id)
+    assert task_run.status == TaskRun.Status.failed and task_run.end_at is not None
+    assert retried == [result.task_run_id]
+
+
+def test_retry_delay(monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr(settings, "TASK_RETRY_BACKOFF_SECONDS", 10)
+    monkeypatch.setattr(settings, "TASK_RETRY_BACKOFF_MAX_SECONDS", 60)
+    assert [retry_delay(attempt) for attempt in range(1, 5)] == [10, 20, 40, 60]
+
+
+@pytest.mark.asyncio
+async def test_list_task_runs(db: None) -> None:
+    task = await create_task()
+    for index, status in enumerate([TaskRun.Status.failed, TaskRun.Status.success, TaskRun.Status.failed]):
+        await TaskRun.objects.create(task=task, index=index, status=status)
+    await TaskRun.objects.create(task=task, index=3, status=TaskRun.Status.failed, is_deleted=True)
+
+    first_page = await list_task_runs(task.id, limit=2)
+    assert [task_run.index for task_run in first_page] == [0, 1]
+    next_page = await list_task_runs(task.id, after_index=first_page[-1].index, limit=2)
+    assert [task_run.index for task_run in next_page] == [2]
+    failed = await list_task_runs(task.id, status=TaskRun.Status.failed)
+    assert [task_run.index for task_run in failed] == [0, 2]
+    assert await list_task_runs(task.id, updated_since=max(task_run.modified_at for task_run in failed)) == []
+
+    await task.update(["is_deleted"], is_deleted=True)
+    with pytest.raises(NoMatch):
+        await list_task_runs(task.id)
+
+
+def test_build_execution_spec() -> None:
+    row = {
+        "task_id": 3,
+        "task_name": "sub-01",
+        "has_source_file": True,
+        "source_compress_method": "tzst",
+        "task_arguments": ["--subject", "01"],
+        "task_environment": {"THREADS": 4},
+        "task_cpu": 4,
+        "task_memory": None,
+        "task_disk": None,
+        "retry_times": 2,
+        "template_id": 2,
+        "template_name": "fmriprep",
+        "has_script": True,
+        "script_hash": None,
+        "script_compress_method": "txz",
+        "template_modified_at": datetime(2023, 10, 1, 12, 0, 0),
+        "template_arguments": ["run.py"],
+        "template_environment": {"THREADS": 1, "MODE": "fast"},
+        "template_cpu": 1,
+        "template_memory": 16 * 1024**3,
+        "template_disk": None,
+        "interpreter_id": 1,
+        "interpreter_name": "python",
+        "has_executable": True,
+        "executable_hash": "abc",
+        "executable_compress_method": "txz",
+        "interpreter_modified_at": datetime(2023, 9, 1),
+        "interpreter_executable": ["bin/python"],
+        "interpreter_environment": {"PYTHONUNBUFFERED": "1"},
+    }
+    spec = build_execution_spec(row, 5)
+    assert spec.command == ["bin/python", "run.py", "--subject", "01"]
+    assert spec.environment == {"PYTHONUNBUFFERED": "1", "THREADS": "4", "MODE": "fast"}
+    assert spec.interpreter.cache_key == "interpreter/1_abc"
+    assert spec.template.cache_key == "template/2_20231001120000000000"
+    assert spec.template.server_path == "/tasker/template/2_fmriprep.txz"
+    assert spec.source.server_path == "/tasker/task/3_sub-01/source.tzst"
+    assert spec.resources == ResourceRequirement(cpu=4, memory=16 * 1024**3, disk=0)
+    assert (spec.retry_times, spec.attempt) == (2, 0)
+    assert spec.priority == 0
+    assert spec.share == "template:2"
+    spec = build_execution_spec(row, 5, priority=10, owner="alice")
+    assert spec.priority == 10
+    assert spec.share == "owner:alice"
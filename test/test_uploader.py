@@ -0,0 +1,45 @@
+import json
+import os
+import time
+from pathlib import Path
+
+import pytest
+
+from zjbs_tasker.uploader import MANIFEST_FILENAME, ResultUploader
+
+
+@pytest.mark.asyncio
+async def test_result_uploader_uploads_only_delta(file_server: dict[str, bytes], tmp_path: Path) -> None:
+    (tmp_path / "sub-01").mkdir()
+    done_file = tmp_path / "sub-01" / "bold.nii"
+    done_file.write_bytes(b"a" * 100)
+    old = time.time_ns() - 60 * 10**9
+    os.utime(done_file, ns=(old, old))
+    (tmp_path / "stdout.txt").write_text("running")
+
+    uploader = ResultUploader(tmp_path, "/task/1_t/run_0", quiescent_seconds=30, scan_interval=1, concurrency=2)
+    await uploader.upload_changed(quiescent_before=time.time_ns() - 30 * 10**9)
+    assert set(file_server) == {"/task/1_t/run_0/sub-01/bold.nii"}
+
+    (tmp_path / "stdout.txt").write_text("finished")
+    await uploader.finish()
+    assert uploader.files_uploaded == 2
+    assert file_server["/task/1_t/run_0/stdout.txt"] == b"finished"
+    manifest = json.loads(file_server[f"/task/1_t/run_0/{MANIFEST_FILENAME}"])
+    assert [file["path"] for file in manifest["files"]] == ["stdout.txt", "sub-01/bold.nii"]
+
+
+@pytest.mark.asyncio
+async def test_result_uploader_drops_removed_files(file_server: dict[str, bytes], tmp_path: Path) -> None:
+    temp_file = tmp_path / "partial.tmp"
+    temp_file.write_bytes(b"a" * 100)
+    uploader = ResultUploader(tmp_path, "/task/1_t/run_0", quiescent_seconds=30, scan_interval=1, concurrency=2)
+    await uploader.upload_changed(quiescent_before=time.time_ns())
+    assert "/task/1_t/run_0/partial.tmp" in file_server
+
+    # 任务把后台上传过的文件重命名
+    temp_file.rename(tmp_path / "result.nii")
+    await uploader.finish()
+    assert set(file_server) == {"/task/1_t/run_0/result.nii", f"/task/1_t/run_0/{MANIFEST_FILENAME}"}
+    manifest = json.loads(file_server[f"/task/1_t/run_0/{MANIFEST_FILENAME}"])
+    assert [file["path"] for file in manifest["files"]] == ["result.nii"]
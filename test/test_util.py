@@ -0,0 +1,157 @@
+import io
+import os
+import tarfile
+import zipfile
+from pathlib import Path
+
+import pytest
+from fastapi import FastAPI, HTTPException
+from httpx import ASGITransport, AsyncClient, HTTPStatusError
+from zjbs_file_client import async_client as file_client_module
+
+from zjbs_tasker.model import CompressMethod
+from zjbs_tasker.settings import settings
+from zjbs_tasker.util import extract_tar_stream, upload_file
+
+
+def read_tar(data: bytes) -> dict[str, bytes]:
+    with tarfile.open(fileobj=io.BytesIO(data), mode="r:xz") as tar_file:
+        return {member.name: tar_file.extractfile(member).read() if member.isreg() else None for member in tar_file}
+
+
+@pytest.mark.asyncio
+async def test_upload_txz_is_forwarded_unchanged(file_server: dict[str, bytes]) -> None:
+    pack = io.BytesIO()
+    with tarfile.open(fileobj=pack, mode="w:xz") as tar_file:
+        info = tarfile.TarInfo("bin/run.sh")
+        info.size = 4
+        tar_file.addfile(info, io.BytesIO(b"echo"))
+
+    await upload_file(io.BytesIO(pack.getvalue()), "pack.txz", CompressMethod.txz, "/tasker/template", "1_test")
+    assert file_server["/tasker/template/1_test.txz"] == pack.getvalue()
+
+
+@pytest.mark.asyncio
+async def test_upload_zip_is_transcoded(file_server: dict[str, bytes]) -> None:
+    pack = io.BytesIO()
+    with zipfile.ZipFile(pack, "w") as zip_file:
+        zip_file.writestr("data/a.txt", b"hello")
+
+    await upload_file(pack, "pack.zip", CompressMethod.zip, "/tasker/task/1_test", "source")
+    files = read_tar(file_server["/tasker/task/1_test/source.txz"])
+    assert files["source/data/a.txt"] == b"hello"
+
+
+@pytest.mark.asyncio
+async def test_upload_single_file(file_server: dict[str, bytes], tmp_path: Path) -> None:
+    await upload_file(io.BytesIO(b"x" * 10), "input.csv", CompressMethod.not_compressed, "/tasker/task/1_t", "source")
+    assert read_tar(file_server["/tasker/task/1_t/source.txz"])["source/input.csv"] == b"x" * 10
+
+
+@pytest.mark.asyncio
+async def test_upload_rejects_unsafe_path(file_server: dict[str, bytes]) -> None:
+    pack = io.BytesIO()
+    with tarfile.open(fileobj=pack, mode="w:xz") as tar_file:
+        info = tarfile.TarInfo("../escape.sh")
+        info.size = 0
+        tar_file.addfile(info, io.BytesIO())
+    pack.seek(0)
+
+    with pytest.raises(HTTPException):
+        await upload_file(pack, "pack.txz", CompressMethod.txz, "/tasker/template", "1_test")
+    assert not file_server
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize(
+    "link_type, name, linkname",
+    [
+        (tarfile.SYMTYPE, "link", "/etc"),
+        (tarfile.SYMTYPE, "link", "../etc"),
+        (tarfile.SYMTYPE, "link", "a/../../etc"),
+        (tarfile.SYMTYPE, "lib/link", "../../etc"),
+        (tarfile.LNKTYPE, "lib/link", "../etc"),
+    ],
+)
+async def test_upload_rejects_unsafe_link(
+    file_server: dict[str, bytes], link_type: bytes, name: str, linkname: str
+) -> None:
+    pack = io.BytesIO()
+    with tarfile.open(fileobj=pack, mode="w:xz") as tar_file:
+        link = tarfile.TarInfo(name)
+        link.type = link_type
+        link.linkname = linkname
+        tar_file.addfile(link)
+        info = tarfile.TarInfo(f"{name}/passwd")
+        info.size = 0
+        tar_file.addfile(info, io.BytesIO())
+    pack.seek(0)
+
+    with pytest.raises(HTTPException):
+        await upload_file(pack, "pack.txz", CompressMethod.txz, "/tasker/template", "1_test")
+    assert not file_server
+
+
+@pytest.mark.asyncio
+async def test_upload_accepts_relative_link_inside_pack(file_server: dict[str, bytes]) -> None:
+    pack = io.BytesIO()
+    with tarfile.open(fileobj=pack, mode="w:xz") as tar_file:
+        info = tarfile.TarInfo("env/lib64/libfoo.so.1")
+        info.size = 0
+        tar_file.addfile(info, io.BytesIO())
+        # conda 环境中常见的指向同级目录的链接
+        link = tarfile.TarInfo("env/lib/libfoo.so")
+        link.type = tarfile.SYMTYPE
+        link.linkname = "../lib64/libfoo.so.1"
+        tar_file.addfile(link)
+
+    await upload_file(io.BytesIO(pack.getvalue()), "pack.txz", CompressMethod.txz, "/tasker/interpreter", "1_env")
+    assert file_server["/tasker/interpreter/1_env.txz"] == pack.getvalue()
+
+
+@pytest.mark.asyncio
+async def test_upload_reports_file_server_error(monkeypatch: pytest.MonkeyPatch) -> None:
+    file_server_app = FastAPI()
+
+    @file_server_app.post("/upload-file")
+    async def upload() -> None:
+        raise HTTPException(status_code=507, detail="disk full")
+
+    monkeypatch.setattr(settings, "UPLOAD_BUFFER_SIZE", 1024)
+    monkeypatch.setattr(
+        file_client_module,
+        "client",
+        AsyncClient(transport=ASGITransport(app=file_server_app), base_url="http://file-server"),
+    )
+    # 上传失败时压缩包还没有生成完，生成压缩包的线程写入管道失败
+    with pytest.raises(HTTPStatusError) as exc_info:
+        await upload_file(
+            io.BytesIO(os.urandom(1024 * 1024)), "input.bin", CompressMethod.not_compressed, "/task", "source", "tar"
+        )
+    assert exc_info.value.response.status_code == 507
+
+
+def test_extract_rejects_link_outside_target(tmp_path: Path) -> None:
+    pack = io.BytesIO()
+    with tarfile.open(fileobj=pack, mode="w") as tar_file:
+        link = tarfile.TarInfo("link")
+        link.type = tarfile.SYMTYPE
+        link.linkname = str(tmp_path)
+        tar_file.addfile(link)
+    pack.seek(0)
+
+    with pytest.raises(tarfile.TarError):
+        extract_tar_stream(pack, CompressMethod.tar, tmp_path / "target")
+    assert not (tmp_path / "target" / "link").exists()
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("pack_compress_method", [CompressMethod.tar, CompressMethod.tgz, CompressMethod.tzst])
+async def test_upload_with_pack_compress_method(
+    file_server: dict[str, bytes], tmp_path: Path, pack_compress_method: CompressMethod
+) -> None:
+    await upload_file(
+        io.BytesIO(b"x" * 10), "input.csv", CompressMethod.not_compressed, "/task", "source", pack_compress_method
+    )
+    extract_tar_stream(io.BytesIO(file_server[f"/task/source.{pack_compress_method}"]), pack_compress_method, tmp_path)
+    assert (tmp_path / "source" / "input.csv").read_bytes() == b"x" * 10
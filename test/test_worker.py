@@ -1,12 +1,15 @@
+import asyncio
 from pathlib import Path
 
+import pytest
 from fastapi.testclient import TestClient
+from loguru import logger
 from rq import Worker
 from rq.job import JobStatus
 
 from zjbs_tasker.db import TaskInterpreter
 from zjbs_tasker.server import queue
-from zjbs_tasker.worker import execute_task_run
+from zjbs_tasker.worker import context_logger, execute_task_run
 
 cwd = Path(__file__).parent
 data_dir = cwd / "data"
@@ -76,3 +79,18 @@ def test_worker(client: TestClient, rq_worker: Worker) -> None:
     job = queue.enqueue_call(execute_task_run, [task_run_id], timeout=10)
     rq_worker.work(burst=True)
     assert job.get_status(refresh=True) == JobStatus.FINISHED
+
+
+@pytest.mark.asyncio
+async def test_context_logger_isolates_concurrent_runs(tmp_path: Path) -> None:
+    async def run(task_run_id: int) -> None:
+        with context_logger(tmp_path / f"{task_run_id}.log", "INFO", task_run_id):
+            for i in range(3):
+                logger.info(f"run {task_run_id} step {i}")
+                await asyncio.sleep(0)
+
+    await asyncio.gather(run(1), run(2))
+    for task_run_id in (1, 2):
+        lines = (tmp_path / f"{task_run_id}.log").read_text().splitlines()
+        assert len(lines) == 3
+        assert all(f"run {task_run_id} step" in line for line in lines)